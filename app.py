@@ -8,17 +8,35 @@ import os
 import io
 import base64
 import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
 from pathlib import Path
 from PIL import Image
 import numpy as np
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
 # Import local modules
-from utils.image_utils import resize_keep_aspect, match_histogram
-from utils.lut_generator import LUTGenerator
+from utils.image_utils import (load_preview, encode_image, match_histogram, blend_images,
+                               matched_strength_curves, lab_transfer_coefficients, reinhard_transfer,
+                               PREVIEW_FORMATS)
+from utils.analysis import ImageAnalysis
+from utils.lut_generator import (LUTGenerator, apply_lut, cube_bytes, fit_error_comment, identity_lut,
+                                 lut_from_curves, read_fit_error)
+from utils.cache import ArtifactCache, LRUCache, content_hash
+from utils.image_store import ImageStore
+from utils.jobs import JobQueue, QueueFull
+from utils import metrics
+from utils.metrics import span
+from utils.presets import PRESETS
+from utils import batch
+from utils.render import (ChannelCurves, LabTransfer, LUTTransform, OUTPUT_FORMATS, open_rgb,
+                          render_full_resolution)
 
 app = Flask(__name__, template_folder='web/templates', static_folder='web/static')
 CORS(app)
@@ -27,12 +45,57 @@ CORS(app)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'web/uploads'
 app.config['SECRET_KEY'] = 'lutor-secret-key-change-me' # It's good practice to change this
+app.config['PREVIEW_SIZE'] = 800  # longer side of the working preview
+app.config['PREVIEW_FORMAT'] = 'jpeg'  # 'jpeg' or 'webp'; requests may override with preview_format
+app.config['PREVIEW_QUALITY'] = 85
+app.config['STYLE_CACHE_MAX_ENTRIES'] = 64
+app.config['STYLE_CACHE_MAX_BYTES'] = 32 * 1024 * 1024
+app.config['MATCHED_CACHE_MAX_ENTRIES'] = 16
+app.config['MATCHED_CACHE_MAX_BYTES'] = 128 * 1024 * 1024
+app.config['CURVES_CACHE_MAX_ENTRIES'] = 1024
+app.config['ANALYSIS_CACHE_MAX_ENTRIES'] = 32
+app.config['ANALYSIS_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+app.config['IMAGE_STORE_MAX_BYTES'] = 512 * 1024 * 1024
+app.config['IMAGE_STORE_TTL'] = 2 * 60 * 60  # seconds since last access
+app.config['IMAGE_STORE_SPILL_FOLDER'] = 'web/uploads/image_store'
+app.config['ORIGINALS_FOLDER'] = 'web/uploads/originals'  # full-resolution uploads
+app.config['ORIGINALS_SWEEP_INTERVAL'] = 60  # seconds between scans for expired originals
+app.config['EXPORT_FOLDER'] = 'web/uploads/exports'
+app.config['BATCH_FOLDER'] = 'web/uploads/batch'
+app.config['BATCH_MAX_WORKERS'] = os.cpu_count() or 1
+app.config['VIDEO_FOLDER'] = 'web/uploads/video'  # clips are graded here, then deleted
+app.config['VIDEO_QUEUE_FRAMES'] = 8  # frames buffered between decode, grade and encode
+app.config['ARTIFACT_CACHE_MAX_ENTRIES'] = 256
+app.config['ARTIFACT_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+app.config['ARTIFACT_FOLDER'] = 'web/uploads/artifacts'  # disk tier; None keeps exports in memory only
+app.config['ARTIFACT_FOLDER_MAX_BYTES'] = 512 * 1024 * 1024
+app.config['PRESET_FOLDER'] = 'presets'  # extra preset images / .cube LUTs, if present
+app.config['PROFILE_FOLDER'] = 'web/uploads/profiles'  # set LUTOR_PROFILE=0.05 to profile 5% of requests
+app.config['JOB_MAX_WORKERS'] = 2
+app.config['JOB_MAX_PENDING'] = 32
+app.config['JOB_RESULT_TTL'] = 60 * 60  # seconds finished jobs stay downloadable
+app.config['LUT_SIZES'] = (17, 33, 64, 65)
+app.config['LUT_FIT_METHOD'] = 'nearest'  # or 'splat'; requests may pick either with fit_method
+app.config['PREVIEW_LUT_SIZE'] = 33  # grid of the client preview LUT for looks that are not per-channel
 
 # --- GLOBAL VARIABLES ---
-lut_generator = None
+style_cache = None  # style image hash -> per-channel histogram CDFs; ('lab', hash) -> LAB mean/std
+matched_cache = None  # (content key, style key) -> histogram-matched content
+curves_cache = None  # stylized image key -> the look's per-channel curves, for exact LUT export
+analysis_cache = None  # image key -> ImageAnalysis shared by style transfer and exports
+image_store = None  # image ID -> decoded upload
+job_queue = None  # background exports
+artifact_cache = None  # export hash -> generated .cube/.xmp bytes
+preset_previews = {}  # preset style key (ID and file version) -> base64 preview
+profiler = None  # sampled cProfile hook, see LUTOR_PROFILE
+lut_generators = {}  # (LUT size, fit method) -> LUTGenerator, built on first use
+startup_seconds = None  # time init_app took
+originals_swept = float('-inf')  # monotonic time of the last expired-originals sweep
+originals_sweep_lock = threading.Lock()
 
 # --- HELPER FUNCTIONS ---
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
+VIDEO_FORMATS = {'mp4': ('.mp4', 'video/mp4'), 'avi': ('.avi', 'video/x-msvideo')}
 
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension."""
@@ -40,26 +103,393 @@ def allowed_file(filename):
 
 def init_app():
     """Initializes the application components."""
-    global lut_generator
+    global style_cache, matched_cache, curves_cache, analysis_cache, image_store, job_queue
+    global artifact_cache, profiler, startup_seconds
+    start = time.perf_counter()
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    lut_generator = LUTGenerator(lut_size=64)
-    print("✅ LUT Generator initialized successfully.")
+    os.makedirs(app.config['ORIGINALS_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['BATCH_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['VIDEO_FOLDER'], exist_ok=True)
+    style_cache = LRUCache(max_entries=app.config['STYLE_CACHE_MAX_ENTRIES'],
+                           max_bytes=app.config['STYLE_CACHE_MAX_BYTES'])
+    matched_cache = LRUCache(max_entries=app.config['MATCHED_CACHE_MAX_ENTRIES'],
+                             max_bytes=app.config['MATCHED_CACHE_MAX_BYTES'])
+    curves_cache = LRUCache(max_entries=app.config['CURVES_CACHE_MAX_ENTRIES'])
+    analysis_cache = LRUCache(max_entries=app.config['ANALYSIS_CACHE_MAX_ENTRIES'],
+                              max_bytes=app.config['ANALYSIS_CACHE_MAX_BYTES'])
+    image_store = ImageStore(max_bytes=app.config['IMAGE_STORE_MAX_BYTES'],
+                             ttl=app.config['IMAGE_STORE_TTL'],
+                             spill_dir=app.config['IMAGE_STORE_SPILL_FOLDER'])
+    artifact_cache = ArtifactCache(max_entries=app.config['ARTIFACT_CACHE_MAX_ENTRIES'],
+                                   max_bytes=app.config['ARTIFACT_CACHE_MAX_BYTES'],
+                                   disk_dir=app.config['ARTIFACT_FOLDER'],
+                                   max_disk_bytes=app.config['ARTIFACT_FOLDER_MAX_BYTES'])
+    job_queue = JobQueue(max_workers=app.config['JOB_MAX_WORKERS'],
+                         max_pending=app.config['JOB_MAX_PENDING'],
+                         finished_ttl=app.config['JOB_RESULT_TTL'])
+    if os.path.isdir(app.config['PRESET_FOLDER']):
+        added = PRESETS.load_directory(app.config['PRESET_FOLDER'])
+        print(f"🎨 Registered {len(added)} preset(s) from {app.config['PRESET_FOLDER']}")
+    profiler = metrics.RequestProfiler.from_env(app.config['PROFILE_FOLDER'])
+    if profiler is not None:
+        print(f"🔬 Profiling {profiler.rate:.0%} of requests into {profiler.output_dir}")
+    startup_seconds = time.perf_counter() - start
+    print(f"✅ LUT Generator initialized successfully in {startup_seconds * 1000:.0f}ms.")
+
+def init_process():
+    """Gives a forked serving process an image store of its own, spilling to a folder of its own."""
+    global image_store
+    image_store = ImageStore(max_bytes=app.config['IMAGE_STORE_MAX_BYTES'],
+                             ttl=app.config['IMAGE_STORE_TTL'],
+                             spill_dir=os.path.join(app.config['IMAGE_STORE_SPILL_FOLDER'], str(os.getpid())))
+
+def warm_shared():
+    """Builds read-only preset tables and identity LUTs up front, so forked workers share them."""
+    with span('warm'):
+        PRESETS.warm()
+        for lut_size in app.config['LUT_SIZES']:
+            identity_lut(lut_size)
+
+def create_app(config=None):
+    """WSGI app factory: applies config overrides, initializes and warms shared data."""
+    if config:
+        app.config.update(config)
+    init_app()
+    warm_shared()
+    return app
+
+def image_to_base64(image, fmt=None):
+    """Convert a PIL Image to a base64 data URI for web display."""
+    with span('encode'):
+        data, mimetype = encode_image(image, fmt or app.config['PREVIEW_FORMAT'],
+                                      app.config['PREVIEW_QUALITY'])
+        img_str = base64.b64encode(data).decode()
+    return f"data:{mimetype};base64,{img_str}"
+
+def preview_format(values, field='preview_format'):
+    """Preview encoding requested by the client, or the configured default."""
+    fmt = values.get(field)
+    return fmt if fmt in PREVIEW_FORMATS else app.config['PREVIEW_FORMAT']
+
+def wants_inline(values):
+    """False when the client asked for image URLs instead of base64 payloads."""
+    return str(values.get('inline', 'true')).lower() not in ('false', '0', 'no')
+
+def image_url(image_id, fmt):
+    return f'/api/images/{image_id}?format={fmt}'
 
-def image_to_base64(image):
-    """Convert a PIL Image to a base64 string for web display."""
-    buffered = io.BytesIO()
-    image.save(buffered, format="JPEG", quality=85)
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return f"data:image/jpeg;base64,{img_str}"
 
 def base64_to_image(base64_string):
     """Convert a base64 string back to a PIL Image."""
     if base64_string.startswith('data:image'):
         base64_string = base64_string.split(',')[1]
-    image_data = base64.b64decode(base64_string)
-    image = Image.open(io.BytesIO(image_data)).convert('RGB')
+    with span('b64decode'):
+        image_data = base64.b64decode(base64_string)
+    with span('decode'):
+        image = Image.open(io.BytesIO(image_data)).convert('RGB')
     return image
 
+class ImageNotFound(Exception):
+    """Raised when a request refers to an unknown or expired image ID."""
+
+def request_image_key(data, field):
+    """Identify a request image by its store ID, or by a hash of its base64 payload."""
+    image_id = data.get(f'{field}_id')
+    if image_id:
+        return f'id:{image_id}'
+    if data.get(field):
+        return content_hash(data[field])
+    return None
+
+def load_request_image(data, field):
+    """Load an image sent either as `<field>_id` or as a base64 `<field>`."""
+    image_id = data.get(f'{field}_id')
+    if image_id:
+        with span('store_get'):
+            image = image_store.get_image(image_id)
+        if image is None:
+            raise ImageNotFound(image_id)
+        return image
+    if data.get(field):
+        return base64_to_image(data[field])
+    return None
+
+def image_analysis(key, load_image):
+    """Return an image's shared ImageAnalysis, loading and scanning it only on a cache miss."""
+    def analyze():
+        with span('analysis'):
+            return ImageAnalysis(load_image())
+    return analysis_cache.get_or_compute(key, analyze)
+
+def request_analysis(data, field):
+    """Shared analysis of an image sent as `<field>_id` or base64 `<field>`, or None."""
+    key = request_image_key(data, field)
+    if key is None:
+        return None
+    return image_analysis(key, lambda: load_request_image(data, field))
+
+def get_style_cdfs(key, load_style):
+    """Return the style image's histogram CDFs, loading it only on a cache miss."""
+    return style_cache.get_or_compute(key, lambda: image_analysis(key, load_style).cdfs())
+
+def get_style_lab_stats(key, load_style):
+    """Return the style image's LAB mean and std, the only style data reinhard mode needs."""
+    def compute():
+        analysis = image_analysis(key, load_style)
+        return analysis.lab_mean, analysis.lab_std
+    return style_cache.get_or_compute(('lab', key), compute)
+
+def preview_lut(data, content_key, preset, style_key, mode):
+    """Full-strength look of a content/style pair as a LUT: (256, 3) if per-channel, else a 3D grid."""
+    def content():
+        return image_analysis(content_key, lambda: load_request_image(data, 'content_image'))
+    if mode == 'histogram' and (preset is None or not preset.has_lut):
+        style_cdfs = preset.cdfs() if preset else \
+            get_style_cdfs(style_key, lambda: load_request_image(data, 'style_image'))
+        return lut_from_curves(matched_strength_curves(content().histograms, style_cdfs, 1.0, quantize=True))
+    size = app.config['PREVIEW_LUT_SIZE']
+    grid = np.ascontiguousarray(identity_lut(size).reshape(size * size, size, 3))
+    if preset is not None and preset.has_lut:
+        graded = apply_lut(grid, preset.lut(), 'tetrahedral', workers=1)
+    else:
+        style_stats = preset.lab_stats() if preset else \
+            get_style_lab_stats(style_key, lambda: load_request_image(data, 'style_image'))
+        analysis = content()
+        scale, offset = lab_transfer_coefficients((analysis.lab_mean, analysis.lab_std), style_stats)
+        graded = LabTransfer(scale, offset).graded(grid)
+    return graded.reshape(size, size, size, 3)
+
+def request_transfer_mode(data):
+    """Style transfer algorithm: 'histogram' matching (default) or 'reinhard' LAB statistics."""
+    mode = data.get('transfer_mode', 'histogram')
+    if mode not in batch.TRANSFER_MODES:
+        raise ValueError(f'Unknown transfer mode {mode}, expected one of {batch.TRANSFER_MODES}')
+    return mode
+
+def request_style_spec(form, work_dir, strength, method, mode):
+    """Batch style spec from an uploaded image or LUT, a preset ID or a stored image, or None."""
+    if 'style' in request.files:
+        style_file = request.files['style']
+        style_path = work_dir / f"style{Path(secure_filename(style_file.filename)).suffix.lower()}"
+        style_file.save(style_path)
+        return batch.load_style(str(style_path), strength, method, mode)
+    if form.get('style_id') in PRESETS:
+        return batch.style_spec_from_preset(PRESETS.get(form['style_id']), strength, method, mode)
+    if form.get('style_image_id'):
+        style_img = image_store.get_image(form['style_image_id'])
+        if style_img is None:
+            raise ImageNotFound(form['style_image_id'])
+        return batch.style_spec_from_image(style_img, strength, mode)
+    return None
+
+class UnknownPreset(ValueError):
+    """Raised when a request names a preset that is not registered."""
+
+def request_preset(data):
+    """Return the registered preset named by `style_preset_id`, if any."""
+    preset_id = data.get('style_preset_id')
+    if not preset_id:
+        return None
+    preset = PRESETS.get(preset_id)
+    if preset is None:
+        raise UnknownPreset(f'Unknown style ID: {preset_id}')
+    return preset
+
+def preset_style_key(preset):
+    """Cache key for a preset's style; directory-loaded presets change with their files."""
+    version = preset.version
+    return f'preset:{preset.id}' if version is None else f'preset:{preset.id}@{version}'
+
+def get_lut_generator(lut_size, method=None):
+    """Return a LUTGenerator for a supported LUT size and fit method."""
+    lut_size = int(lut_size)
+    method = method or app.config['LUT_FIT_METHOD']
+    if lut_size not in app.config['LUT_SIZES']:
+        raise ValueError(f'Unsupported LUT size {lut_size}, expected one of {app.config["LUT_SIZES"]}')
+    key = (lut_size, method)
+    if key not in lut_generators:
+        lut_generators[key] = LUTGenerator(lut_size=lut_size, method=method)
+    return lut_generators[key]
+
+LUT_TYPES = ('3d', '1d')
+
+def request_curves(data):
+    """Per-channel curves of the request's stylized image, if it is a separable look we made."""
+    lut_type = data.get('lut_type', '3d')
+    if lut_type not in LUT_TYPES:
+        raise ValueError(f'Unknown LUT type {lut_type}, expected one of {LUT_TYPES}')
+    key = request_image_key(data, 'stylized_image')
+    curves = curves_cache.get(key) if key else None
+    if curves is None and lut_type == '1d':
+        raise ValueError('1D LUTs are only available for histogram-matched looks')
+    return curves
+
+def curves_cube_bytes(curves, lut_type, lut_size):
+    """Serialize a separable look exactly, as a 1D LUT or a 3D LUT of lut_size."""
+    with span('lut_curves'):
+        lut = lut_from_curves(curves, None if lut_type == '1d' else lut_size)
+    return cube_bytes(lut, comments=['Exact per-channel curves of the histogram-matched look'])
+
+def fit_cube_bytes(generator, original, stylized, progress=None):
+    """Fit a LUT to two image analyses and serialize it, recording the fit error in the .cube header."""
+    lut = generator.fit_lut_from_analysis(original, stylized, progress=progress)
+    error = generator.fit_error(lut, *original.paired_samples(stylized))
+    return cube_bytes(lut, comments=[fit_error_comment(error, generator.method)])
+
+ARTIFACT_TYPES = {
+    'cube': ('text/plain', 'lutor_style.cube'),
+    'xmp': ('application/rdf+xml', 'lutor_style.xmp'),
+    'lut16': ('application/octet-stream', 'lutor_preview.lut16'),
+}
+
+def artifact_key(data, kind, *params):
+    """Content-addressed name for an export of the request's image pair, also used as its ETag."""
+    original_key = request_image_key(data, 'original_image')
+    stylized_key = request_image_key(data, 'stylized_image')
+    if original_key is None or stylized_key is None:
+        return None
+    return f"{content_hash(kind, original_key, stylized_key, *params)}.{kind}"
+
+def send_artifact(key, data):
+    """Send a generated export from memory, tagged with its content-addressed ETag."""
+    mimetype, download_name = ARTIFACT_TYPES[key.rsplit('.', 1)[-1]]
+    response = send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=True,
+                         download_name=download_name, etag=False)
+    response.set_etag(key)
+    response.headers['X-Artifact-Key'] = key
+    if key.endswith('.cube'):
+        fit_error = read_fit_error(data)
+        if fit_error is not None:
+            response.headers['X-LUT-Fit-Error'] = fit_error
+    return response
+
+def not_modified(key):
+    """304 for a client that already holds this export."""
+    response = Response(status=304)
+    response.set_etag(key)
+    return response
+
+def save_original(image_id, filename, data):
+    """Keep the full-resolution upload behind its preview's image ID."""
+    folder = Path(app.config['ORIGINALS_FOLDER'])
+    ext = Path(secure_filename(filename)).suffix.lower()
+    path = folder / f'{image_id}{ext}'
+    if path.exists():
+        # Re-upload of a live image: restart its age like the preview's
+        os.utime(path)
+    else:
+        path.write_bytes(data)
+    
+    sweep_originals()
+
+def sweep_originals():
+    """Drops originals whose previews have long expired, at most once per ORIGINALS_SWEEP_INTERVAL."""
+    global originals_swept
+    now = time.monotonic()
+    if now - originals_swept < app.config['ORIGINALS_SWEEP_INTERVAL'] or not originals_sweep_lock.acquire(False):
+        return
+    try:
+        originals_swept = now
+        cutoff = time.time() - app.config['IMAGE_STORE_TTL']
+        for old in Path(app.config['ORIGINALS_FOLDER']).iterdir():
+            try:
+                if old.stat().st_mtime < cutoff:
+                    old.unlink()
+            except OSError:
+                pass
+    finally:
+        originals_sweep_lock.release()
+
+def find_original(image_id):
+    """Path of the full-resolution upload for an image ID, or None; finding it refreshes its age."""
+    if not image_id:
+        return None
+    path = next(Path(app.config['ORIGINALS_FOLDER']).glob(f'{secure_filename(image_id)}.*'), None)
+    if path is not None:
+        try:
+            os.utime(path)
+        except OSError:
+            return None  # pruned meanwhile
+    return path
+
+def image_not_found_response(e):
+    """410 response telling the client to resend the image as base64."""
+    return jsonify({'error': f'Unknown or expired image ID: {e}', 'expired': True}), 410
+
+# --- INSTRUMENTATION ---
+REQUESTS = metrics.Counter('lutor_requests_total', 'HTTP requests by endpoint, method and status',
+                           ['endpoint', 'method', 'status'])
+REQUEST_SECONDS = metrics.Histogram('lutor_request_seconds',
+                                    'Time to produce a response, excluding streamed bodies', ['endpoint'])
+REQUESTS_IN_FLIGHT = metrics.Gauge('lutor_requests_in_flight', 'Requests being handled')
+
+def request_endpoint():
+    """Route pattern of the current request, keeping metric labels low-cardinality."""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    metrics.start_request()
+    REQUESTS_IN_FLIGHT.inc()
+    if profiler is not None:
+        profiler.start()
+
+@app.after_request
+def add_server_timing(response):
+    """Reports per-stage timings in a Server-Timing header."""
+    total = time.perf_counter() - g.request_start
+    endpoint = request_endpoint()
+    REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    REQUEST_SECONDS.observe(total, endpoint)
+    response.headers['Server-Timing'] = metrics.server_timing(metrics.end_request(), total)
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    REQUESTS_IN_FLIGHT.dec()
+    if profiler is not None:
+        profiler.stop(request_endpoint())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Exposes request, stage, cache and job metrics in Prometheus text format."""
+    caches = {
+        'style': style_cache.stats(),
+        'matched': matched_cache.stats(),
+        'curves': curves_cache.stats(),
+        'analysis': analysis_cache.stats(),
+        'artifact': artifact_cache.stats(),
+        'image_store': image_store.stats(),
+    }
+    jobs = job_queue.stats()
+    
+    def per_cache(field):
+        return [((name,), stats[field]) for name, stats in caches.items()]
+    
+    hit_ratios = [((name,), stats['hits'] / (stats['hits'] + stats['misses'])
+                   if stats['hits'] + stats['misses'] else 0.0) for name, stats in caches.items()]
+    lines = (REQUESTS.render() + REQUEST_SECONDS.render() + REQUESTS_IN_FLIGHT.render()
+             + metrics.STAGE_SECONDS.render()
+             + metrics.metric_lines('lutor_cache_hits_total', 'Cache hits', per_cache('hits'),
+                                    ['cache'], kind='counter')
+             + metrics.metric_lines('lutor_cache_misses_total', 'Cache misses', per_cache('misses'),
+                                    ['cache'], kind='counter')
+             + metrics.metric_lines('lutor_cache_hit_ratio', 'Cache hit ratio since startup',
+                                    hit_ratios, ['cache'])
+             + metrics.metric_lines('lutor_cache_entries', 'Entries held in memory',
+                                    per_cache('entries'), ['cache'])
+             + metrics.metric_lines('lutor_cache_bytes', 'Bytes held in memory',
+                                    per_cache('bytes'), ['cache'])
+             + metrics.metric_lines('lutor_jobs', 'Background jobs by status',
+                                    [((status,), count) for status, count in jobs.items()], ['status'])
+             + metrics.metric_lines('lutor_jobs_in_flight', 'Background jobs queued or running',
+                                    [((), jobs['queued'] + jobs['running'])])
+             + metrics.metric_lines('lutor_startup_seconds', 'Time init_app took in this process',
+                                    [((), round(startup_seconds or 0.0, 6))]))
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 # --- API ENDPOINTS ---
 @app.route('/')
 def index():
@@ -78,16 +508,25 @@ def upload_file():
             return jsonify({'error': 'No file selected'}), 400
         
         if file and allowed_file(file.filename):
-            image = Image.open(file.stream).convert('RGB')
-            # Resize for a consistent preview size
-            preview_image = resize_keep_aspect(image, 800)
-            image_b64 = image_to_base64(preview_image)
+            file_data = file.stream.read()
+            fmt = preview_format(request.form)
+            # Decode straight to a consistent preview size
+            with span('decode'):
+                preview_image, full_size = load_preview(io.BytesIO(file_data), app.config['PREVIEW_SIZE'])
+            with span('store_put'):
+                image_id = image_store.put(preview_image)
+            with span('save_original'):
+                save_original(image_id, file.filename, file_data)
             
-            return jsonify({
+            result = {
                 'success': True,
-                'image': image_b64,
-                'size': image.size
-            })
+                'image_id': image_id,
+                'image_url': image_url(image_id, fmt),
+                'size': full_size
+            }
+            if wants_inline(request.form):
+                result['image'] = image_to_base64(preview_image, fmt)
+            return jsonify(result)
         else:
             return jsonify({'error': 'Invalid file type'}), 400
     
@@ -95,60 +534,170 @@ def upload_file():
         print(f"🔴 Error in /api/upload: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/images/<image_id>')
+def get_image(image_id):
+    """Serves a stored image as binary JPEG or WebP, without base64 overhead."""
+    fmt = preview_format(request.args, 'format')
+    etag = f'{image_id}.{fmt}'
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    
+    image = image_store.get_image(image_id)
+    if image is None:
+        return image_not_found_response(ImageNotFound(image_id))
+    with span('encode'):
+        data, mimetype = encode_image(image, fmt, app.config['PREVIEW_QUALITY'])
+    
+    # IDs are content hashes, so an ID always names the same pixels
+    response = send_file(io.BytesIO(data), mimetype=mimetype, etag=False,
+                         max_age=app.config['IMAGE_STORE_TTL'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.set_etag(etag)
+    return response
+
 @app.route('/api/style_transfer', methods=['POST'])
 def style_transfer():
-    """Performs color style transfer using histogram matching."""
+    """Performs color style transfer using histogram matching or LAB statistics."""
     try:
         data = request.json
-        content_b64 = data.get('content_image')
-        style_b64 = data.get('style_image')
         strength = float(data.get('strength', 1.0))
+        mode = request_transfer_mode(data)
         
-        if not content_b64 or not style_b64:
+        content_img = load_request_image(data, 'content_image')
+        content_key = request_image_key(data, 'content_image')
+        preset = request_preset(data)
+        style_key = preset_style_key(preset) if preset else request_image_key(data, 'style_image')
+        if content_img is None or style_key is None:
             return jsonify({'error': 'Missing content or style image'}), 400
+        content = image_analysis(content_key, lambda: content_img)
         
-        content_img = base64_to_image(content_b64)
-        style_img = base64_to_image(style_b64)
+        # Strength-only changes reuse the matched result and just re-blend
+        pair_key = (content_key, style_key, mode)
+        color_matched = matched_cache.get(pair_key)
+        if color_matched is None:
+            if preset is not None and preset.has_lut:
+                with span('lut_apply'):
+                    color_matched = np.asarray(apply_lut(np.asarray(content_img), preset.lut(), 'tetrahedral'))
+            elif mode == 'reinhard':
+                # Six numbers describe the style; the content side is one affine pass in LAB
+                with span('style_stats'):
+                    style_stats = preset.lab_stats() if preset else \
+                        get_style_lab_stats(style_key, lambda: load_request_image(data, 'style_image'))
+                with span('reinhard'):
+                    scale, offset = lab_transfer_coefficients((content.lab_mean, content.lab_std), style_stats)
+                    color_matched = reinhard_transfer(content_img, scale, offset)
+            else:
+                with span('style_cdfs'):
+                    style_cdfs = preset.cdfs() if preset else \
+                        get_style_cdfs(style_key, lambda: load_request_image(data, 'style_image'))
+                
+                # Core color transfer logic
+                with span('match'):
+                    color_matched = np.asarray(match_histogram(content_img, None, target_cdfs=style_cdfs,
+                                                               source_counts=content.histograms))
+            matched_cache.put(pair_key, color_matched)
         
-        # Core color transfer logic
-        color_matched_img = match_histogram(content_img, style_img)
-
         # Blend the original with the color-matched image for strength control
-        if content_img.size != color_matched_img.size:
-             color_matched_img = color_matched_img.resize(content_img.size, Image.LANCZOS)
-             
-        stylized_img = Image.blend(content_img, color_matched_img, alpha=strength)
+        with span('blend'):
+            stylized_img = Image.fromarray(blend_images(content_img, color_matched, strength))
         
-        stylized_b64 = image_to_base64(stylized_img)
+        with span('store_put'):
+            stylized_id = image_store.put(stylized_img)
         
-        return jsonify({
+        if mode == 'histogram' and (preset is None or not preset.has_lut):
+            # Histogram matching plus the blend is separable: keep its curves so
+            # LUT exports of this result are exact instead of fitted
+            with span('curves'):
+                style_cdfs = preset.cdfs() if preset else \
+                    get_style_cdfs(style_key, lambda: load_request_image(data, 'style_image'))
+                curves = matched_strength_curves(content.histograms, style_cdfs, strength, quantize=True)
+                curves_cache.put(f'id:{stylized_id}', curves)
+        
+        fmt = preview_format(data)
+        result = {
             'success': True,
-            'stylized_image': stylized_b64
-        })
+            'stylized_image_id': stylized_id,
+            'stylized_image_url': image_url(stylized_id, fmt)
+        }
+        if wants_inline(data):
+            result['stylized_image'] = image_to_base64(stylized_img, fmt)
+        return jsonify(result)
     
+    except ImageNotFound as e:
+        return image_not_found_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"🔴 Error in /api/style_transfer: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/preview_lut', methods=['POST'])
+def preview_lut_export():
+    """Returns the full-strength look as a float16 LUT, so clients can preview strength locally."""
+    try:
+        data = request.json
+        mode = request_transfer_mode(data)
+        preset = request_preset(data)
+        content_key = request_image_key(data, 'content_image')
+        style_key = preset_style_key(preset) if preset else request_image_key(data, 'style_image')
+        if content_key is None or style_key is None:
+            return jsonify({'error': 'Missing content or style image'}), 400
+        key = f"{content_hash('lut16', content_key, style_key, mode, app.config['PREVIEW_LUT_SIZE'])}.lut16"
+        if request.if_none_match.contains(key):
+            return not_modified(key)
+        
+        def generate():
+            with span('preview_lut'):
+                lut = preview_lut(data, content_key, preset, style_key, mode)
+            # Little-endian half floats, C order: [r, g, b, channel] or [value, channel]
+            return np.ascontiguousarray(lut, dtype='<f2').tobytes()
+        
+        lut_bytes = artifact_cache.get_or_compute(key, generate)
+        response = send_artifact(key, lut_bytes)
+        # 256 entries of 3 half floats for a per-channel look, size^3 entries otherwise
+        entries = len(lut_bytes) // 6
+        response.headers['X-LUT-Dimensions'] = '1d' if entries == 256 else '3d'
+        response.headers['X-LUT-Size'] = str(256 if entries == 256 else round(entries ** (1 / 3)))
+        return response
+        
+    except ImageNotFound as e:
+        return image_not_found_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"🔴 Error in /api/preview_lut: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/export_lut', methods=['POST'])
 def export_lut():
     """Generates and exports a 3D LUT (.cube) file."""
     try:
         data = request.json
-        original_b64 = data.get('original_image')
-        stylized_b64 = data.get('stylized_image')
-        
-        if not original_b64 or not stylized_b64:
+        generator = get_lut_generator(data.get('lut_size', 64), data.get('fit_method'))
+        curves = request_curves(data)
+        if curves is not None:
+            lut_type = data.get('lut_type', '3d')
+            key = artifact_key(data, 'cube', 'curves', lut_type, generator.lut_size)
+        else:
+            key = artifact_key(data, 'cube', generator.lut_size, generator.method)
+        if key is None:
             return jsonify({'error': 'Missing original or stylized image'}), 400
+        if request.if_none_match.contains(key):
+            return not_modified(key)
         
-        original_img = base64_to_image(original_b64)
-        stylized_img = base64_to_image(stylized_b64)
-        
-        lut_path = Path(app.config['UPLOAD_FOLDER']) / 'temp_lut.cube'
-        lut_generator.generate_from_images(original_img, stylized_img, lut_path)
+        def generate():
+            if curves is not None:
+                return curves_cube_bytes(curves, lut_type, generator.lut_size)
+            return fit_cube_bytes(generator, request_analysis(data, 'original_image'),
+                                  request_analysis(data, 'stylized_image'))
         
-        return send_file(lut_path, as_attachment=True, download_name='lutor_style.cube')
+        return send_artifact(key, artifact_cache.get_or_compute(key, generate))
     
+    except ImageNotFound as e:
+        return image_not_found_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"🔴 Error in /api/export_lut: {e}")
         return jsonify({'error': str(e)}), 500
@@ -158,74 +707,351 @@ def export_xmp():
     """Generates and exports a Lightroom Preset (.xmp) file."""
     try:
         data = request.json
-        original_b64 = data.get('original_image')
-        stylized_b64 = data.get('stylized_image')
+        key = artifact_key(data, 'xmp')
+        if key is None:
+            return jsonify({'error': 'Missing original or stylized image'}), 400
+        if request.if_none_match.contains(key):
+            return not_modified(key)
+        
+        def generate():
+            generator = get_lut_generator(64)
+            return generator.xmp_preset_from_analysis(request_analysis(data, 'original_image'),
+                                                      request_analysis(data, 'stylized_image'))
+        
+        return send_artifact(key, artifact_cache.get_or_compute(key, generate))
+    
+    except ImageNotFound as e:
+        return image_not_found_response(e)
+    except Exception as e:
+        print(f"🔴 Error in /api/export_xmp: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/artifacts/<key>')
+def get_artifact(key):
+    """Re-downloads a previously generated export by its ETag."""
+    if request.if_none_match.contains(key):
+        return not_modified(key)
+    data = artifact_cache.get(key)
+    if data is None:
+        return jsonify({'error': 'Unknown or expired artifact'}), 404
+    return send_artifact(key, data)
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    """Reports hit/miss counters for the server-side caches."""
+    return jsonify({
+        'style_cache': style_cache.stats(),
+        'matched_cache': matched_cache.stats(),
+        'curves_cache': curves_cache.stats(),
+        'analysis_cache': analysis_cache.stats(),
+        'image_store': image_store.stats(),
+        'artifact_cache': artifact_cache.stats(),
+        'jobs': job_queue.stats()
+    })
+
+# --- BACKGROUND JOBS ---
+def run_export_lut_job(job, generator, original, stylized):
+    """Fit a LUT in the background and return the .cube file contents."""
+    return artifact_cache.get_or_compute(job.key, lambda: fit_cube_bytes(
+        generator, original, stylized, progress=job.report))
+
+def run_curves_lut_job(job, curves, lut_type, lut_size):
+    """Build an exact LUT from a separable look's curves; finishes almost immediately."""
+    return artifact_cache.get_or_compute(job.key, lambda: curves_cube_bytes(curves, lut_type, lut_size))
+
+@app.route('/api/jobs/export_lut', methods=['POST'])
+def submit_export_lut():
+    """Queues a LUT export; identical exports already in flight are shared."""
+    try:
+        data = request.json
+        generator = get_lut_generator(data.get('lut_size', 64), data.get('fit_method'))
+        curves = request_curves(data)
+        if curves is not None:
+            lut_type = data.get('lut_type', '3d')
+            key = artifact_key(data, 'cube', 'curves', lut_type, generator.lut_size)
+            if key is None:
+                return jsonify({'error': 'Missing original or stylized image'}), 400
+            job, created = job_queue.submit('export_lut', key, run_curves_lut_job,
+                                            curves, lut_type, generator.lut_size)
+            return jsonify({**job.to_dict(), 'deduplicated': not created}), 202
         
-        if not original_b64 or not stylized_b64:
+        key = artifact_key(data, 'cube', generator.lut_size, generator.method)
+        original = request_analysis(data, 'original_image')
+        stylized = request_analysis(data, 'stylized_image')
+        
+        if original is None or stylized is None:
             return jsonify({'error': 'Missing original or stylized image'}), 400
         
-        original_img = base64_to_image(original_b64)
-        stylized_img = base64_to_image(stylized_b64)
+        job, created = job_queue.submit('export_lut', key, run_export_lut_job,
+                                        generator, original, stylized)
+        return jsonify({**job.to_dict(), 'deduplicated': not created}), 202
+    
+    except ImageNotFound as e:
+        return image_not_found_response(e)
+    except QueueFull as e:
+        return jsonify({'error': f'Too many exports in progress ({e}), try again shortly'}), 503
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"🔴 Error in /api/jobs/export_lut: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        xmp_path = Path(app.config['UPLOAD_FOLDER']) / 'temp_preset.xmp'
-        lut_generator.generate_xmp_preset(original_img, stylized_img, xmp_path)
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Reports a background job's status and progress."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancels a queued or running job."""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/result')
+def job_result(job_id):
+    """Downloads the output of a finished job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status != 'done':
+        return jsonify({**job.to_dict(), 'error': job.error or f'Job is {job.status}'}), 409
+    return send_artifact(job.key, job.result)
+
+@app.route('/api/export_full', methods=['POST'])
+def export_full():
+    """Renders the current look over the full-resolution content upload."""
+    try:
+        data = request.json
+        fmt = data.get('format', 'png')
+        transform_type = data.get('transform', 'curves')
+        strength = float(data.get('strength', 1.0))
         
-        return send_file(xmp_path, as_attachment=True, download_name='lutor_style.xmp')
+        if fmt not in OUTPUT_FORMATS:
+            return jsonify({'error': f'Unknown format: {fmt}'}), 400
+        original_path = find_original(data.get('content_image_id'))
+        if original_path is None:
+            return jsonify({'error': 'Full-resolution original not available', 'expired': True}), 410
+        
+        with span('decode'):
+            image = open_rgb(original_path)
+        preset = request_preset(data)
+        mode = request_transfer_mode(data)
+        style_key = request_image_key(data, 'style_image')
+        if preset is not None and transform_type == 'curves':
+            # Presets carry their own CDFs, LAB stats or LUT; nothing to re-analyse
+            transform = batch.transform_for(batch.style_spec_from_preset(preset, strength, mode=mode), image)
+        elif transform_type == 'curves' and style_key is None:
+            return jsonify({'error': 'Missing style image'}), 400
+        elif transform_type == 'curves' and mode == 'reinhard':
+            # The style is six LAB numbers; content statistics come from a sample of the full image
+            style_stats = get_style_lab_stats(style_key, lambda: load_request_image(data, 'style_image'))
+            transform = batch.transform_for(batch.style_spec_from_lab_stats(style_stats, strength), image)
+        elif transform_type == 'curves':
+            # The histogram-matched look is exactly three per-channel curves;
+            # the content histogram comes straight from the full image
+            style_cdfs = get_style_cdfs(style_key, lambda: load_request_image(data, 'style_image'))
+            hist = np.array(image.histogram()).reshape(3, 256)
+            transform = ChannelCurves(matched_strength_curves(hist, style_cdfs, strength))
+        elif transform_type == 'lut':
+            # Fit a 3D LUT on the preview pair, a bounded sample of the look
+            content = request_analysis(data, 'content_image')
+            stylized = request_analysis(data, 'stylized_image')
+            if content is None or stylized is None:
+                return jsonify({'error': 'Missing content or stylized image'}), 400
+            generator = get_lut_generator(data.get('lut_size', 64), data.get('fit_method'))
+            transform = LUTTransform(generator.fit_lut_from_analysis(content, stylized))
+        else:
+            return jsonify({'error': f'Unknown transform: {transform_type}'}), 400
+        
+        ext, mimetype = OUTPUT_FORMATS[fmt]
+        output_path = Path(app.config['EXPORT_FOLDER']) / f'{uuid.uuid4().hex}{ext}'
+        with span('render'):
+            render_full_resolution(image, transform, output_path, fmt)
+        
+        # Stream from an unlinked handle so the temporary file never lingers
+        output_file = open(output_path, 'rb')
+        try:
+            output_path.unlink()
+        except OSError:
+            pass
+        return send_file(output_file, mimetype=mimetype, as_attachment=True,
+                         download_name=f'lutor_full_resolution{ext}')
     
+    except ImageNotFound as e:
+        return image_not_found_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"🔴 Error in /api/export_xmp: {e}")
+        print(f"🔴 Error in /api/export_full: {e}")
         return jsonify({'error': str(e)}), 500
 
-# --- PRESET STYLE GENERATION ---
-# These functions programmatically create simple images to be used as style references.
+@app.route('/api/batch', methods=['POST'])
+def batch_process():
+    """Applies one style to a zip of images and streams back a zip of results."""
+    work_dir = None
+    try:
+        form = request.form
+        strength = float(form.get('strength', 1.0))
+        fmt = form.get('format', 'jpeg')
+        method = form.get('method', 'tetrahedral')
+        mode = request_transfer_mode(form)
+        workers = min(int(form.get('workers', app.config['BATCH_MAX_WORKERS'])),
+                      app.config['BATCH_MAX_WORKERS'])
+        
+        if fmt not in OUTPUT_FORMATS:
+            return jsonify({'error': f'Unknown format: {fmt}'}), 400
+        if 'inputs' not in request.files:
+            return jsonify({'error': 'No input zip provided'}), 400
+        
+        work_dir = Path(tempfile.mkdtemp(dir=app.config['BATCH_FOLDER']))
+        inputs_path = work_dir / 'inputs.zip'
+        request.files['inputs'].save(inputs_path)
+        
+        spec = request_style_spec(form, work_dir, strength, method, mode)
+        if spec is None:
+            return jsonify({'error': 'Missing style'}), 400
+        
+        inputs = batch.list_inputs(inputs_path)
+        if not inputs:
+            return jsonify({'error': 'No images found in the zip'}), 400
+        
+        failed = []
+        start = time.perf_counter()
+        
+        def results():
+            # Spawn the workers: a fork of this multi-threaded server would inherit
+            # locks held by the cache, image store and job queue threads
+            for name, data, error in batch.run_batch(spec, inputs, None, fmt, workers,
+                                                     start_method='spawn'):
+                if error:
+                    failed.append(error)
+                yield name, data, error
+        
+        def generate(cleanup_dir):
+            try:
+                report = lambda: batch.batch_report(len(inputs) - len(failed), failed,
+                                                    time.perf_counter() - start)
+                yield from batch.stream_zip(results(), report)
+            finally:
+                shutil.rmtree(cleanup_dir, ignore_errors=True)
+        
+        response = Response(generate(work_dir), mimetype='application/zip', headers={
+            'Content-Disposition': 'attachment; filename=lutor_batch.zip',
+            'X-Batch-Images': str(len(inputs)),
+        })
+        work_dir = None  # now owned by the streaming generator
+        return response
+    
+    except ImageNotFound as e:
+        return image_not_found_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"🔴 Error in /api/batch: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+@app.route('/api/video', methods=['POST'])
+def video_process():
+    """Grades an uploaded clip frame by frame with one style and returns the video."""
+    work_dir = None
+    try:
+        form = request.form
+        strength = float(form.get('strength', 1.0))
+        fmt = form.get('format', 'mp4')
+        method = form.get('method', 'tetrahedral')
+        mode = request_transfer_mode(form)
+        
+        if fmt not in VIDEO_FORMATS:
+            return jsonify({'error': f'Unknown video format: {fmt}'}), 400
+        if 'video' not in request.files:
+            return jsonify({'error': 'No video provided'}), 400
+        
+        work_dir = Path(tempfile.mkdtemp(dir=app.config['VIDEO_FOLDER']))
+        video_file = request.files['video']
+        input_path = work_dir / f"input{Path(secure_filename(video_file.filename)).suffix.lower()}"
+        video_file.save(input_path)
+        
+        spec = request_style_spec(form, work_dir, strength, method, mode)
+        if spec is None:
+            return jsonify({'error': 'Missing style'}), 400
+        
+        from utils.video import grade_video  # video I/O is only loaded for video requests
+        ext, mimetype = VIDEO_FORMATS[fmt]
+        output_path = work_dir / f'output{ext}'
+        with span('video'):
+            report = grade_video(spec, input_path, output_path,
+                                 queue_frames=app.config['VIDEO_QUEUE_FRAMES'])
+        if report['frames'] == 0:
+            return jsonify({'error': 'No frames could be decoded'}), 400
+        
+        # Stream from an unlinked handle so the work directory can go now
+        output_file = open(output_path, 'rb')
+        response = send_file(output_file, mimetype=mimetype, as_attachment=True,
+                             download_name=f'lutor_video{ext}')
+        response.headers['X-Video-Frames'] = str(report['frames'])
+        response.headers['X-Frames-Per-Second'] = f"{report['frames_per_second']:.2f}"
+        return response
+        
+    except ImageNotFound as e:
+        return image_not_found_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"🔴 Error in /api/video: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+# --- PRESET STYLES ---
 @app.route('/api/preset_styles')
 def get_preset_styles():
     """Returns a list of available preset styles."""
-    preset_styles = [
-        {'name': 'Warm Sunset', 'id': 'warm', 'description': 'Warm orange and yellow tones'},
-        {'name': 'Cool Ocean', 'id': 'cool', 'description': 'Cool blue and cyan tones'},
-        {'name': 'Vintage Film', 'id': 'vintage', 'description': 'Classic film look'},
-        {'name': 'High Contrast', 'id': 'contrast', 'description': 'Bold black and white'},
-        {'name': 'Soft Pastel', 'id': 'pastel', 'description': 'Gentle pastel colors'},
-    ]
-    return jsonify({'styles': preset_styles})
+    return jsonify({'styles': PRESETS.list()})
 
 @app.route('/api/generate_preset_style', methods=['POST'])
 def generate_preset_style():
-    """Generates a style image based on a preset ID."""
+    """Returns a preset's style image; presets are generated and encoded only once."""
     try:
         style_id = request.json.get('style_id')
-        style_generators = {
-            'warm': create_warm_style,
-            'cool': create_cool_style,
-            'vintage': create_vintage_style,
-            'contrast': create_contrast_style,
-            'pastel': create_pastel_style
-        }
+        preset = PRESETS.get(style_id)
         
-        if style_id not in style_generators:
+        if preset is None:
             return jsonify({'error': 'Unknown style ID'}), 400
         
-        style_img = style_generators[style_id]()
-        style_b64 = image_to_base64(style_img)
+        style_img = preset.image()
+        preview_key = preset_style_key(preset)
+        if preview_key not in preset_previews:
+            # Previews of earlier versions of the preset's files are stale
+            for stale in [k for k in list(preset_previews) if k.startswith(f'preset:{preset.id}@')]:
+                preset_previews.pop(stale, None)
+            preset_previews[preview_key] = image_to_base64(style_img)
+        style_image_id = image_store.put(style_img)
         
-        return jsonify({'success': True, 'style_image': style_b64})
+        # Clients that send the image ID back get the preset's precomputed CDFs
+        key = f'id:{style_image_id}'
+        if key not in style_cache:
+            style_cache.put(key, preset.cdfs())
+        
+        return jsonify({
+            'success': True,
+            'style_image': preset_previews[preview_key],
+            'style_image_id': style_image_id,
+            'style_preset_id': preset.id
+        })
     
     except Exception as e:
         print(f"🔴 Error in /api/generate_preset_style: {e}")
         return jsonify({'error': str(e)}), 500
 
-def create_warm_style():
-    img = Image.new('RGB', (256, 256)); p = []; [p.append((min(255, 200 + int(30*np.sin(x*0.05))), min(255, 150 + int(50*np.sin(y*0.03))), max(0, 100 - int(40*np.sin((x+y)*0.02))))) for y in range(256) for x in range(256)]; img.putdata(p); return img
-def create_cool_style():
-    img = Image.new('RGB', (256, 256)); p = []; [p.append((max(0, 100 - int(40*np.sin(x*0.05))), min(255, 150 + int(30*np.sin(y*0.03))), min(255, 200 + int(50*np.sin((x+y)*0.02))))) for y in range(256) for x in range(256)]; img.putdata(p); return img
-def create_vintage_style():
-    img = Image.new('RGB', (256, 256)); p = []; [p.append((min(255, 180 + int(20*np.sin(x*0.03))), min(255, 160 + int(20*np.sin(y*0.03))), min(255, 120 + int(20*np.sin((x+y)*0.02))))) for y in range(256) for x in range(256)]; img.putdata(p); return img
-def create_contrast_style():
-    img = Image.new('RGB', (256, 256)); p = []; [p.append((255,255,255) if (x+y)%40<20 else (0,0,0)) for y in range(256) for x in range(256)]; img.putdata(p); return img
-def create_pastel_style():
-    img = Image.new('RGB', (256, 256)); p = []; [p.append((min(255, 200 + int(30*np.sin(x*0.05))), min(255, 200 + int(30*np.sin(y*0.05))), min(255, 200 + int(30*np.sin((x+y)*0.05))))) for y in range(256) for x in range(256)]; img.putdata(p); return img
-
 
 # --- MAIN EXECUTION ---
 if __name__ == '__main__':
@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.fixture
+def lutor_app(tmp_path):
+    """The Flask app, initialised with every folder it writes to under tmp_path"""
+    import app as lutor
+
+    for key in ('UPLOAD_FOLDER', 'ORIGINALS_FOLDER', 'EXPORT_FOLDER', 'BATCH_FOLDER', 'VIDEO_FOLDER',
+                'IMAGE_STORE_SPILL_FOLDER', 'ARTIFACT_FOLDER', 'PROFILE_FOLDER'):
+        lutor.app.config[key] = str(tmp_path / key.lower())
+    lutor.init_app()
+    return lutor
@@ -0,0 +1,94 @@
+import io
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from utils import batch
+
+
+def _jpeg():
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((8, 8, 3), 128, dtype=np.uint8)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def _zip(path, names):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name in names:
+            zf.writestr(name, _jpeg())
+
+
+def test_is_safe_name():
+    assert batch.is_safe_name('a/b.jpg')
+    for name in ('../x.jpg', '/tmp/x.jpg', 'a/../../x.jpg', 'C:/x.jpg', '..\\x.jpg', ''):
+        assert not batch.is_safe_name(name)
+
+
+def test_zip_slip_members_are_skipped(tmp_path):
+    archive = tmp_path / 'in.zip'
+    _zip(archive, ['ok.jpg', '../x.jpg', '/tmp/x.jpg'])
+    out = tmp_path / 'out'
+    out.mkdir()
+
+    inputs = batch.list_inputs(archive)
+    assert [name for name, _ in inputs] == ['ok.jpg']
+
+    spec = batch.load_style('warm')
+    results = list(batch.run_batch(spec, inputs, str(out), 'jpeg', workers=1))
+    assert [error for _, _, error in results] == [None]
+    assert sorted(p.name for p in tmp_path.rglob('*.jpg')) == ['ok.jpg']
+
+
+def test_unsafe_names_are_never_written(tmp_path):
+    out = tmp_path / 'out'
+    out.mkdir()
+    spec = batch.load_style('warm')
+    for name in ('../x.jpg', '/tmp/x.jpg'):
+        _, data, error = batch._process_one((name, io.BytesIO(_jpeg()), str(out), 'jpeg', name), spec)
+        assert data is None and error
+    assert not (tmp_path / 'x.jpg').exists()
+
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(batch.stream_zip([('../x.jpg', b'data', None)]))))
+    assert archive.namelist() == []
+
+
+def test_colliding_stems_get_distinct_outputs(tmp_path):
+    assert batch.output_names(['a.jpg', 'a.PNG', 'b.jpg', 'd/a.jpg'], 'png') == \
+        ['a.jpg.png', 'a.PNG.png', 'b.png', 'd/a.png']
+
+    archive = tmp_path / 'in.zip'
+    _zip(archive, ['a.jpg', 'a.png', 'b.jpg'])
+    results = batch.run_batch(batch.load_style('warm'), batch.list_inputs(archive), None, 'png', workers=1)
+    names = zipfile.ZipFile(io.BytesIO(b''.join(batch.stream_zip(results)))).namelist()
+    assert sorted(names) == ['a.jpg.png', 'a.png.png', 'b.png']
+
+
+def test_interleaved_in_process_batches_keep_their_styles():
+    def inputs():
+        return [(f'{i}.jpg', io.BytesIO(_jpeg())) for i in range(3)]
+
+    def expected(style):
+        return [data for _, data, _ in batch.run_batch(batch.load_style(style), inputs(), None, 'png', workers=1)]
+
+    warm, cool = expected('warm'), expected('cool')
+    assert warm != cool
+
+    a = batch.run_batch(batch.load_style('warm'), inputs(), None, 'png', workers=1)
+    b = batch.run_batch(batch.load_style('cool'), inputs(), None, 'png', workers=1)
+    got_a, got_b = [], []
+    for _ in range(3):
+        got_a.append(next(a)[1])
+        got_b.append(next(b)[1])
+    assert got_a == warm and got_b == cool
+
+
+def test_api_batch_response_names(lutor_app):
+    archive = io.BytesIO()
+    _zip(archive, ['ok.jpg', '../x.jpg', '/tmp/x.jpg'])
+    response = lutor_app.app.test_client().post('/api/batch', data={
+        'inputs': (io.BytesIO(archive.getvalue()), 'inputs.zip'), 'style_id': 'warm', 'workers': '1'},
+        content_type='multipart/form-data')
+    assert response.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(response.get_data())).namelist()
+    assert sorted(names) == ['batch_report.json', 'ok.jpg']
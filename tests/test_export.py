@@ -0,0 +1,91 @@
+import io
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from utils.image_utils import matched_strength_curves
+from utils.presets import PRESETS
+
+
+def _png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16), (90, 120, 150)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_originals_in_use_are_not_pruned(lutor_app):
+    client = lutor_app.app.test_client()
+    ttl = lutor_app.app.config['IMAGE_STORE_TTL']
+
+    def upload():
+        response = client.post('/api/upload', data={'file': (io.BytesIO(_png()), 'content.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        return response.get_json()['image_id']
+
+    image_id = upload()
+    original = next(Path(lutor_app.app.config['ORIGINALS_FOLDER']).glob(f'{image_id}.*'))
+
+    # A re-upload of the same image restarts its original's age
+    _age(original, ttl + 60)
+    assert upload() == image_id
+    assert original.exists() and original.stat().st_mtime > time.time() - ttl
+
+    # So does exporting from it
+    _age(original, ttl - 60)
+    response = client.post('/api/export_full', json={
+        'content_image_id': image_id, 'style_preset_id': 'warm', 'format': 'png'})
+    assert response.status_code == 200
+    assert original.stat().st_mtime > time.time() - 60
+
+
+def test_expired_originals_are_swept_periodically(lutor_app, monkeypatch):
+    folder = Path(lutor_app.app.config['ORIGINALS_FOLDER'])
+    stale = folder / 'stale.png'
+    stale.write_bytes(_png())
+    _age(stale, lutor_app.app.config['IMAGE_STORE_TTL'] + 60)
+
+    monkeypatch.setattr(lutor_app, 'originals_swept', time.monotonic())
+    lutor_app.sweep_originals()
+    assert stale.exists()  # swept recently: no scan on this upload
+
+    monkeypatch.setattr(lutor_app, 'originals_swept', float('-inf'))
+    lutor_app.sweep_originals()
+    assert not stale.exists()
+
+
+def test_preview_lut_payloads(lutor_app):
+    client = lutor_app.app.test_client()
+    content = Image.fromarray(np.random.default_rng(12).integers(0, 256, (24, 32, 3), dtype=np.uint8))
+    payload = {'content_image': lutor_app.image_to_base64(content, 'webp'), 'style_preset_id': 'warm'}
+
+    # Histogram matching is per channel: 256 entries of three little-endian half floats
+    response = client.post('/api/preview_lut', json=payload)
+    assert response.status_code == 200
+    assert response.headers['X-LUT-Dimensions'] == '1d' and response.headers['X-LUT-Size'] == '256'
+    lut = np.frombuffer(response.get_data(), dtype='<f2').reshape(256, 3)
+    decoded = lutor_app.load_request_image(payload, 'content_image')
+    counts = np.array(decoded.histogram()).reshape(3, 256)
+    curves = matched_strength_curves(counts, PRESETS.get('warm').cdfs(), 1.0, quantize=True)
+    np.testing.assert_allclose(lut.astype(np.float64), curves.T / 255.0, atol=1e-3)
+
+    etag = response.headers['ETag']
+    cached = client.post('/api/preview_lut', json=payload, headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and not cached.get_data()
+
+    # Statistics transfer is not separable: a 3D grid of PREVIEW_LUT_SIZE
+    response = client.post('/api/preview_lut', json={**payload, 'transfer_mode': 'reinhard'})
+    assert response.status_code == 200
+    size = lutor_app.app.config['PREVIEW_LUT_SIZE']
+    assert response.headers['X-LUT-Dimensions'] == '3d' and response.headers['X-LUT-Size'] == str(size)
+    grid = np.frombuffer(response.get_data(), dtype='<f2').reshape(size, size, size, 3)
+    assert np.all((grid >= 0) & (grid <= 1))
+    assert response.headers['ETag'] != etag
@@ -0,0 +1,100 @@
+import threading
+
+import numpy as np
+
+from utils import image_store
+from utils.image_store import ImageStore
+
+
+def _image(value):
+    return np.full((16, 16, 3), value, dtype=np.uint8)
+
+
+def test_spilled_images_reload(tmp_path):
+    store = ImageStore(max_bytes=_image(0).nbytes, spill_dir=tmp_path)
+    first = store.put(_image(1))
+    second = store.put(_image(2))
+    assert store.stats()['spilled_entries'] == 1
+    np.testing.assert_array_equal(store.get(first), _image(1))
+    np.testing.assert_array_equal(store.get(second), _image(2))
+
+
+def test_spill_writes_do_not_hold_the_lock(tmp_path, monkeypatch):
+    store = ImageStore(max_bytes=_image(0).nbytes, spill_dir=tmp_path)
+    first = store.put(_image(1))
+
+    writing, release = threading.Event(), threading.Event()
+    save = np.save
+
+    def slow_save(path, array):
+        writing.set()
+        assert release.wait(5)
+        save(path, array)
+
+    monkeypatch.setattr(image_store.np, 'save', slow_save)
+    spiller = threading.Thread(target=store.put, args=(_image(2),))
+    spiller.start()
+    try:
+        assert writing.wait(5)
+        # The store stays usable mid-write, and the image being written is still readable
+        reads = []
+        reader = threading.Thread(target=lambda: reads.append(store.get(first)), daemon=True)
+        reader.start()
+        reader.join(5)
+        assert reads, "get blocked behind a spill write"
+        np.testing.assert_array_equal(reads[0], _image(1))
+        assert first in store
+        assert store.stats()['entries'] == 1
+    finally:
+        release.set()
+        spiller.join()
+    assert store.stats()['spilled_entries'] == 1
+    np.testing.assert_array_equal(store.get(first), _image(1))
+
+
+def test_reupload_of_spilled_image_removes_its_file(tmp_path):
+    store = ImageStore(max_bytes=_image(0).nbytes, spill_dir=tmp_path)
+    first = store.put(_image(1))
+    store.put(_image(2))
+    assert (tmp_path / f'{first}.npy').exists()
+    store.put(_image(1))  # spills image 2 in turn
+    assert not (tmp_path / f'{first}.npy').exists()
+    assert len(list(tmp_path.iterdir())) == 1
+    assert store.stats()['disk_bytes'] == _image(0).nbytes
+
+
+def test_corrupt_spill_is_a_miss(tmp_path):
+    store = ImageStore(max_bytes=_image(0).nbytes, spill_dir=tmp_path)
+    first = store.put(_image(1))
+    store.put(_image(2))
+    (tmp_path / f'{first}.npy').write_bytes(b'\x93NUMPY truncated')
+    assert store.get(first) is None
+    assert store.stats()['misses'] == 1
+
+
+def test_concurrent_gets_wait_for_a_reload(tmp_path, monkeypatch):
+    store = ImageStore(max_bytes=_image(0).nbytes, spill_dir=tmp_path)
+    first = store.put(_image(1))
+    store.put(_image(2))
+
+    loading, release = threading.Event(), threading.Event()
+    load = np.load
+
+    def slow_load(path, *args, **kwargs):
+        loading.set()
+        assert release.wait(5)
+        return load(path, *args, **kwargs)
+
+    monkeypatch.setattr(image_store.np, 'load', slow_load)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.get(first))) for _ in range(3)]
+    threads[0].start()
+    assert loading.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(results) == 3
+    for result in results:
+        np.testing.assert_array_equal(result, _image(1))
@@ -0,0 +1,157 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, JpegImagePlugin
+
+from utils.image_utils import (ORIENTATION_TAG, blend_images, histogram_cdfs, load_preview, lab_stats, lab_transfer_coefficients,
+                               lab_to_rgb, match_histogram, match_histogram_channel, matched_strength_curves,
+                               reinhard_transfer, rgb_to_lab)
+from utils.render import ChannelCurves, LabTransfer
+
+
+def _pair():
+    rng = np.random.default_rng(0)
+    content = rng.integers(0, 200, (32, 32, 3), dtype=np.uint8)
+    style = rng.integers(40, 256, (32, 32, 3), dtype=np.uint8)
+    counts = [np.bincount(content[:, :, i].ravel(), minlength=256) for i in range(3)]
+    return content, style, counts
+
+
+def test_quantized_curves_reproduce_the_preview():
+    content, style, counts = _pair()
+    preview = blend_images(content, match_histogram(content, Image.fromarray(style)), 0.6)
+    curves = matched_strength_curves(counts, histogram_cdfs(style), 0.6, quantize=True)
+    np.testing.assert_array_equal(ChannelCurves(curves)(content), preview)
+
+
+def test_float_curves_keep_16_bit_precision():
+    content, style, counts = _pair()
+    curves = matched_strength_curves(counts, histogram_cdfs(style), 0.6)
+    quantized = matched_strength_curves(counts, histogram_cdfs(style), 0.6, quantize=True)
+    assert np.abs(curves - quantized).max() <= 1.0
+
+    table = ChannelCurves(curves).table(np.uint16)
+    assert np.any(table % 257)
+
+
+def _unique_match_channel(source, target):
+    """The np.unique / np.interp matcher that the bincount path replaced"""
+    s_values, bin_idx, s_counts = np.unique(source.ravel(), return_inverse=True, return_counts=True)
+    t_values, t_counts = np.unique(target.ravel(), return_counts=True)
+    s_cdf = np.cumsum(s_counts).astype(np.float64)
+    s_cdf /= s_cdf[-1]
+    t_cdf = np.cumsum(t_counts).astype(np.float64)
+    t_cdf /= t_cdf[-1]
+    return np.interp(s_cdf, t_cdf, t_values)[bin_idx].reshape(source.shape).astype(source.dtype)
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_match_histogram_matches_unique_reference(dtype):
+    rng = np.random.default_rng(6)
+    peak = np.iinfo(dtype).max
+    # Gaps in both histograms exercise the values missing from each
+    source = (rng.beta(2, 5, (64, 48, 3)) * peak).astype(dtype)
+    target = (rng.beta(5, 2, (40, 40, 3)) * peak).astype(dtype)
+    expected = np.dstack([_unique_match_channel(source[:, :, i], target[:, :, i]) for i in range(3)])
+
+    matched = match_histogram(source, target)
+    np.testing.assert_array_equal(np.asarray(matched), expected)
+    np.testing.assert_array_equal(match_histogram(source, None, target_cdfs=histogram_cdfs(target)), matched)
+    np.testing.assert_array_equal(match_histogram_channel(source[:, :, 1], target[:, :, 1]), expected[:, :, 1])
+
+
+def test_match_histogram_rejects_mixed_bit_depths():
+    source = np.zeros((4, 4, 3), dtype=np.uint8)
+    target = np.full((4, 4, 3), 60000, dtype=np.uint16)
+    with pytest.raises(ValueError):
+        match_histogram(source, target)
+    with pytest.raises(ValueError):
+        match_histogram(source, None, target_cdfs=histogram_cdfs(target))
+    with pytest.raises(ValueError):
+        match_histogram_channel(source[:, :, 0], target[:, :, 0])
+
+
+def _smooth_image(seed, low, high, shape=(48, 64)):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]] / max(shape)
+    base = np.dstack([x, y, (x + y) / 2]) * (high - low) + low
+    return np.clip(base + rng.normal(0, 4, base.shape), 0, 255).astype(np.uint8)
+
+
+def test_reinhard_transfer_moves_lab_statistics():
+    content, style = _smooth_image(8, 30, 140), _smooth_image(9, 120, 240)
+    style_stats = lab_stats(style)
+    scale, offset = lab_transfer_coefficients(lab_stats(content), style_stats)
+
+    result = reinhard_transfer(content, scale, offset)
+    mean, std = lab_stats(result)
+    np.testing.assert_allclose(mean, style_stats[0], atol=4)
+    np.testing.assert_allclose(std, style_stats[1], rtol=0.15, atol=1.5)
+    # Row tiles are independent
+    np.testing.assert_array_equal(reinhard_transfer(content, scale, offset, tile_rows=7), result)
+
+    # Identical statistics leave the image as the 8-bit LAB round trip does
+    scale, offset = lab_transfer_coefficients(lab_stats(content), lab_stats(content))
+    np.testing.assert_array_equal(reinhard_transfer(content, scale, offset),
+                                  np.asarray(lab_to_rgb(rgb_to_lab(content))))
+
+
+def test_lab_transfer_strength_and_bit_depths():
+    content, style = _smooth_image(10, 30, 140), _smooth_image(11, 120, 240)
+    scale, offset = lab_transfer_coefficients(lab_stats(content), lab_stats(style))
+
+    np.testing.assert_array_equal(LabTransfer(scale, offset, 0.0)(content), content)
+    full = LabTransfer(scale, offset, 1.0)(content)
+    np.testing.assert_array_equal(full, reinhard_transfer(content, scale, offset))
+
+    half = LabTransfer(scale, offset, 0.5)
+    np.testing.assert_array_equal(half(content), blend_images(content, full, 0.5))
+    deep = half(content, np.uint16)
+    assert deep.dtype == np.uint16
+    assert np.abs(deep / 257.0 - half(content)).max() <= 3
+
+
+def _half_red_half_blue(size, fmt, orientation=None):
+    width, height = size
+    array = np.zeros((height, width, 3), dtype=np.uint8)
+    array[:, :width // 2, 0] = 255
+    array[:, width // 2:, 2] = 255
+    image = Image.fromarray(array)
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ORIENTATION_TAG] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, exif=exif.tobytes(), quality=95)
+    buffer.seek(0)
+    return buffer
+
+
+def test_load_preview_applies_exif_orientation():
+    # Orientation 6: the camera was turned, display rotated 90 degrees clockwise
+    preview, full_size = load_preview(_half_red_half_blue((400, 200), 'JPEG', orientation=6), 100)
+    assert full_size == (200, 400)
+    assert preview.size == (50, 100)
+    pixels = np.asarray(preview).astype(int)
+    assert pixels[5, 25, 0] > 200 and pixels[5, 25, 2] < 60    # left half is now on top
+    assert pixels[-5, 25, 2] > 200 and pixels[-5, 25, 0] < 60
+
+
+def test_load_preview_decodes_jpegs_at_reduced_scale(monkeypatch):
+    drafts = []
+    draft = JpegImagePlugin.JpegImageFile.draft
+
+    def record(self, mode, size):
+        result = draft(self, mode, size)
+        drafts.append(self.size)
+        return result
+
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, 'draft', record)
+    preview, full_size = load_preview(_half_red_half_blue((2400, 1600), 'JPEG'), 300)
+    assert full_size == (2400, 1600) and preview.size == (300, 200)
+    # 2400 -> 300 is exactly the largest DCT scaling, 1/8
+    assert drafts == [(300, 200)]
+
+    preview, full_size = load_preview(_half_red_half_blue((2400, 1600), 'PNG'), 300)
+    assert full_size == (2400, 1600) and preview.size == (300, 200)
+    assert np.asarray(preview)[100, 10, 0] == 255 and np.asarray(preview)[100, -10, 2] == 255
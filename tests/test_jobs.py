@@ -0,0 +1,60 @@
+import threading
+import time
+
+from utils.jobs import JobQueue
+
+
+def _wait(job, status):
+    deadline = time.monotonic() + 5
+    while job.status != status and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.status == status
+
+
+def test_submit_dedupe_and_cancel():
+    queue = JobQueue(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def work(job):
+        started.set()
+        while not release.wait(0.01):
+            job.report(0.5)
+        return 'done'
+
+    job, created = queue.submit('export_lut', 'key', work)
+    assert created
+    same, created = queue.submit('export_lut', 'key', work)
+    assert same is job and not created
+
+    # The single worker is busy, so this one stays queued
+    assert started.wait(5)
+    queued, _ = queue.submit('export_lut', 'other', work)
+    assert queued.status == 'queued'
+    assert queue.cancel(queued.id).status == 'cancelled'
+
+    queue.cancel(job.id)
+    _wait(job, 'cancelled')
+    assert job.result is None
+    assert queue.stats()['cancelled'] == 2
+
+    # A finished job no longer blocks a new one with the same key
+    release.set()
+    again, created = queue.submit('export_lut', 'key', work)
+    assert created and again is not job
+    _wait(again, 'done')
+    assert again.result == 'done' and again.progress == 1.0
+
+
+def test_expired_jobs_are_gone(lutor_app, monkeypatch):
+    queue = JobQueue(finished_ttl=0)
+    monkeypatch.setattr(lutor_app, 'job_queue', queue)
+    client = lutor_app.app.test_client()
+
+    job, _ = queue.submit('export_lut', None, lambda job: 'done')
+    _wait(job, 'done')
+    assert client.get(f'/api/jobs/{job.id}').get_json()['status'] == 'done'
+
+    time.sleep(0.01)
+    queue.submit('export_lut', None, lambda job: 'done')  # submitting prunes expired jobs
+    response = client.get(f'/api/jobs/{job.id}')
+    assert response.status_code == 404
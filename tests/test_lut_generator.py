@@ -0,0 +1,242 @@
+import numpy as np
+import pytest
+
+from utils import lut_generator
+from utils.lut_generator import (ColourLookup, LUTGenerator, apply_lut, fit_error_comment, identity_lut,
+                                 load_cube_file, load_lut, read_fit_error, save_cube_file)
+
+
+def test_cube_header_whitespace(tmp_path):
+    lut = identity_lut(2)
+    rows = '\n'.join(' '.join(f'{v:.6f}' for v in lut[r, g, b])
+                     for b in range(2) for g in range(2) for r in range(2))
+    path = tmp_path / 'tabs.cube'
+    path.write_text(f'TITLE "tabs"\nLUT_3D_SIZE\t2\nDOMAIN_MIN  0 0 0\nDOMAIN_MAX\t1\t1\t1\n{rows}\n')
+
+    loaded, domain_min, domain_max = load_cube_file(path)
+    assert loaded.shape == (2, 2, 2, 3)
+    np.testing.assert_allclose(loaded, lut, atol=1e-6)
+    assert list(domain_min) == [0, 0, 0] and list(domain_max) == [1, 1, 1]
+
+
+def test_cube_unknown_keywords_are_skipped(tmp_path):
+    lut = identity_lut(2)
+    rows = '\n'.join(' '.join(f'{v:.6f}' for v in lut[r, g, b])
+                     for b in range(2) for g in range(2) for r in range(2))
+    path = tmp_path / 'resolve.cube'
+    path.write_text(f'TITLE "resolve"\nLUT_IN_VIDEO_RANGE\nLUT_3D_SIZE 2\nLUT_3D_INPUT_RANGE 0 1\n'
+                    f'VENDOR_KEY some value\n{rows}\n')
+    loaded, _, _ = load_cube_file(path)
+    np.testing.assert_allclose(loaded, lut, atol=1e-6)
+
+    path.write_text(f'LUT_3D_SIZE 2\n{rows}\nnot a number\n')
+    with pytest.raises(ValueError):
+        load_cube_file(path)
+
+
+@pytest.mark.parametrize('size', [17, 33, 65])
+def test_cube_round_trip(tmp_path, size):
+    rng = np.random.default_rng(size)
+    lut = rng.uniform(0, 1, (size, size, size, 3)).astype(np.float32)
+    path = tmp_path / f'{size}.cube'
+    save_cube_file(lut, path)
+
+    loaded, domain_min, domain_max = load_cube_file(path)
+    assert loaded.shape == lut.shape
+    np.testing.assert_allclose(loaded, lut, atol=5e-7)
+    assert list(domain_min) == [0, 0, 0] and list(domain_max) == [1, 1, 1]
+
+    # The first cached load writes the binary companion, the second reads it
+    companion = tmp_path / f'{size}.cube.npy'
+    np.testing.assert_array_equal(load_lut(path, cache_binary=True), loaded)
+    assert companion.exists()
+    cached = load_lut(path, cache_binary=True)
+    assert isinstance(cached, np.memmap)
+    np.testing.assert_array_equal(cached, loaded)
+
+
+def test_1d_cube_round_trip(tmp_path):
+    lut = np.random.default_rng(0).uniform(0, 1, (256, 3)).astype(np.float32)
+    path = tmp_path / 'curves.cube'
+    save_cube_file(lut, path)
+    np.testing.assert_allclose(load_lut(path), lut, atol=5e-7)
+
+
+def _brute_force(target, original):
+    distances = ((target[:, None, :] - original[None, :, :]) ** 2).sum(axis=2)
+    return distances, np.argsort(distances, axis=1)
+
+
+def test_closest_mappings_match_brute_force():
+    rng = np.random.default_rng(1)
+    # Continuous colours: no two neighbours tie on distance
+    original = rng.uniform(0, 255, (500, 3)).astype(np.float32)
+    stylized = rng.uniform(0, 255, (500, 3)).astype(np.float32)
+    target = rng.uniform(0, 255, (300, 3)).astype(np.float32)
+    generator = LUTGenerator(lut_size=17)
+    distances, order = _brute_force(target.astype(np.float64), original.astype(np.float64))
+
+    nearest = generator._find_closest_mappings(target, original, stylized, k=1, chunk_size=64)
+    np.testing.assert_allclose(nearest, stylized[order[:, 0]], atol=1e-3)
+
+    knn = order[:, :5]
+    weights = 1.0 / (np.take_along_axis(distances, knn, axis=1) + 1e-6)
+    weights /= weights.sum(axis=1, keepdims=True)
+    expected = np.einsum('ij,ijk->ik', weights, stylized[knn].astype(np.float64))
+    mapped = generator._find_closest_mappings(target, original, stylized, chunk_size=64)
+    np.testing.assert_allclose(mapped, np.clip(expected, 0, 255), atol=1e-2)
+
+
+def _lattice(rgb, size):
+    coords = np.clip(rgb, 0, 1) * (size - 1)
+    index = np.minimum(np.floor(coords).astype(int), size - 2)
+    return index, coords - index
+
+
+def _reference_trilinear(rgb, lut):
+    (ir, ig, ib), (fr, fg, fb) = (a.T for a in _lattice(rgb, lut.shape[0]))
+    out = np.zeros(rgb.shape)
+    for dr in (0, 1):
+        for dg in (0, 1):
+            for db in (0, 1):
+                weight = ((fr if dr else 1 - fr) * (fg if dg else 1 - fg) * (fb if db else 1 - fb))
+                out += weight[:, None] * lut[ir + dr, ig + dg, ib + db]
+    return out
+
+
+def _reference_tetrahedral(rgb, lut):
+    index, fraction = _lattice(rgb, lut.shape[0])
+    out = np.empty(rgb.shape)
+    for n, ((ir, ig, ib), f) in enumerate(zip(index, fraction)):
+        # Walk from node 000 to node 111 one axis at a time, largest fraction first
+        order = np.argsort(-f, kind='stable')
+        node = np.array([ir, ig, ib])
+        sorted_f = np.concatenate([[1.0], f[order], [0.0]])
+        value = np.zeros(3)
+        for step in range(4):
+            value += (sorted_f[step] - sorted_f[step + 1]) * lut[tuple(node)]
+            if step < 3:
+                node[order[step]] += 1
+        out[n] = value
+    return out
+
+
+def test_apply_lut_identity_is_exact():
+    rng = np.random.default_rng(2)
+    for dtype in (np.uint8, np.uint16):
+        image = rng.integers(0, np.iinfo(dtype).max + 1, (37, 53, 3), dtype=dtype)
+        for size in (17, 33):
+            for method in ('trilinear', 'tetrahedral'):
+                graded = apply_lut(image, identity_lut(size), method, tile_pixels=200, workers=3)
+                np.testing.assert_array_equal(graded, image)
+
+
+@pytest.mark.parametrize('method, reference', [('trilinear', _reference_trilinear),
+                                               ('tetrahedral', _reference_tetrahedral)])
+def test_apply_lut_matches_reference(method, reference):
+    rng = np.random.default_rng(3)
+    lut = rng.uniform(0, 1, (9, 9, 9, 3)).astype(np.float32)
+    image = rng.uniform(0, 1, (41, 29, 3)).astype(np.float32)
+    # Lattice nodes and the upper domain edge hit the clamped index paths
+    image[0, :9] = np.linspace(0, 1, 9)[:, None]
+    image[1, 0] = 1.0
+    expected = reference(image.reshape(-1, 3).astype(np.float64), lut.astype(np.float64))
+    expected = np.clip(expected, 0, 1).reshape(image.shape)
+
+    whole = apply_lut(image, lut, method, workers=1)
+    np.testing.assert_allclose(whole, expected, atol=1e-5)
+    # Tiles of 3 rows and a bit, split across threads with their own scratch buffers
+    tiled = apply_lut(image, lut, method, tile_pixels=100, workers=4)
+    np.testing.assert_array_equal(tiled, whole)
+
+    image8 = (image * 255).round().astype(np.uint8)
+    expected8 = reference(image8.reshape(-1, 3) / 255.0, lut.astype(np.float64))
+    expected8 = np.rint(np.clip(expected8, 0, 1) * 255).reshape(image.shape)
+    graded8 = apply_lut(image8, lut, method, tile_pixels=100, workers=4)
+    assert np.abs(graded8.astype(int) - expected8).max() <= 1
+
+
+@pytest.mark.parametrize('method', ['trilinear', 'tetrahedral'])
+def test_colour_lookup_matches_per_pixel_interpolation(method, monkeypatch):
+    rng = np.random.default_rng(4)
+    lut = rng.uniform(0, 1, (17, 17, 17, 3)).astype(np.float32)
+    # Few distinct colours, repeated across many pixels, as in a photo
+    palette = rng.integers(0, 256, (500, 3), dtype=np.uint8)
+    image = palette[rng.integers(0, len(palette), (120, 90))]
+    direct = apply_lut(image, lut, method, workers=1)
+
+    monkeypatch.setattr(lut_generator, 'COLOUR_LOOKUP_MIN_PIXELS', 1000)
+    np.testing.assert_array_equal(apply_lut(image, lut, method, tile_pixels=500, workers=3), direct)
+
+    lookup = ColourLookup(lut, method, workers=1)
+    tiles = [lookup(image[y:y + 8]) for y in range(0, len(image), 8)]
+    np.testing.assert_array_equal(np.concatenate(tiles), direct)
+
+
+def test_apply_lut_rejects_other_integer_dtypes():
+    for dtype in (np.int32, np.int64, np.bool_):
+        with pytest.raises(TypeError):
+            apply_lut(np.zeros((4, 4, 3), dtype=dtype), identity_lut(5))
+
+
+def _gamma_pair(original, gamma=1.5):
+    return original, np.rint(255 * (original / 255.0) ** gamma).astype(np.uint8)
+
+
+def test_splat_fit_recovers_a_smooth_curve(tmp_path):
+    original = np.random.default_rng(5).integers(0, 256, (256, 256, 3), dtype=np.uint8)
+    expected = identity_lut(17) ** 1.5
+    generator = LUTGenerator(lut_size=17, method='splat')
+
+    lut = generator.fit_lut(*_gamma_pair(original))
+    assert np.abs(lut - expected).mean() * 255 < 2
+    error = generator.fit_error(lut, *_gamma_pair(original))
+    assert error['rmse'] < 2 and error['samples'] == original.shape[0] * original.shape[1]
+
+    # Only the lower half of the cube has data; diffusion fills the rest
+    # from the offsets around it rather than leaving identity behind
+    lut = generator.fit_lut(*_gamma_pair(original // 2))
+    covered = np.zeros((17, 17, 17), dtype=bool)
+    covered[:9, :9, :9] = True
+    deviation = np.abs(lut - expected).mean(axis=-1) * 255
+    assert deviation[covered].mean() < 2
+    identity_deviation = np.abs(identity_lut(17) - expected).mean(axis=-1) * 255
+    assert deviation[~covered].mean() < identity_deviation[~covered].mean() / 2
+
+    comment = fit_error_comment(error, 'splat')
+    path = tmp_path / 'fit.cube'
+    save_cube_file(lut, path, comments=[comment])
+    assert read_fit_error(path.read_bytes()) == comment[len('Fit error: '):]
+    assert f"rmse={error['rmse']:.3f}" in comment
+
+
+def test_unique_colours_count_and_average_their_pixels():
+    colours = np.array([[10, 20, 30], [10, 20, 30], [10, 20, 30], [200, 0, 5], [0, 0, 0], [200, 0, 5]],
+                       dtype=np.uint8)
+    stylized = np.array([[0, 0, 0], [30, 60, 90], [60, 0, 30], [100, 100, 100], [7, 8, 9], [50, 0, 0]],
+                        dtype=np.uint8)
+    unique, counts, means = LUTGenerator(lut_size=17)._get_unique_colors(colours, stylized)
+
+    np.testing.assert_array_equal(unique, [[0, 0, 0], [10, 20, 30], [200, 0, 5]])
+    np.testing.assert_array_equal(counts, [1, 3, 2])
+    np.testing.assert_allclose(means, [[7, 8, 9], [30, 20, 40], [75, 50, 50]])
+
+
+def test_unique_colour_subsample_keeps_aligned_counts_and_means():
+    rng = np.random.default_rng(7)
+    # Colour k appears k + 1 times and always stylizes to (k, k, k) // 4
+    keys = np.repeat(np.arange(400), np.arange(1, 401))
+    colours = np.stack([keys >> 8, keys & 0xFF, np.zeros_like(keys)], axis=1).astype(np.uint8)
+    stylized = np.repeat((keys // 4)[:, None], 3, axis=1)
+    order = rng.permutation(len(keys))
+
+    np.random.seed(0)
+    unique, counts, means = LUTGenerator(lut_size=17)._get_unique_colors(
+        colours[order], stylized[order], max_samples=100)
+    assert len(unique) == 100
+    sampled = unique[:, 0].astype(int) << 8 | unique[:, 1]
+    assert np.all(np.diff(sampled) > 0)
+    np.testing.assert_array_equal(counts, sampled + 1)
+    np.testing.assert_allclose(means, np.repeat((sampled // 4)[:, None], 3, axis=1))
+    # Weighted by count: frequent colours dominate the sample
+    assert np.median(sampled) > 200
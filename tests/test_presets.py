@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.lut_generator import identity_lut, save_cube_file
+from utils.presets import PRESETS
+
+
+@pytest.fixture
+def preset_dir(tmp_path):
+    """A directory for presets registered by the test; they are unregistered afterwards"""
+    presets = tmp_path / 'presets'
+    presets.mkdir()
+    registered = []
+    yield presets, registered
+    for preset_id in registered:
+        PRESETS.unregister(preset_id)
+
+
+def test_preview_lut_follows_edited_preset_files(lutor_app, preset_dir):
+    presets, registered = preset_dir
+    cube = presets / 'edited.cube'
+    save_cube_file(identity_lut(9), cube)
+    registered += PRESETS.load_directory(presets)
+
+    client = lutor_app.app.test_client()
+    payload = {'content_image': lutor_app.image_to_base64(Image.new('RGB', (16, 16), (90, 120, 150))),
+               'style_preset_id': 'edited'}
+    first = client.post('/api/preview_lut', json=payload)
+    assert first.status_code == 200
+
+    save_cube_file(np.clip(identity_lut(9) * 0.5, 0, 1), cube)
+    stat = os.stat(cube)
+    os.utime(cube, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    second = client.post('/api/preview_lut', json=payload, headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert second.get_data() != first.get_data()
+
+
+def test_deleted_preset_files(preset_dir):
+    presets, registered = preset_dir
+    for stem in ('loaded', 'unloaded'):
+        save_cube_file(identity_lut(5), presets / f'{stem}.cube')
+    registered += PRESETS.load_directory(presets)
+
+    loaded = PRESETS.get('loaded')
+    lut = loaded.lut()
+    version = loaded.version
+    os.remove(presets / 'loaded.cube')
+    os.remove(presets / 'unloaded.cube')
+
+    # Memoized data outlives its file; a preset that never loaded is gone
+    assert loaded.version == version
+    np.testing.assert_array_equal(loaded.lut(), lut)
+    assert 'loaded' in PRESETS
+    assert 'unloaded' not in PRESETS and PRESETS.get('unloaded') is None
+    assert 'unloaded' not in [preset['id'] for preset in PRESETS.list()]
+    PRESETS.warm()
+
+
+def test_preset_preview_follows_edited_image(lutor_app, preset_dir):
+    presets, registered = preset_dir
+    image = presets / 'photo.png'
+    Image.new('RGB', (8, 8), (200, 40, 40)).save(image)
+    registered += PRESETS.load_directory(presets)
+
+    client = lutor_app.app.test_client()
+    first = client.post('/api/generate_preset_style', json={'style_id': 'photo'}).get_json()
+
+    Image.new('RGB', (8, 8), (40, 40, 200)).save(image)
+    stat = os.stat(image)
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    second = client.post('/api/generate_preset_style', json={'style_id': 'photo'}).get_json()
+    assert second['style_image_id'] != first['style_image_id']
+    assert second['style_image'] != first['style_image']
@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+from utils import serve
+
+
+def test_multiple_processes_need_per_process_state():
+    with pytest.raises(SystemExit):
+        serve.main(['--processes', '2'])
+
+
+def test_processes_spill_to_their_own_folders(lutor_app):
+    shared = lutor_app.app.config['IMAGE_STORE_SPILL_FOLDER']
+    lutor_app.init_process()
+    assert str(lutor_app.image_store.spill_dir) == os.path.join(shared, str(os.getpid()))
+    assert os.path.isdir(lutor_app.image_store.spill_dir)
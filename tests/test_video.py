@@ -0,0 +1,33 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils import video
+from utils.batch import load_style
+
+
+def _frames(folder, sizes):
+    folder.mkdir()
+    for i, (width, height) in enumerate(sizes):
+        cv2.imwrite(str(folder / f'{i:03d}.png'), np.full((height, width, 3), 40 * i, dtype=np.uint8))
+    return folder
+
+
+def test_frame_sequence_grades_every_frame(tmp_path):
+    frames = _frames(tmp_path / 'in', [(32, 24)] * 3)
+    report = video.grade_video(load_style('warm'), frames, tmp_path / 'out')
+    assert report['frames'] == 3
+    assert sorted(p.name for p in (tmp_path / 'out').iterdir()) == [
+        'frame_000000.png', 'frame_000001.png', 'frame_000002.png']
+
+
+def test_frames_of_another_size_are_rejected(tmp_path):
+    frames = _frames(tmp_path / 'in', [(32, 24), (32, 24), (40, 24)])
+    with pytest.raises(ValueError, match='002.png'):
+        video.grade_video(load_style('warm'), frames, tmp_path / 'out.avi')
+
+    sink = video.FrameSink(tmp_path / 'direct.avi', 24.0)
+    sink.write(np.zeros((24, 32, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        sink.write(np.zeros((24, 40, 3), dtype=np.uint8))
+    sink.close()
@@ -0,0 +1,92 @@
+"""
+Shared image analysis for LUTor
+Everything the style transfer, LUT export and XMP export read from an image
+is collected in one pass and kept together, so an image that several
+endpoints use is only scanned once.
+"""
+
+import threading
+
+import numpy as np
+import cv2
+from PIL import Image
+
+from .image_utils import counts_cdf
+from .lut_generator import unique_color_keys
+
+
+# Largest sample set kept per image; a working preview fits without striding
+MAX_SAMPLES = 1 << 20
+
+
+def sample_stride(height, width, max_samples=MAX_SAMPLES):
+    """Smallest row and column stride keeping the strided pixel grid within max_samples"""
+    return max(1, int(np.ceil(np.sqrt(height * width / max_samples))))
+
+
+class ImageAnalysis:
+    """
+    Per-image statistics, computed once and shared between endpoints
+    Attributes:
+        shape: (height, width) of the analysed image
+        histograms: (3, 256) per-channel value counts over every pixel
+        samples: (h, w, 3) uint8 grid of every stride-th pixel in both directions
+        lab_mean, lab_std: (3,) OpenCV 8-bit LAB statistics of the samples
+    The unique-colour table is only needed for LUT fitting, so it is built from
+    the samples on first use rather than for every style image.
+    """
+
+    def __init__(self, image, max_samples=MAX_SAMPLES):
+        """
+        Args:
+            image: PIL Image or (H, W, 3) uint8 array
+            max_samples: bound on the sample set; larger images are strided
+        """
+        if isinstance(image, Image.Image):
+            image = np.asarray(image.convert('RGB') if image.mode != 'RGB' else image)
+        height, width = image.shape[:2]
+        self.shape = (height, width)
+        self.stride = sample_stride(height, width, max_samples)
+        self.samples = np.ascontiguousarray(image[::self.stride, ::self.stride])
+        self.samples.setflags(write=False)
+        self.histograms = np.stack([
+            cv2.calcHist([image], [c], None, [256], [0, 256]).ravel() for c in range(3)
+        ]).astype(np.int64)
+
+        lab = cv2.cvtColor(self.samples, cv2.COLOR_RGB2LAB).reshape(-1, 3)
+        self.lab_mean = lab.mean(axis=0)
+        self.lab_std = lab.std(axis=0)
+
+        self._unique = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Memory held, counting the unique-colour table whether or not it is built yet"""
+        n_samples = self.samples.shape[0] * self.samples.shape[1]
+        return self.samples.nbytes + self.histograms.nbytes + 16 * n_samples
+
+    def cdfs(self):
+        """Per-channel (values, cdf) pairs, as image_utils.histogram_cdfs returns"""
+        return [counts_cdf(counts) for counts in self.histograms]
+
+    def unique_colors(self):
+        """unique_color_keys of the samples, built once"""
+        with self._lock:
+            if self._unique is None:
+                self._unique = unique_color_keys(self.samples)
+            return self._unique
+
+    def paired_samples(self, other):
+        """
+        This image's samples with the matching samples of another analysis
+        The other image's samples are resized to this grid when the two
+        images differ in size or stride.
+        Returns:
+            ((n, 3) samples, (n, 3) other samples) as uint8 arrays
+        """
+        other_samples = other.samples
+        if other_samples.shape != self.samples.shape:
+            h, w = self.samples.shape[:2]
+            other_samples = cv2.resize(other_samples, (w, h), interpolation=cv2.INTER_AREA)
+        return self.samples.reshape(-1, 3), other_samples.reshape(-1, 3)
@@ -0,0 +1,348 @@
+"""
+Batch processing for LUTor
+Fits a style once and applies it to many images across a process pool.
+
+Usage:
+    python -m utils.batch STYLE INPUT OUTPUT [--workers N] [--strength S] [--format jpeg]
+                                             [--mode histogram|reinhard]
+
+STYLE is a preset ID, a style image or a .cube/.npy LUT. INPUT is a directory
+or a .zip of images; OUTPUT is a directory or a .zip path.
+"""
+
+import argparse
+import functools
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from pathlib import Path, PurePosixPath, PureWindowsPath
+
+import numpy as np
+from PIL import Image
+
+from .analysis import sample_stride
+from .image_utils import histogram_cdfs, lab_stats, lab_transfer_coefficients, matched_strength_curves
+from .lut_generator import identity_lut, load_lut
+from .presets import IMAGE_EXTENSIONS, LUT_EXTENSIONS, PRESETS
+from .render import (ChannelCurves, LabTransfer, LUTTransform, OUTPUT_FORMATS, open_rgb,
+                     render_full_resolution)
+
+
+TRANSFER_MODES = ('histogram', 'reinhard')
+
+
+# --- STYLE SPECS ---
+# A style spec is a small picklable dict sent once to every worker process.
+
+def style_spec_from_image(image, strength=1.0, mode='histogram'):
+    """Histogram-matching or LAB statistics (reinhard) style from a reference image"""
+    if mode == 'reinhard':
+        return style_spec_from_lab_stats(lab_stats(image), strength)
+    return {'kind': 'histogram', 'cdfs': histogram_cdfs(image), 'strength': strength}
+
+
+def style_spec_from_lab_stats(stats, strength=1.0):
+    """LAB statistics style: six numbers, the style image's LAB mean and std"""
+    return {'kind': 'reinhard', 'stats': stats, 'strength': strength}
+
+
+def style_spec_from_lut(lut, strength=1.0, method='tetrahedral'):
+    """LUT style; strength blends the LUT towards identity"""
+    lut = np.asarray(lut, dtype=np.float32)
+    if strength != 1.0:
+        if lut.ndim == 4:
+            identity = identity_lut(lut.shape[0])
+        else:
+            identity = np.linspace(0.0, 1.0, lut.shape[0], dtype=np.float32)[:, None]
+        lut = identity + (lut - identity) * np.float32(strength)
+    return {'kind': 'lut', 'lut': lut, 'method': method}
+
+
+def style_spec_from_preset(preset, strength=1.0, method='tetrahedral', mode='histogram'):
+    """Style spec from a registered preset, reusing its memoized LUT, CDFs or LAB stats"""
+    if preset.has_lut:
+        return style_spec_from_lut(preset.lut(), strength, method)
+    if mode == 'reinhard':
+        return style_spec_from_lab_stats(preset.lab_stats(), strength)
+    return {'kind': 'histogram', 'cdfs': preset.cdfs(), 'strength': strength}
+
+
+def load_style(style, strength=1.0, method='tetrahedral', mode='histogram'):
+    """
+    Build a style spec from a preset ID, a LUT file or a style image path
+    """
+    if mode not in TRANSFER_MODES:
+        raise ValueError(f"Unknown transfer mode '{mode}', expected one of {TRANSFER_MODES}")
+    preset = PRESETS.get(style)
+    if preset is not None:
+        return style_spec_from_preset(preset, strength, method, mode)
+    path = Path(style)
+    if not path.exists():
+        raise ValueError(f"Unknown style '{style}': not a preset ID or an existing file")
+    if path.suffix.lower() in LUT_EXTENSIONS:
+        return style_spec_from_lut(load_lut(path), strength, method)
+    return style_spec_from_image(open_rgb(path), strength, mode)
+
+
+def transform_for(spec, image):
+    """Per-image transform for a style spec"""
+    if spec['kind'] == 'lut':
+        return LUTTransform(spec['lut'], spec['method'])
+    if spec['kind'] == 'reinhard':
+        # Content statistics from a nearest-neighbour sample, without a full-size copy;
+        # the style side is precomputed
+        stride = sample_stride(image.height, image.width)
+        sample = image.resize((max(1, image.width // stride), max(1, image.height // stride)),
+                              Image.NEAREST) if stride > 1 else image
+        content_stats = lab_stats(sample)
+        return LabTransfer(*lab_transfer_coefficients(content_stats, spec['stats']), spec['strength'])
+    hist = np.array(image.histogram()).reshape(3, 256)
+    return ChannelCurves(matched_strength_curves(hist, spec['cdfs'], spec['strength']))
+
+
+# --- INPUTS ---
+
+def is_safe_name(name):
+    """True for a relative name without '..' parts, safe to join onto an output directory"""
+    for pure in (PurePosixPath(name), PureWindowsPath(name)):
+        if pure.is_absolute() or pure.anchor or '..' in pure.parts:
+            return False
+    return bool(name)
+
+
+def list_inputs(path):
+    """
+    List input images as (name, source) jobs
+    source is a file path, or a (zip path, member) pair for zip archives.
+    """
+    path = Path(path)
+    if path.is_dir():
+        files = sorted(p for p in path.rglob('*')
+                       if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+        return [(str(p.relative_to(path)), str(p)) for p in files]
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            # Members that would land outside the output directory are skipped
+            members = sorted(n for n in zf.namelist()
+                             if not n.endswith('/') and Path(n).suffix.lower() in IMAGE_EXTENSIONS
+                             and is_safe_name(n))
+        return [(name, (str(path), name)) for name in members]
+    raise ValueError(f"{path} is neither a directory nor a zip archive")
+
+
+def output_names(names, fmt):
+    """
+    Output file names for input names, one per input
+    Inputs normally keep their stem (a.jpg -> a.png). Inputs whose stems
+    collide in one directory (a.jpg and a.png) keep their extension as well
+    (a.jpg.png, a.png.png), so no output overwrites another.
+    """
+    ext = OUTPUT_FORMATS[fmt][0]
+    stems = [str(Path(name).with_suffix('')).lower() for name in names]
+    counts = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+    return [name + ext if counts[stem] > 1 else str(Path(name).with_suffix(ext))
+            for name, stem in zip(names, stems)]
+
+
+def _open_source(source):
+    if isinstance(source, tuple):
+        zip_path, member = source
+        with zipfile.ZipFile(zip_path) as zf:
+            return open_rgb(io.BytesIO(zf.read(member)))
+    return open_rgb(source)
+
+
+# --- WORKERS ---
+
+_worker_spec = None
+
+
+def _init_worker(spec):
+    global _worker_spec
+    _worker_spec = spec
+
+
+def _process_one(job, spec=None):
+    """
+    Grade one image; returns (output name, bytes or None, error or None)
+    spec defaults to the pool worker's spec from _init_worker.
+    """
+    name, source, output_dir, fmt, out_name = job
+    try:
+        if not is_safe_name(out_name):
+            raise ValueError("unsafe output name")
+        if output_dir is not None:
+            root = Path(output_dir).resolve()
+            out_path = (root / out_name).resolve()
+            if root not in out_path.parents:
+                raise ValueError(f"refusing to write outside {output_dir}")
+        image = _open_source(source)
+        transform = transform_for(_worker_spec if spec is None else spec, image)
+        if output_dir is not None:
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+            render_full_resolution(image, transform, out_path, fmt)
+            return out_name, None, None
+        buffer = io.BytesIO()
+        render_full_resolution(image, transform, buffer, fmt)
+        return out_name, buffer.getvalue(), None
+    except Exception as e:
+        return out_name, None, f"{name}: {e}"
+
+
+def run_batch(spec, inputs, output_dir=None, fmt='jpeg', workers=None, progress=None, start_method=None):
+    """
+    Apply a style spec to many images, yielding results as they finish
+    Args:
+        spec: style spec from load_style / style_spec_from_*
+        inputs: (name, source) jobs from list_inputs
+        output_dir: write results here; if None, results are yielded as bytes
+        fmt: output format, one of render.OUTPUT_FORMATS
+        workers: process count, defaults to the CPU count
+        progress: optional callback(done, total, name, error, elapsed)
+        start_method: multiprocessing start method for the pool, e.g. 'spawn'
+            from a multi-threaded server, where forking would copy held locks
+    Yields:
+        (output name, bytes or None, error or None)
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{fmt}'")
+    names = output_names([name for name, _ in inputs], fmt)
+    jobs = [(name, source, output_dir, fmt, out_name)
+            for (name, source), out_name in zip(inputs, names)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    start = time.perf_counter()
+
+    if workers == 1:
+        # Bound per call: concurrent in-process batches must not share the worker global
+        results = map(functools.partial(_process_one, spec=spec), jobs)
+        pool = None
+    else:
+        import multiprocessing  # only batches with several workers need it
+        context = multiprocessing.get_context(start_method)
+        pool = context.Pool(workers, initializer=_init_worker, initargs=(spec,))
+        results = pool.imap_unordered(_process_one, jobs)
+
+    try:
+        for done, (name, data, error) in enumerate(results, 1):
+            if progress is not None:
+                progress(done, len(jobs), name, error, time.perf_counter() - start)
+            yield name, data, error
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def batch_report(done, failed, elapsed):
+    """Summary dict for a finished batch"""
+    return {
+        'images': done,
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'images_per_second': round(done / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Unseekable sink that lets zipfile output be drained chunk by chunk"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(results, report=None):
+    """
+    Yield the bytes of a zip archive as (name, data, error) results arrive
+    Args:
+        results: iterable from run_batch with output_dir=None
+        report: optional callable returning a dict, stored as batch_report.json
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for name, data, error in results:
+            if data is not None and is_safe_name(name):
+                zf.writestr(name, data)
+            chunk = buffer.take()
+            if chunk:
+                yield chunk
+        if report is not None:
+            zf.writestr('batch_report.json', json.dumps(report(), indent=2))
+    yield buffer.take()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m utils.batch',
+                                     description='Apply one LUTor style to many images.')
+    parser.add_argument('style', help='preset ID, style image or .cube/.npy LUT')
+    parser.add_argument('input', help='directory or .zip of images')
+    parser.add_argument('output', help='output directory, or a path ending in .zip')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--strength', type=float, default=1.0, help='style strength (default: 1.0)')
+    parser.add_argument('--format', default='jpeg', choices=sorted(OUTPUT_FORMATS))
+    parser.add_argument('--method', default='tetrahedral', choices=['trilinear', 'tetrahedral'],
+                        help='LUT interpolation for .cube styles')
+    parser.add_argument('--mode', default='histogram', choices=TRANSFER_MODES,
+                        help='style transfer for image styles: histogram matching or LAB statistics')
+    parser.add_argument('--presets', metavar='DIR', help='register extra presets from a directory')
+    args = parser.parse_args(argv)
+
+    if args.presets:
+        PRESETS.load_directory(args.presets)
+
+    spec = load_style(args.style, args.strength, args.method, args.mode)
+    inputs = list_inputs(args.input)
+    if not inputs:
+        print(f"No images found in {args.input}", file=sys.stderr)
+        return 1
+
+    failed = []
+    start = time.perf_counter()
+
+    def progress(done, total, name, error, elapsed):
+        status = f"FAILED ({error})" if error else name
+        rate = done / elapsed if elapsed > 0 else 0.0
+        print(f"[{done:>{len(str(total))}}/{total}] {status}  ({rate:.2f} img/s)", file=sys.stderr)
+
+    def collect(results):
+        for name, data, error in results:
+            if error:
+                failed.append(error)
+            yield name, data, error
+
+    to_zip = args.output.lower().endswith('.zip')
+    output_dir = None if to_zip else args.output
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    results = collect(run_batch(spec, inputs, output_dir, args.format, args.workers, progress))
+    if to_zip:
+        with open(args.output, 'wb') as f:
+            for chunk in stream_zip(results):
+                f.write(chunk)
+    else:
+        for _ in results:
+            pass
+
+    report = batch_report(len(inputs) - len(failed), failed, time.perf_counter() - start)
+    print(json.dumps(report, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,483 @@
+"""
+Benchmarks for LUTor
+Times cold start, the colour pipeline and every /api route on deterministic synthetic
+images, and compares the results against a stored baseline.
+
+Usage:
+    python -m utils.benchmark [--sizes 0.25,1,4,12,50] [--repeat 3] [--output results.json]
+                              [--baseline baseline.json] [--threshold 0.2] [--filter NAME]
+
+Save a run with --output on a reference machine and pass it back as
+--baseline later; the command exits with status 1 if any case got slower
+(or used more memory) than the baseline by more than the threshold.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+import numpy as np
+import cv2
+from PIL import Image
+
+from .image_utils import load_preview, match_histogram
+from .lut_generator import LUTGenerator
+
+
+DEFAULT_SIZES = (0.25, 1, 4, 12, 50)  # megapixels
+LUT_SIZES = (17, 33, 64)
+ROUTE_IMAGE_MP = 1.0  # HTTP cases use preview-sized images
+MIN_RSS_CHECK_MB = 16  # smaller memory growth is too noisy to compare
+
+
+# --- SYNTHETIC IMAGES ---
+
+def synthetic_image(megapixels, seed=0, chunk_rows=1024):
+    """
+    Deterministic 4:3 RGB test image of roughly the given size
+    Smooth gradients and colour blobs plus seeded noise, so histograms and
+    unique colour counts look like a photo rather than a flat test card.
+    """
+    width = max(16, int(round((megapixels * 1e6 * 4 / 3) ** 0.5)))
+    height = max(12, int(round(width * 3 / 4)))
+    x = np.arange(width, dtype=np.float32) / width
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    for y0 in range(0, height, chunk_rows):
+        y = (np.arange(y0, min(y0 + chunk_rows, height), dtype=np.float32) / height)[:, None]
+        rng = np.random.default_rng((seed, y0))
+        noise = rng.normal(0, 12, (y.shape[0], width, 3)).astype(np.float32)
+        tile = np.empty(noise.shape, dtype=np.float32)
+        tile[..., 0] = 255 * x * (0.6 + 0.4 * np.sin(7 * y + seed))
+        tile[..., 1] = 255 * y * (0.5 + 0.5 * np.cos(5 * x))
+        tile[..., 2] = 127 + 100 * np.sin(11 * (x + y) + seed)
+        tile += noise
+        image[y0:y0 + y.shape[0]] = np.clip(tile, 0, 255)
+    return image
+
+
+def synthetic_stylized(image):
+    """A fixed per-channel grade of a synthetic image, used as the 'after' image"""
+    ramp = np.arange(256, dtype=np.float32) / 255
+    curves = np.stack([ramp ** 0.8, ramp ** 1.1, 0.1 + 0.8 * ramp], axis=1)
+    table = np.clip(curves * 255, 0, 255).astype(np.uint8).reshape(256, 1, 3)
+    return cv2.LUT(image, table)
+
+
+def _encode(image, fmt='JPEG'):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format=fmt, quality=90)
+    return buffer.getvalue()
+
+
+# --- MEASUREMENT ---
+
+def _current_rss():
+    """Resident set size in bytes (Linux), or None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class _PeakRSS:
+    """Sample RSS in a background thread while a block runs"""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.start = self.peak = _current_rss()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def __enter__(self):
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _current_rss())
+
+
+class Case:
+    """
+    One benchmark: an untimed setup before every run and a timed run
+    Args:
+        name: benchmark name, e.g. 'match_histogram'
+        params: dict identifying the variant, e.g. {'mp': 4}
+        run: callable timed on each repeat
+        work: amount of work per run, for throughput
+        unit: unit of work, e.g. 'MP'
+        setup: optional callable run (untimed) before each repeat
+    """
+
+    def __init__(self, name, params, run, work=1.0, unit='run', setup=None):
+        self.name = name
+        self.params = params
+        self.run = run
+        self.work = work
+        self.unit = unit
+        self.setup = setup
+
+    @property
+    def id(self):
+        params = ','.join(f'{k}={v}' for k, v in self.params.items())
+        return f'{self.name}[{params}]' if params else self.name
+
+    def measure(self, repeat):
+        times = []
+        with _PeakRSS() as rss:
+            for _ in range(repeat):
+                if self.setup is not None:
+                    self.setup()
+                start = time.perf_counter()
+                self.run()
+                times.append(time.perf_counter() - start)
+        median = statistics.median(times)
+        result = {
+            'id': self.id,
+            'name': self.name,
+            'params': self.params,
+            'repeat': repeat,
+            'seconds_min': round(min(times), 6),
+            'seconds_median': round(median, 6),
+            'throughput': round(self.work / median, 3) if median > 0 else None,
+            'throughput_unit': f'{self.unit}/s',
+        }
+        if rss.start is not None:
+            result['peak_rss_mb'] = round(rss.peak / 2 ** 20, 1)
+            result['rss_delta_mb'] = round((rss.peak - rss.start) / 2 ** 20, 1)
+        return result
+
+
+# --- PIPELINE CASES ---
+
+def pipeline_cases(sizes):
+    """Cases for the colour pipeline functions at each image size"""
+    from app import base64_to_image, image_to_base64
+
+    for mp in sizes:
+        original = synthetic_image(mp, seed=1)
+        stylized = synthetic_stylized(original)
+        style = synthetic_image(min(mp, ROUTE_IMAGE_MP), seed=2)
+        actual_mp = original.shape[0] * original.shape[1] / 1e6
+        params = {'mp': mp}
+
+        yield Case('match_histogram', params, lambda o=original, s=style: match_histogram(o, s),
+                   actual_mp, 'MP')
+        for lut_size in LUT_SIZES:
+            generator = LUTGenerator(lut_size=lut_size)
+            yield Case('lut_from_mapping', {**params, 'lut_size': lut_size},
+                       lambda g=generator, o=original, s=stylized: g._generate_lut_from_mapping(o, s),
+                       actual_mp, 'MP')
+            yield Case('lut_from_splat', {**params, 'lut_size': lut_size},
+                       lambda g=generator, o=original, s=stylized: g._generate_lut_from_splat(o, s),
+                       actual_mp, 'MP')
+        yield Case('analyze_color_adjustments', params,
+                   lambda g=generator, o=original, s=stylized: g._analyze_color_adjustments(o, s),
+                   actual_mp, 'MP')
+
+        pil_image = Image.fromarray(original)
+        data_uri = image_to_base64(pil_image)
+        yield Case('base64_encode', params, lambda i=pil_image: image_to_base64(i), actual_mp, 'MP')
+        yield Case('base64_decode', params, lambda d=data_uri: base64_to_image(d), actual_mp, 'MP')
+        jpeg = _encode(original)
+        yield Case('load_preview', params, lambda d=jpeg: load_preview(io.BytesIO(d), 800),
+                   actual_mp, 'MP')
+        del original, stylized, style, pil_image, data_uri, jpeg
+
+
+def cube_cases(tmp_dir):
+    """Cases for writing .cube files"""
+    for lut_size in LUT_SIZES:
+        axis = np.linspace(0, 1, lut_size, dtype=np.float32)
+        lut = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1) ** 0.9
+        generator = LUTGenerator(lut_size=lut_size)
+        path = os.path.join(tmp_dir, f'bench_{lut_size}.cube')
+        yield Case('save_cube_file', {'lut_size': lut_size},
+                   lambda g=generator, l=lut, p=path: g._save_cube_file(l, p),
+                   lut_size ** 3 / 1e6, 'Mcells')
+
+
+# --- STARTUP ---
+
+def startup_cases(tmp_dir):
+    """Cold start of a fresh interpreter: importing the app and init_app"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = f'import sys; sys.path.insert(0, {root!r}); import app; app.init_app()'
+    # Run in the temporary directory so the upload folders are created there
+    yield Case('startup', {'stage': 'init'},
+               lambda: subprocess.run([sys.executable, '-c', code], cwd=tmp_dir, check=True,
+                                      stdout=subprocess.DEVNULL))
+
+
+# --- HTTP CASES ---
+
+def _check(response, expected=(200,)):
+    if response.status_code not in expected:
+        raise RuntimeError(f'{response.request.path} returned {response.status_code}: '
+                           f'{response.get_data(as_text=True)[:200]}')
+    response.get_data()  # consume streamed bodies
+    return response
+
+
+def route_cases(tmp_dir, batch_images=4, video_frames=24):
+    """
+    Cases for every /api route through Flask's test client
+    Returns:
+        (list of cases, set of /api rules without a case)
+    """
+    import app as lutor
+
+    app = lutor.app
+    for key, folder in (('UPLOAD_FOLDER', ''), ('ORIGINALS_FOLDER', 'originals'),
+                        ('EXPORT_FOLDER', 'exports'), ('BATCH_FOLDER', 'batch'), ('VIDEO_FOLDER', 'video'),
+                        ('IMAGE_STORE_SPILL_FOLDER', 'image_store')):
+        app.config[key] = os.path.join(tmp_dir, 'web', folder)
+    app.config['ARTIFACT_FOLDER'] = None  # time generation, not the disk tier
+    app.config['PRESET_FOLDER'] = os.path.join(tmp_dir, 'no-presets')
+    lutor.init_app()
+    client = app.test_client()
+
+    content = synthetic_image(ROUTE_IMAGE_MP, seed=3)
+    style = synthetic_image(0.25, seed=4)
+    content_jpeg, style_jpeg = _encode(content), _encode(style)
+
+    def upload(data, name):
+        return _check(client.post('/api/upload', data={'file': (io.BytesIO(data), name)},
+                                  content_type='multipart/form-data')).json
+
+    content_id = upload(content_jpeg, 'content.jpg')['image_id']
+    style_id = upload(style_jpeg, 'style.jpg')['image_id']
+    transfer = {'content_image_id': content_id, 'style_image_id': style_id, 'strength': 0.8}
+    stylized_id = _check(client.post('/api/style_transfer', json=transfer)).json['stylized_image_id']
+    pair = {'original_image_id': content_id, 'stylized_image_id': stylized_id}
+    # An uploaded look has no known curves, so its LUT is fitted
+    fitted_id = upload(_encode(synthetic_stylized(content)), 'stylized.jpg')['image_id']
+    fitted_pair = {'original_image_id': content_id, 'stylized_image_id': fitted_id}
+
+    def clear_caches():
+        lutor.style_cache.clear()
+        lutor.matched_cache.clear()
+        lutor.analysis_cache.clear()
+        lutor.artifact_cache.clear()
+
+    def wait_for(job_id):
+        while True:
+            status = _check(client.get(f'/api/jobs/{job_id}')).json
+            if status['status'] not in ('queued', 'running'):
+                return status
+            time.sleep(0.005)
+
+    def run_job():
+        job = _check(client.post('/api/jobs/export_lut', json=fitted_pair), (202,)).json
+        return wait_for(job['job_id'])
+
+    finished_job = run_job()['job_id']
+    lut_response = _check(client.post('/api/export_lut', json=pair))
+    artifact_key = lut_response.headers['X-Artifact-Key']
+
+    batch_zip = io.BytesIO()
+    with zipfile.ZipFile(batch_zip, 'w') as zf:
+        for i in range(batch_images):
+            zf.writestr(f'img_{i}.jpg', _encode(synthetic_image(0.25, seed=10 + i)))
+    batch_bytes = batch_zip.getvalue()
+
+    clip_path = os.path.join(tmp_dir, 'clip.avi')
+    writer = cv2.VideoWriter(clip_path, cv2.VideoWriter_fourcc(*'MJPG'), 24.0, (640, 360))
+    for i in range(video_frames):
+        writer.write(cv2.resize(synthetic_image(0.25, seed=20 + i), (640, 360)))
+    writer.release()
+    with open(clip_path, 'rb') as f:
+        clip_bytes = f.read()
+
+    mp = {'mp': ROUTE_IMAGE_MP}
+    cases = {
+        '/api/upload': [Case('route', {'route': '/api/upload', **mp},
+                             lambda: upload(content_jpeg, 'content.jpg'))],
+        '/api/style_transfer': [
+            Case('route', {'route': '/api/style_transfer', 'cache': 'cold', **mp},
+                 lambda: _check(client.post('/api/style_transfer', json=transfer)),
+                 setup=clear_caches),
+            Case('route', {'route': '/api/style_transfer', 'cache': 'warm', **mp},
+                 lambda: _check(client.post('/api/style_transfer', json=transfer))),
+        ],
+        '/api/export_lut': [
+            Case('route', {'route': '/api/export_lut', 'cache': 'cold', 'look': 'curves', **mp},
+                 lambda: _check(client.post('/api/export_lut', json=pair)), setup=clear_caches),
+            Case('route', {'route': '/api/export_lut', 'cache': 'cold', 'look': 'fitted', **mp},
+                 lambda: _check(client.post('/api/export_lut', json=fitted_pair)), setup=clear_caches),
+            Case('route', {'route': '/api/export_lut', 'cache': 'etag', **mp},
+                 lambda: _check(client.post('/api/export_lut', json=pair,
+                                            headers={'If-None-Match': f'"{artifact_key}"'}), (304,))),
+        ],
+        '/api/preview_lut': [
+            Case('route', {'route': '/api/preview_lut', 'mode': mode, **mp},
+                 lambda mode=mode: _check(client.post('/api/preview_lut', json={
+                     **transfer, 'transfer_mode': mode})), setup=clear_caches)
+            for mode in ('histogram', 'reinhard')],
+        '/api/export_xmp': [Case('route', {'route': '/api/export_xmp', **mp},
+                                 lambda: _check(client.post('/api/export_xmp', json=pair)),
+                                 setup=clear_caches)],
+        '/api/artifacts/<key>': [Case('route', {'route': '/api/artifacts/<key>'},
+                                      lambda: _check(client.get(f'/api/artifacts/{artifact_key}')),
+                                      setup=lambda: lutor.artifact_cache.put(artifact_key,
+                                                                             lut_response.data))],
+        '/api/images/<image_id>': [
+            Case('route', {'route': '/api/images/<image_id>', 'format': fmt, **mp},
+                 lambda fmt=fmt: _check(client.get(f'/api/images/{content_id}?format={fmt}')))
+            for fmt in ('jpeg', 'webp')],
+        '/api/cache_stats': [Case('route', {'route': '/api/cache_stats'},
+                                  lambda: _check(client.get('/api/cache_stats')))],
+        '/api/export_full': [
+            Case('route', {'route': '/api/export_full', 'format': fmt, **mp},
+                 lambda fmt=fmt: _check(client.post('/api/export_full', json={
+                     **transfer, 'format': fmt})))
+            for fmt in ('png', 'tiff', 'jpeg')],
+        '/api/batch': [Case('route', {'route': '/api/batch', 'images': batch_images},
+                            lambda: _check(client.post('/api/batch', data={
+                                'inputs': (io.BytesIO(batch_bytes), 'inputs.zip'),
+                                'style_id': 'warm', 'format': 'jpeg'},
+                                content_type='multipart/form-data')),
+                            batch_images, 'images')],
+        '/api/video': [Case('route', {'route': '/api/video', 'frames': video_frames},
+                            lambda: _check(client.post('/api/video', data={
+                                'video': (io.BytesIO(clip_bytes), 'clip.avi'),
+                                'style_id': 'warm', 'format': 'avi'},
+                                content_type='multipart/form-data')),
+                            video_frames, 'frames')],
+        '/api/preset_styles': [Case('route', {'route': '/api/preset_styles'},
+                                    lambda: _check(client.get('/api/preset_styles')))],
+        '/api/generate_preset_style': [Case('route', {'route': '/api/generate_preset_style'},
+                                            lambda: _check(client.post('/api/generate_preset_style',
+                                                                       json={'style_id': 'warm'})))],
+        '/api/jobs/export_lut': [Case('route', {'route': '/api/jobs/export_lut', **mp}, run_job,
+                                      setup=clear_caches)],
+        '/api/jobs/<job_id>': [Case('route', {'route': '/api/jobs/<job_id>'},
+                                    lambda: _check(client.get(f'/api/jobs/{finished_job}')))],
+        '/api/jobs/<job_id>/cancel': [Case('route', {'route': '/api/jobs/<job_id>/cancel'},
+                                           lambda: _check(client.post(f'/api/jobs/{finished_job}/cancel')))],
+        '/api/jobs/<job_id>/result': [Case('route', {'route': '/api/jobs/<job_id>/result'},
+                                           lambda: _check(client.get(f'/api/jobs/{finished_job}/result')))],
+    }
+    api_rules = {rule.rule for rule in app.url_map.iter_rules() if rule.rule.startswith('/api/')}
+    uncovered = api_rules - set(cases)
+    return [case for rule in sorted(cases) if rule in api_rules for case in cases[rule]], uncovered
+
+
+# --- BASELINE ---
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline run
+    Returns:
+        list of regression descriptions (empty if none)
+    """
+    previous = {r['id']: r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        base = previous.get(result['id'])
+        if base is None:
+            continue
+        ratio = result['seconds_median'] / base['seconds_median'] if base['seconds_median'] else 1.0
+        result['vs_baseline'] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append(f"{result['id']}: {ratio:.2f}x slower "
+                               f"({base['seconds_median']:.4f}s -> {result['seconds_median']:.4f}s)")
+        before, after = base.get('rss_delta_mb'), result.get('rss_delta_mb')
+        if before is not None and after is not None and after - before >= MIN_RSS_CHECK_MB \
+                and after > before * (1 + threshold):
+            regressions.append(f"{result['id']}: memory {before:.0f}MB -> {after:.0f}MB")
+    return regressions
+
+
+def environment():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m utils.benchmark',
+                                     description='Benchmark the LUTor pipeline and API.')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma-separated image sizes in megapixels')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case (default: 3)')
+    parser.add_argument('--filter', default=None, help='only run cases whose ID contains this')
+    parser.add_argument('--skip-routes', action='store_true', help='skip the HTTP cases')
+    parser.add_argument('--output', default=None, help='write JSON results here (default: stdout)')
+    parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown vs. the baseline (default: 0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    sizes = [float(s) if '.' in s else int(s) for s in args.sizes.split(',') if s]
+    tmp_dir = tempfile.mkdtemp(prefix='lutor-bench-')
+    results, uncovered = [], set()
+    try:
+        groups = [startup_cases(tmp_dir), pipeline_cases(sizes), cube_cases(tmp_dir)]
+        if not args.skip_routes:
+            cases, uncovered = route_cases(tmp_dir)
+            groups.append(cases)
+        for group in groups:
+            for case in group:
+                if args.filter and args.filter not in case.id:
+                    continue
+                result = case.measure(args.repeat)
+                results.append(result)
+                print(f"{result['id']:<60} {result['seconds_median'] * 1000:>10.2f} ms  "
+                      f"{result['throughput']:>10} {result['throughput_unit']:<10} "
+                      f"{result.get('rss_delta_mb', '-'):>8} MB", file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    for rule in sorted(uncovered):
+        print(f"⚠️  No benchmark for {rule}", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"🔴 Regression: {line}", file=sys.stderr)
+
+    report = {
+        'environment': environment(),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'results': results,
+        'uncovered_routes': sorted(uncovered),
+        'regressions': regressions,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
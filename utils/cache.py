@@ -0,0 +1,210 @@
+"""
+Caching utilities for LUTor
+Bounded, thread-safe LRU caches keyed by content hashes
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+def content_hash(*parts):
+    """
+    Hash strings, bytes and numpy arrays into a hex digest
+    Arrays contribute their shape and dtype as well as their raw bytes.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(f"{part.shape}{part.dtype}".encode())
+            h.update(np.ascontiguousarray(part).data)
+        elif isinstance(part, str):
+            h.update(part.encode())
+        elif isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(part)
+        else:
+            h.update(repr(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def estimate_nbytes(value):
+    """Rough memory footprint of arrays, bytes, containers of them and objects with nbytes"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(getattr(value, 'nbytes', None), int):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(v) for v in value)
+    return 64
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries=128, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def get(self, key, default=None):
+        """Return the cached value and mark it recently used"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, nbytes=None):
+        """Insert a value, evicting least recently used entries as needed"""
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, nbytes)
+            self.bytes += nbytes
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss"""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value, nbytes = self._data.pop(key)
+                self.bytes -= nbytes
+                return value
+            return default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class ArtifactCache(LRUCache):
+    """
+    LRU cache of generated files (bytes) keyed by content hash
+    Entries are optionally mirrored to a disk tier that outlives memory
+    eviction and restarts; disk reads are promoted back into memory.
+    Keys are used as file names, so they must be plain names like '<hash>.cube'.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, disk_dir=None,
+                 max_disk_bytes=512 * 1024 * 1024):
+        super().__init__(max_entries, max_bytes)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_hits = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _path(self, key):
+        if self.disk_dir is None or Path(key).name != key or key.startswith('.'):
+            return None
+        return self.disk_dir / key
+
+    def get(self, key, default=None):
+        sentinel = object()
+        value = super().get(key, sentinel)
+        if value is not sentinel:
+            return value
+        path = self._path(key)
+        if path is None:
+            return default
+        try:
+            value = path.read_bytes()
+            os.utime(path)  # disk tier is LRU by modification time
+        except OSError:
+            return default
+        with self._lock:
+            self.disk_hits += 1
+        LRUCache.put(self, key, value)
+        return value
+
+    def put(self, key, value, nbytes=None):
+        super().put(key, value, nbytes)
+        path = self._path(key)
+        if path is None or path.exists():
+            return
+        tmp = path.with_name(f'.{key}.{threading.get_ident()}.tmp')
+        try:
+            tmp.write_bytes(value)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        files = []
+        for path in self.disk_dir.iterdir():
+            if path.name.startswith('.'):
+                continue  # writes in progress
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        stats = super().stats()
+        stats['disk_hits'] = self.disk_hits
+        return stats
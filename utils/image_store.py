@@ -0,0 +1,215 @@
+"""
+Server-side image store for LUTor
+Keeps decoded images in memory under opaque IDs so clients can refer to
+uploads without sending them back as base64 on every request.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .cache import content_hash
+
+
+class ImageStore:
+    """
+    Memory-bounded image store with TTL and LRU eviction
+    When memory runs over budget the least recently used images are spilled
+    to disk (if a spill directory is configured) and reloaded on access.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, ttl=3600, spill_dir=None,
+                 max_disk_bytes=2 * 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # id -> (array, last_access)
+        self._disk = OrderedDict()    # id -> (path, nbytes, last_access)
+        self._spilling = {}           # id -> (array, last_access) while written to disk
+        self._loading = {}            # id -> Event set once a spilled image is reloaded
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def put(self, image):
+        """
+        Store an image and return its ID
+        Args:
+            image: PIL Image or (H, W, 3) array
+        Returns:
+            opaque string ID, derived from the pixel content
+        """
+        if isinstance(image, Image.Image):
+            image = np.array(image.convert('RGB'))
+        array = np.ascontiguousarray(image)
+        array.setflags(write=False)
+        image_id = content_hash(array)
+        now = time.monotonic()
+
+        with self._lock:
+            if image_id in self._memory:
+                self._memory.move_to_end(image_id)
+                self._memory[image_id] = (self._memory[image_id][0], now)
+                return image_id
+            if image_id in self._spilling:
+                self._spilling[image_id] = (self._spilling[image_id][0], now)
+                return image_id
+            if image_id in self._disk:
+                self._remove_spilled(image_id)
+            self._memory[image_id] = (array, now)
+            self.bytes += array.nbytes
+            victims = self._enforce_limits(now)
+        self._write_spills(victims)
+        return image_id
+
+    def get(self, image_id):
+        """Return the stored array (read-only) or None if unknown or expired"""
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                self._expire(now)
+                entry = self._memory.get(image_id)
+                if entry is not None:
+                    self._memory.move_to_end(image_id)
+                    self._memory[image_id] = (entry[0], now)
+                    self.hits += 1
+                    return entry[0]
+
+                entry = self._spilling.get(image_id)
+                if entry is not None:
+                    # Still being written out; the array is at hand
+                    self._spilling[image_id] = (entry[0], now)
+                    self.hits += 1
+                    return entry[0]
+
+                loading = self._loading.get(image_id)
+                if loading is None:
+                    spilled = self._disk.get(image_id)
+                    if spilled is None:
+                        self.misses += 1
+                        return None
+                    path = spilled[0]
+                    self._drop_from_disk(image_id)
+                    loaded = self._loading[image_id] = threading.Event()
+                    break
+            # Another thread is reloading it; look again once it is done
+            loading.wait()
+
+        # Reload outside the lock; disk reads can be slow
+        try:
+            array = np.load(path)
+            array.setflags(write=False)
+        except (OSError, ValueError):
+            array = None  # gone, truncated or corrupt
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        victims = []
+        with self._lock:
+            del self._loading[image_id]
+            if array is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if image_id not in self._memory and image_id not in self._spilling:
+                    self._memory[image_id] = (array, now)
+                    self.bytes += array.nbytes
+                    victims = self._enforce_limits(now)
+        loaded.set()
+        self._write_spills(victims)
+        return array
+
+    def get_image(self, image_id):
+        """Return the stored image as a PIL Image, or None"""
+        array = self.get(image_id)
+        return Image.fromarray(array) if array is not None else None
+
+    def __contains__(self, image_id):
+        with self._lock:
+            return any(image_id in table for table in (self._memory, self._spilling, self._loading, self._disk))
+
+    def _expire(self, now):
+        if not self.ttl:
+            return
+        for image_id, (array, last) in list(self._memory.items()):
+            if now - last > self.ttl:
+                del self._memory[image_id]
+                self.bytes -= array.nbytes
+        for image_id, (_, _, last) in list(self._disk.items()):
+            if now - last > self.ttl:
+                self._remove_spilled(image_id)
+
+    def _enforce_limits(self, now):
+        """
+        Evict least recently used images down to max_bytes; call with the lock held
+        Returns:
+            IDs to pass to _write_spills once the lock is released
+        """
+        self._expire(now)
+        victims = []
+        while self.bytes > self.max_bytes and len(self._memory) > 1:
+            image_id, (array, last) = self._memory.popitem(last=False)
+            self.bytes -= array.nbytes
+            if self.spill_dir:
+                # Readers find it here until it is on disk
+                self._spilling[image_id] = (array, last)
+                victims.append(image_id)
+        return victims
+
+    def _write_spills(self, victims):
+        """Write evicted images to disk; call without the lock, disk writes can be slow"""
+        for image_id in victims:
+            with self._lock:
+                array = self._spilling[image_id][0]
+            path = self.spill_dir / f"{image_id}.npy"
+            try:
+                np.save(path, array)
+            except OSError:
+                path = None
+            with self._lock:
+                _, last = self._spilling.pop(image_id)
+                if path is not None:
+                    self._disk[image_id] = (path, array.nbytes, last)
+                    self.disk_bytes += array.nbytes
+                    self.spills += 1
+                while self.disk_bytes > self.max_disk_bytes and self._disk:
+                    self._remove_spilled(next(iter(self._disk)))
+
+    def _drop_from_disk(self, image_id):
+        if image_id in self._disk:
+            _, nbytes, _ = self._disk.pop(image_id)
+            self.disk_bytes -= nbytes
+
+    def _remove_spilled(self, image_id):
+        path = self._disk[image_id][0]
+        self._drop_from_disk(image_id)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._memory),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'spilled_entries': len(self._disk),
+                'disk_bytes': self.disk_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'spills': self.spills,
+            }
@@ -2,11 +2,35 @@
 Image processing utilities for LUTor
 """
 
+import io
+
 from PIL import Image
 import numpy as np
 import cv2
 
 
+ORIENTATION_TAG = 0x0112
+# EXIF orientation -> transpose that makes the image upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# Box-reduce until the image is at most this many times the target size,
+# then finish with LANCZOS; at 3x the result is indistinguishable
+REDUCING_GAP = 3
+
+# format -> (PIL format, mimetype, save options tuned for encode speed)
+PREVIEW_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', {'subsampling': 2}),  # 4:2:0, no optimize pass
+    'webp': ('WEBP', 'image/webp', {'method': 0}),       # fastest WebP encoder setting
+}
+
+
 def load_image(path):
     """Load image from file path"""
     try:
@@ -30,7 +54,12 @@ def resize_keep_aspect(img, target_size):
     Returns:
         resized PIL Image
     """
-    w, h = img.size
+    return img.resize(fit_size(img.size, target_size), Image.LANCZOS)
+
+
+def fit_size(size, target_size):
+    """(width, height) with the longer side scaled to target_size"""
+    w, h = size
     
     if w > h:
         new_w = target_size
@@ -39,7 +68,64 @@ def resize_keep_aspect(img, target_size):
         new_h = target_size
         new_w = int(w * target_size / h)
     
-    return img.resize((new_w, new_h), Image.LANCZOS)
+    return max(1, new_w), max(1, new_h)
+
+
+def image_orientation(img):
+    """EXIF orientation of an opened image (1 if missing), read from the header only"""
+    try:
+        return img.getexif().get(ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+
+
+def apply_orientation(img, orientation):
+    """Rotate/flip an image upright for its EXIF orientation"""
+    method = ORIENTATION_TRANSPOSE.get(orientation)
+    return img.transpose(method) if method is not None else img
+
+
+def load_preview(source, target_size):
+    """
+    Decode an image straight to preview size
+    JPEGs are decoded at a reduced DCT scale (draft mode) and large images are
+    box-reduced by an integer factor before the final LANCZOS resample, so the
+    full-resolution pixels are never held in memory. EXIF orientation is
+    applied to the small result.
+    Args:
+        source: path or file object
+        target_size: int, target size for the longer side
+    Returns:
+        (preview PIL Image in RGB, full-resolution (width, height) once upright)
+    """
+    img = Image.open(source)
+    orientation = image_orientation(img)
+    w, h = img.size
+    full_size = (h, w) if orientation in (5, 6, 7, 8) else (w, h)
+    preview_size = fit_size((w, h), target_size)
+    
+    if preview_size[0] < w:
+        img.draft('RGB', preview_size)  # no-op for formats other than JPEG
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    factor = min(img.size[0] // preview_size[0], img.size[1] // preview_size[1]) // REDUCING_GAP
+    if factor > 1:
+        img = img.reduce(factor)
+    
+    preview = img.resize(preview_size, Image.LANCZOS)
+    return apply_orientation(preview, orientation), full_size
+
+
+def encode_image(img, fmt='jpeg', quality=85):
+    """
+    Encode a PIL Image for display
+    Returns:
+        (bytes, mimetype)
+    """
+    pil_format, mimetype, options = PREVIEW_FORMATS[fmt]
+    buffer = io.BytesIO()
+    img.save(buffer, format=pil_format, quality=quality, **options)
+    return buffer.getvalue(), mimetype
 
 
 def rgb_to_lab(img):
@@ -58,6 +144,70 @@ def lab_to_rgb(lab):
     return Image.fromarray(rgb)
 
 
+def lab_stats(img, stride=1):
+    """
+    Per-channel mean and standard deviation of an image in 8-bit LAB
+    Args:
+        img: PIL Image or uint8 RGB array
+        stride: only look at every stride-th row and column
+    Returns:
+        ((3,) mean, (3,) std) in OpenCV 8-bit LAB units
+    """
+    if isinstance(img, Image.Image):
+        img = np.asarray(img)
+    lab = rgb_to_lab(np.ascontiguousarray(img[::stride, ::stride])).reshape(-1, 3)
+    return lab.mean(axis=0), lab.std(axis=0)
+
+
+def lab_transfer_coefficients(source_stats, target_stats):
+    """
+    Per-channel affine LAB transform giving the source the target's statistics
+    Reinhard et al. colour transfer: (lab - source mean) * target std / source
+    std + target mean, folded into one scale and offset per channel.
+    Args:
+        source_stats, target_stats: (mean, std) pairs from lab_stats
+    Returns:
+        ((3,) scale, (3,) offset)
+    """
+    source_mean, source_std = (np.asarray(v, dtype=np.float64) for v in source_stats)
+    target_mean, target_std = (np.asarray(v, dtype=np.float64) for v in target_stats)
+    scale = target_std / np.maximum(source_std, 1e-6)
+    return scale, target_mean - source_mean * scale
+
+
+def reinhard_transfer(source, scale, offset, tile_rows=256):
+    """
+    Apply a lab_transfer_coefficients transform to an RGB image in row tiles
+    Each tile is converted to LAB, transformed by one fused, saturating affine
+    pass and converted back, so only a tile of LAB data exists at a time.
+    Args:
+        source: PIL Image or uint8 RGB array
+    Returns:
+        uint8 RGB array
+    """
+    source = np.asarray(source)
+    matrix = np.hstack([np.diag(scale), np.reshape(offset, (3, 1))]).astype(np.float32)
+    out = np.empty_like(source)
+    for y in range(0, source.shape[0], tile_rows):
+        lab = rgb_to_lab(np.ascontiguousarray(source[y:y + tile_rows]))
+        out[y:y + tile_rows] = np.asarray(lab_to_rgb(cv2.transform(lab, matrix)))
+    return out
+
+
+def blend_images(base, overlay, alpha):
+    """
+    Blend two uint8 images as base * (1 - alpha) + overlay * alpha
+    Single fused, saturating pass; alpha may go above 1 to extrapolate.
+    Args:
+        base, overlay: PIL Images or uint8 arrays of the same size
+    Returns:
+        blended uint8 array
+    """
+    base = np.asarray(base)
+    overlay = np.asarray(overlay)
+    return cv2.addWeighted(base, 1.0 - alpha, overlay, alpha, 0.0)
+
+
 def calculate_histogram(img, bins=256):
     """Calculate color histogram for an image"""
     if isinstance(img, Image.Image):
@@ -70,45 +220,153 @@ def calculate_histogram(img, bins=256):
     return hist_r, hist_g, hist_b
 
 
-def match_histogram(source, target):
+def channel_cdf(channel, bins=256):
+    """
+    Cumulative distribution of an integer image channel
+    Args:
+        channel: uint8 (bins=256) or uint16 (bins=65536) array
+        bins: number of possible values
+    Returns:
+        (counts, values, cdf): per-value counts, the values present in the
+        channel and the normalised CDF at those values
+    """
+    counts = np.bincount(channel.ravel(), minlength=bins)
+    return (counts,) + counts_cdf(counts)
+
+
+def counts_cdf(counts):
+    """(values, cdf) of a channel from its per-value counts, as in channel_cdf"""
+    values = np.flatnonzero(counts)
+    cdf = np.cumsum(counts)[values].astype(np.float64)
+    cdf /= cdf[-1]
+    return values, cdf
+
+
+def match_histogram_curve(source_counts, target_values, target_cdf, dtype=np.uint8):
+    """
+    Build the per-value lookup table mapping a source channel onto a target CDF
+    Args:
+        source_counts: per-value counts of the source channel
+        target_values, target_cdf: target channel distribution from channel_cdf
+    Returns:
+        lookup table with one entry per possible source value
+    """
+    s_cdf = np.cumsum(source_counts).astype(np.float64)
+    s_cdf /= s_cdf[-1]
+    return np.interp(s_cdf, target_cdf, target_values).astype(dtype)
+
+
+def _bins_for(img):
+    if img.dtype == np.uint8:
+        return 256
+    if img.dtype == np.uint16:
+        return 65536
+    raise ValueError(f"Histogram matching needs uint8 or uint16 data, got {img.dtype}")
+
+
+def _check_same_depth(source, target):
+    if source.dtype != target.dtype:
+        raise ValueError(f"Histogram matching needs images of one bit depth, "
+                         f"got {source.dtype} and {target.dtype}")
+
+
+def apply_channel_curves(img, curves):
+    """Apply one lookup table per channel to an (H, W, 3) integer image"""
+    if img.dtype == np.uint8:
+        return cv2.LUT(img, np.stack(curves, axis=1).reshape(256, 1, 3))
+    matched = np.empty_like(img)
+    for i in range(3):
+        matched[:, :, i] = np.take(curves[i], img[:, :, i])
+    return matched
+
+
+def histogram_cdfs(img):
+    """
+    Per-channel (values, cdf) pairs of an RGB image, as used by match_histogram
+    These only depend on the target image, so callers can cache them.
+    """
+    if isinstance(img, Image.Image):
+        img = np.array(img)
+    bins = _bins_for(img)
+    return [channel_cdf(img[:, :, i], bins)[1:] for i in range(3)]
+
+
+def match_histogram(source, target, target_cdfs=None, source_counts=None):
     """
     Match histogram of source image to target image
     Args:
-        source: source PIL Image
-        target: target PIL Image
+        source: source PIL Image or uint8/uint16 array
+        target: target PIL Image or array of the same dtype (mismatched bit
+            depths raise ValueError); may be None when target_cdfs is given
+        target_cdfs: optional precomputed histogram_cdfs(target)
+        source_counts: optional precomputed per-channel value counts of source
     Returns:
-        histogram matched PIL Image
+        histogram matched PIL Image (uint16 arrays come back as arrays)
     """
     if isinstance(source, Image.Image):
         source = np.array(source)
-    if isinstance(target, Image.Image):
-        target = np.array(target)
-    
-    matched = np.zeros_like(source)
+    if target_cdfs is None:
+        if isinstance(target, Image.Image):
+            target = np.array(target)
+        _check_same_depth(source, target)
+        target_cdfs = histogram_cdfs(target)
     
+    bins = _bins_for(source)
+    if any(values[-1] >= bins for values, _ in target_cdfs):
+        raise ValueError(f"Target histogram has values beyond the {source.dtype} range of the source")
+    curves = []
     for i in range(3):  # RGB channels
-        matched[:, :, i] = match_histogram_channel(source[:, :, i], target[:, :, i])
+        if source_counts is not None:
+            s_counts = source_counts[i]
+        else:
+            s_counts = np.bincount(source[:, :, i].ravel(), minlength=bins)
+        t_values, t_cdf = target_cdfs[i]
+        curves.append(match_histogram_curve(s_counts, t_values, t_cdf, source.dtype))
     
-    return Image.fromarray(matched.astype(np.uint8))
+    matched = apply_channel_curves(source, curves)
+    if matched.dtype != np.uint8:
+        return matched
+    return Image.fromarray(matched)
+
+
+def matched_strength_curves(source_counts, target_cdfs, strength=1.0, quantize=False):
+    """
+    Per-channel curves for histogram matching blended at a strength
+    The look produced by match_histogram followed by blend_images is
+    separable, so it is fully described by these three 256-entry curves.
+    Args:
+        source_counts: three per-value count arrays of the content image
+        target_cdfs: histogram_cdfs of the style image
+        strength: blend factor, as for blend_images
+        quantize: build the curves from the uint8 matched curve and blend
+            exactly as the preview does, so they reproduce it bit for bit;
+            otherwise keep full float precision for 16-bit rendering
+    Returns:
+        (3, 256) float64 array of output values in 0-255 range; integer
+        valued when quantize is set
+    """
+    if quantize:
+        identity = np.arange(256, dtype=np.uint8)
+    else:
+        identity = np.arange(256, dtype=np.float64)
+    curves = np.empty((3, 256), dtype=np.float64)
+    for i in range(3):
+        t_values, t_cdf = target_cdfs[i]
+        if quantize:
+            # Same uint8 curve and same blend as the preview, value by value
+            matched = match_histogram_curve(source_counts[i], t_values, t_cdf)
+            curves[i] = blend_images(identity, matched, strength).ravel()
+        else:
+            matched = match_histogram_curve(source_counts[i], t_values, t_cdf, np.float64)
+            curves[i] = identity * (1.0 - strength) + matched * strength
+    return np.clip(curves, 0, 255)
 
 
 def match_histogram_channel(source, target):
     """Match histogram for a single channel"""
-    oldshape = source.shape
-    source = source.ravel()
-    target = target.ravel()
-    
-    # Get unique values and their indices
-    s_values, bin_idx, s_counts = np.unique(source, return_inverse=True, return_counts=True)
-    t_values, t_counts = np.unique(target, return_counts=True)
-    
-    # Calculate CDFs
-    s_cdf = np.cumsum(s_counts).astype(np.float64)
-    s_cdf /= s_cdf[-1]
-    t_cdf = np.cumsum(t_counts).astype(np.float64)
-    t_cdf /= t_cdf[-1]
-    
-    # Interpolate
-    interp_values = np.interp(s_cdf, t_cdf, t_values)
-    
-    return interp_values[bin_idx].reshape(oldshape)
\ No newline at end of file
+    _check_same_depth(source, target)
+    bins = _bins_for(source)
+    s_counts = np.bincount(source.ravel(), minlength=bins)
+    _, t_values, t_cdf = channel_cdf(target, bins)
+    curve = match_histogram_curve(s_counts, t_values, t_cdf, source.dtype)
+    return np.take(curve, source)
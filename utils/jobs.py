@@ -0,0 +1,159 @@
+"""
+Background jobs for LUTor
+A bounded worker pool with a job table, progress reporting, cancellation and
+de-duplication of identical queued or running jobs.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation has been requested"""
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are already queued"""
+
+
+class Job:
+    """A unit of background work and its observable state"""
+
+    ACTIVE = ('queued', 'running')
+
+    def __init__(self, kind, key):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def report(self, fraction):
+        """Record progress (0-1); raises JobCancelled if the job was cancelled"""
+        self.progress = float(min(max(fraction, 0.0), 1.0))
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': round(self.progress, 4),
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    """
+    Run callables in a bounded thread pool and keep a table of their state
+    Callables receive the Job as their first argument and should call
+    job.report() periodically so they can be observed and cancelled.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, keep_finished=256, finished_ttl=3600):
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self.finished_ttl = finished_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='lutor-job')
+        self._jobs = OrderedDict()  # id -> Job
+        self._active_keys = {}      # dedupe key -> Job
+        self._lock = threading.Lock()
+
+    def submit(self, kind, key, fn, *args, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs) unless an identical job is already active
+        Args:
+            kind: job type label, e.g. 'export_lut'
+            key: hashable de-duplication key, or None to always queue
+        Returns:
+            (job, created): created is False when an existing job was returned
+        """
+        with self._lock:
+            if key is not None and key in self._active_keys:
+                return self._active_keys[key], False
+            pending = sum(1 for j in self._jobs.values() if j.status == 'queued')
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} jobs already queued")
+            job = Job(kind, key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active_keys[key] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job, True
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_requested:
+            return  # cancelled while queued
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            self._finish(job, 'done')
+        except JobCancelled:
+            self._finish(job, 'cancelled')
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, 'failed')
+
+    def _finish(self, job, status):
+        with self._lock:
+            job.status = status
+            job.finished = time.time()
+            if self._active_keys.get(job.key) is job:
+                del self._active_keys[job.key]
+
+    def _prune(self):
+        """Forget old finished jobs (caller holds the lock)"""
+        now = time.time()
+        finished = [j for j in self._jobs.values() if j.status not in Job.ACTIVE]
+        excess = len(finished) - self.keep_finished
+        for job in finished:
+            if excess > 0 or now - job.finished > self.finished_ttl:
+                del self._jobs[job.id]
+                excess -= 1
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation; queued jobs never start, running ones stop at their next report"""
+        job = self.get(job_id)
+        if job is not None and job.status in Job.ACTIVE:
+            job._cancel.set()
+            if job.status == 'queued':
+                self._finish(job, 'cancelled')
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                'queued': counts.get('queued', 0),
+                'running': counts.get('running', 0),
+                'done': counts.get('done', 0),
+                'failed': counts.get('failed', 0),
+                'cancelled': counts.get('cancelled', 0),
+            }
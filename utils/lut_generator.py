@@ -1,36 +1,553 @@
 """
 3D LUT Generator for LUTor
-Generates 3D LUTs from before/after image pairs and exports .cube and .xmp files
+Generates 3D LUTs from before/after image pairs, exports .cube and .xmp files
+and applies LUTs to images
 """
 
+import io
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
-import xml.etree.ElementTree as ET
 from pathlib import Path
 import cv2
 from .image_utils import rgb_to_lab, lab_to_rgb
+from .metrics import span
 
 
-class LUTGenerator:
-    """Generate 3D LUTs from image transformations"""
+@span('cube_write')
+def save_cube_file(lut, output_path, title="LUTor Style Transfer LUT", comments=()):
+    """
+    Save a LUT as a .cube file
+    Args:
+        lut: (N, N, N, 3) 3D LUT indexed [r, g, b] or (N, 3) 1D LUT, 0-1 range
+        output_path: Path to save .cube file, or a writable text file object
+        comments: extra header comment lines, without the leading '#'
+    """
+    lut = np.asarray(lut, dtype=np.float32)
+    size = lut.shape[0]
     
-    def __init__(self, lut_size=64):
-        self.lut_size = lut_size
-        self.identity_lut = self._create_identity_lut()
+    if lut.ndim == 4:
+        kind, size_line = "3D", f"LUT_3D_SIZE {size}"
+        # .cube order is red fastest, then green, then blue
+        rows = lut.transpose(2, 1, 0, 3).reshape(-1, 3)
+    elif lut.ndim == 2:
+        kind, size_line = "1D", f"LUT_1D_SIZE {size}"
+        rows = lut
+    else:
+        raise ValueError(f"Unsupported LUT shape {lut.shape}")
     
-    def _create_identity_lut(self):
-        """Create identity 3D LUT"""
-        size = self.lut_size
-        lut = np.zeros((size, size, size, 3), dtype=np.float32)
+    header = (
+        f"# LUTor Generated {kind} LUT\n"
+        "# Created with LUTor Style Transfer\n"
+        + "".join(f"# {line}\n" for line in comments) +
+        "\n"
+        f"TITLE \"{title}\"\n"
+        f"{size_line}\n"
+        "DOMAIN_MIN 0.0 0.0 0.0\n"
+        "DOMAIN_MAX 1.0 1.0 1.0\n"
+        "\n"
+    )
+    # Format the whole table in one pass instead of one write per entry
+    body = ("%.6f %.6f %.6f\n" * len(rows)) % tuple(rows.ravel().tolist())
+    
+    if hasattr(output_path, 'write'):
+        output_path.write(header)
+        output_path.write(body)
+        return
+    with open(output_path, 'w') as f:
+        f.write(header)
+        f.write(body)
+
+
+def _is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+
+def load_cube_file(path):
+    """
+    Load a .cube file
+    Args:
+        path: Path to .cube file
+    Returns:
+        (lut, domain_min, domain_max): lut is (N, N, N, 3) indexed [r, g, b]
+        for 3D files or (N, 3) for 1D files; domains are length-3 arrays
+    """
+    size_3d = size_1d = None
+    domain_min = np.zeros(3, dtype=np.float32)
+    domain_max = np.ones(3, dtype=np.float32)
+    
+    with open(path, 'r') as f:
+        text = f.read()
+    
+    # Header keywords come before the first numeric line
+    lines = text.splitlines()
+    data_start = len(lines)
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        # Keywords are separated from their values by any run of whitespace
+        keyword, *value = line.split(None, 1)
+        value = value[0] if value else ''
+        if keyword == 'LUT_3D_SIZE':
+            size_3d = int(value)
+        elif keyword == 'LUT_1D_SIZE':
+            size_1d = int(value)
+        elif keyword == 'DOMAIN_MIN':
+            domain_min = np.array(value.split(), dtype=np.float32)
+        elif keyword == 'DOMAIN_MAX':
+            domain_max = np.array(value.split(), dtype=np.float32)
+        elif _is_number(keyword):
+            data_start = i
+            break
+        # Anything else (TITLE, LUT_IN_VIDEO_RANGE, vendor keys, ...) is ignored
+    
+    data_lines = [l for l in lines[data_start:] if l.strip() and not l.lstrip().startswith('#')]
+    values = np.array(' '.join(data_lines).split(), dtype=np.float32)
+    
+    if size_3d is not None:
+        expected = size_3d ** 3 * 3
+        if values.size != expected:
+            raise ValueError(f"{path}: expected {expected} values, found {values.size}")
+        # Stored red fastest; transpose back to [r, g, b] indexing
+        lut = values.reshape(size_3d, size_3d, size_3d, 3).transpose(2, 1, 0, 3)
+        lut = np.ascontiguousarray(lut)
+    elif size_1d is not None:
+        expected = size_1d * 3
+        if values.size != expected:
+            raise ValueError(f"{path}: expected {expected} values, found {values.size}")
+        lut = values.reshape(size_1d, 3)
+    else:
+        raise ValueError(f"{path}: missing LUT_3D_SIZE or LUT_1D_SIZE")
+    
+    return lut, domain_min, domain_max
+
+
+def save_lut_binary(lut, output_path, dtype=np.float16):
+    """Save a LUT as a compact .npy file that can be memory-mapped on load"""
+    np.save(output_path, np.asarray(lut, dtype=dtype))
+
+
+def cube_bytes(lut, title="LUTor Style Transfer LUT", comments=()):
+    """Serialize a LUT to .cube file contents in memory"""
+    buffer = io.StringIO()
+    save_cube_file(lut, buffer, title, comments)
+    return buffer.getvalue().encode()
+
+
+def lut_from_curves(curves, lut_size=None):
+    """
+    Exact LUT for a separable look given as per-channel curves
+    Args:
+        curves: (3, 256) output values in 0-255 range, one curve per channel
+        lut_size: None for a 256-entry 1D LUT, or the size of a 3D LUT built
+            by broadcasting the curves (sampled at the grid nodes) over the grid
+    Returns:
+        (256, 3) or (N, N, N, 3) float32 LUT in 0-1 range
+    """
+    curves = np.asarray(curves, dtype=np.float64).reshape(3, 256) / 255.0
+    if lut_size is None:
+        return np.ascontiguousarray(curves.T, dtype=np.float32)
+    
+    nodes = np.linspace(0, 255, lut_size)
+    samples = [np.interp(nodes, np.arange(256), curve).astype(np.float32) for curve in curves]
+    lut = np.empty((lut_size, lut_size, lut_size, 3), dtype=np.float32)
+    lut[..., 0] = samples[0][:, None, None]
+    lut[..., 1] = samples[1][None, :, None]
+    lut[..., 2] = samples[2][None, None, :]
+    return lut
+
+
+_identity_luts = {}
+_identity_lock = threading.Lock()
+
+
+def identity_lut(size):
+    """
+    Identity 3D LUT, (N, N, N, 3) float32 in 0-1 range
+    Built once per size and shared read-only, so every generator (and every
+    forked server process) reads the same array.
+    """
+    with _identity_lock:
+        lut = _identity_luts.get(size)
+        if lut is None:
+            axis = np.linspace(0.0, 1.0, size, dtype=np.float32)
+            lut = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1)
+            lut.setflags(write=False)
+            _identity_luts[size] = lut
+        return lut
+
+
+def load_lut_binary(path, mmap=True):
+    """Load a LUT saved by save_lut_binary, memory-mapped by default"""
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+
+def load_lut(path, cache_binary=False):
+    """
+    Load a LUT from a .cube or .npy file
+    Args:
+        path: Path to .cube or .npy file
+        cache_binary: for .cube files, reuse (or create) a `<path>.npy`
+            companion so later loads skip text parsing
+    Returns:
+        LUT array, (N, N, N, 3) or (N, 3), in 0-1 range
+    """
+    path = Path(path)
+    if path.suffix.lower() == '.npy':
+        return load_lut_binary(path)
+    
+    companion = path.with_name(path.name + '.npy')
+    if cache_binary and companion.exists() and companion.stat().st_mtime >= path.stat().st_mtime:
+        return load_lut_binary(companion)
+    
+    lut, domain_min, domain_max = load_cube_file(path)
+    if np.any(domain_min != 0) or np.any(domain_max != 1):
+        raise ValueError(f"{path}: only DOMAIN 0-1 LUTs are supported")
+    
+    if cache_binary:
+        save_lut_binary(lut, companion, dtype=np.float32)
+    return lut
+
+
+def _lut_index_tables(size, depth):
+    """
+    Per-value lattice index and fraction tables for integer images
+    Returns (index, fraction) arrays with one entry per possible input value;
+    index is clamped to size - 2 so index + 1 is always a valid node.
+    """
+    scale = (size - 1) / float(depth - 1)
+    coords = np.arange(depth, dtype=np.float32) * np.float32(scale)
+    index = np.minimum(coords.astype(np.int32), size - 2)
+    return index, coords - index
+
+
+def _lut_coords(channel, size, tables):
+    """Lattice index and fraction for one channel of a tile"""
+    if tables is not None:
+        index, fraction = tables
+        return np.take(index, channel), np.take(fraction, channel)
+    coords = np.clip(channel, 0.0, 1.0).astype(np.float32) * np.float32(size - 1)
+    index = np.minimum(coords.astype(np.int32), size - 2)
+    return index, coords - index
+
+
+_tile_scratch = threading.local()
+
+
+def _scratch(shape):
+    """Reusable per-thread float32 buffer, grown on demand"""
+    needed = int(np.prod(shape))
+    buffer = getattr(_tile_scratch, 'buffer', None)
+    if buffer is None or buffer.size < needed:
+        buffer = np.empty(needed, dtype=np.float32)
+        _tile_scratch.buffer = buffer
+    return buffer[:needed].reshape(shape)
+
+
+def _apply_lut_tile(src, out, lut_flat, size, method, tables):
+    """Apply a flattened (size**3, 3) LUT to one row tile, writing into out"""
+    pixels = src.reshape(-1, 3)
+    ir, fr = _lut_coords(pixels[:, 0], size, tables)
+    ig, fg = _lut_coords(pixels[:, 1], size, tables)
+    ib, fb = _lut_coords(pixels[:, 2], size, tables)
+    
+    # Flat lattice offsets for one step along each axis
+    step_r, step_g, step_b = size * size, size, 1
+    base = ir * step_r + ig * step_g + ib
+    result = _scratch((len(pixels), 3))
+    
+    if method == 'trilinear':
+        fr, fg, fb = fr[:, None], fg[:, None], fb[:, None]
         
-        for r in range(size):
-            for g in range(size):
-                for b in range(size):
-                    lut[r, g, b, 0] = r / (size - 1)  # R
-                    lut[r, g, b, 1] = g / (size - 1)  # G
-                    lut[r, g, b, 2] = b / (size - 1)  # B
+        def lerp_b(offset):
+            lo = np.take(lut_flat, base + offset, axis=0)
+            hi = np.take(lut_flat, base + offset + step_b, axis=0)
+            return lo + (hi - lo) * fb
         
-        return lut
+        c00 = lerp_b(0)
+        c01 = lerp_b(step_g)
+        c0 = c00 + (c01 - c00) * fg
+        c10 = lerp_b(step_r)
+        c11 = lerp_b(step_r + step_g)
+        c1 = c10 + (c11 - c10) * fg
+        np.add(c0, (c1 - c0) * fr, out=result)
+    elif method == 'tetrahedral':
+        # The tetrahedron is picked by the ordering of the three fractions:
+        # walk from node 000 along the largest fraction's axis, then away
+        # from the smallest fraction's axis, and finish at node 111
+        corner = step_r + step_g + step_b
+        step_max = np.where(fr >= fg, np.where(fr >= fb, step_r, step_b),
+                            np.where(fg >= fb, step_g, step_b))
+        step_min = np.where(fr < fg, np.where(fr < fb, step_r, step_b),
+                            np.where(fg < fb, step_g, step_b))
+        f_max = np.maximum(np.maximum(fr, fg), fb)
+        f_min = np.minimum(np.minimum(fr, fg), fb)
+        f_mid = fr + fg + fb - f_max - f_min
+        
+        np.multiply(np.take(lut_flat, base, axis=0), (1.0 - f_max)[:, None], out=result)
+        result += np.take(lut_flat, base + step_max, axis=0) * (f_max - f_mid)[:, None]
+        result += np.take(lut_flat, base + corner - step_min, axis=0) * (f_mid - f_min)[:, None]
+        result += np.take(lut_flat, base + corner, axis=0) * f_min[:, None]
+    else:
+        raise ValueError(f"Unknown interpolation method '{method}'")
+    
+    _store_tile(result, out)
+
+
+def _apply_lut1d_tile(src, out, lut, size, method, tables):
+    """Apply a (size, 3) per-channel 1D LUT to one row tile"""
+    pixels = src.reshape(-1, 3)
+    result = _scratch((len(pixels), 3))
+    for c in range(3):
+        index, fraction = _lut_coords(pixels[:, c], size, tables)
+        lo = lut[index, c]
+        result[:, c] = lo + (lut[index + 1, c] - lo) * fraction
+    _store_tile(result, out)
+
+
+def _store_tile(result, out):
+    """Write 0-1 float results into an output tile of the image dtype"""
+    target = out.reshape(-1, 3)
+    if out.dtype == np.float32:
+        np.clip(result, 0.0, 1.0, out=target)
+        return
+    peak = np.iinfo(out.dtype).max
+    result *= peak
+    result += 0.5
+    np.clip(result, 0, peak, out=result)
+    target[...] = result
+
+
+# uint8 images at least this large are graded colour by colour, see ColourLookup
+COLOUR_LOOKUP_MIN_PIXELS = 1 << 20
+
+
+def apply_lut(image, lut, method='trilinear', tile_pixels=1 << 16, workers=None):
+    """
+    Apply a 3D or 1D LUT to an image
+    The image is processed in row tiles spread across a thread pool, so scratch
+    memory is bounded by tile size rather than image size. Large uint8 images
+    interpolate each distinct colour once (see ColourLookup) instead of every
+    pixel.
+    Args:
+        image: PIL Image or (H, W, 3) uint8, uint16 or float (0-1) array
+        lut: (N, N, N, 3) 3D LUT indexed [r, g, b] or (N, 3) 1D LUT, 0-1 range
+        method: 'trilinear' or 'tetrahedral' (3D LUTs only)
+        tile_pixels: approximate number of pixels per tile
+        workers: thread count, defaults to the CPU count
+    Returns:
+        graded image of the same type (PIL Image or array) and dtype
+    """
+    is_pil = isinstance(image, Image.Image)
+    src = np.asarray(image.convert('RGB') if is_pil else image)
+    if src.ndim != 3 or src.shape[2] != 3:
+        raise ValueError(f"Expected an RGB image, got shape {src.shape}")
+    if src.dtype not in (np.uint8, np.uint16):
+        if src.dtype.kind != 'f':
+            raise TypeError(f"Expected a uint8, uint16 or float image, got {src.dtype}")
+        src = src.astype(np.float32, copy=False)
+    
+    lut = np.asarray(lut, dtype=np.float32)
+    if lut.ndim not in (2, 4):
+        raise ValueError(f"Unsupported LUT shape {lut.shape}")
+    h, w = src.shape[:2]
+    if src.dtype == np.uint8 and lut.ndim == 4 and h * w >= COLOUR_LOOKUP_MIN_PIXELS:
+        lookup = ColourLookup(lut, method, tile_pixels, workers)
+        out = np.empty_like(src)
+        tile_rows = max(1, tile_pixels // max(w, 1))
+        needed = np.zeros(COLOUR_CUBE_SIZE, dtype=bool)
+        _map_tiles(lambda rows: lookup.mark(src[rows], needed), h, tile_rows, workers)
+        lookup.add(needed)
+        _map_tiles(lambda rows: lookup.lookup(src[rows], out[rows]), h, tile_rows, workers)
+    else:
+        out = _apply_lut_tiles(src, lut, method, tile_pixels, workers)
+    
+    return Image.fromarray(out) if is_pil else out
+
+
+def _map_tiles(run, height, tile_rows, workers):
+    """Call run(row slice) for every row tile, on a thread pool if workers > 1"""
+    tiles = [slice(y, min(y + tile_rows, height)) for y in range(0, height, tile_rows)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tiles) == 1:
+        for rows in tiles:
+            run(rows)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run, tiles))
+
+
+def _apply_lut_tiles(src, lut, method, tile_pixels, workers):
+    """Interpolate every pixel of a checked (H, W, 3) array, tile by tile"""
+    size = lut.shape[0]
+    tables = None
+    if src.dtype != np.float32:
+        tables = _lut_index_tables(size, np.iinfo(src.dtype).max + 1)
+    
+    if lut.ndim == 2:
+        work = _apply_lut1d_tile
+        lut_data = lut
+    else:
+        work = _apply_lut_tile
+        lut_data = np.ascontiguousarray(lut.reshape(-1, 3))
+    
+    h, w = src.shape[:2]
+    out = np.empty((h, w, 3), dtype=src.dtype)
+    
+    def run(rows):
+        work(src[rows], out[rows], lut_data, size, method, tables)
+    
+    _map_tiles(run, h, max(1, tile_pixels // max(w, 1)), workers)
+    return out
+
+
+COLOUR_CUBE_SIZE = 1 << 24
+
+
+def _colour_keys(tile):
+    """Packed 24-bit keys (r<<16 | g<<8 | b) of a uint8 RGB tile"""
+    keys = tile[..., 0].astype(np.uint32)
+    keys <<= 8
+    keys |= tile[..., 1]
+    keys <<= 8
+    keys |= tile[..., 2]
+    return keys
+
+
+class ColourLookup:
+    """
+    Memoized 3D LUT application for uint8 images
+    Every 8-bit colour is interpolated at most once and kept in a dense
+    2^24-entry table of packed RGBX words, so grading a pixel is a single
+    table read. Photos hold far fewer distinct colours than pixels, and only
+    the table pages of colours that occur are ever touched. Tiles of one
+    image (or frames of one clip) share the table.
+    """
+
+    def __init__(self, lut, method='trilinear', tile_pixels=1 << 16, workers=None):
+        self.lut = np.asarray(lut, dtype=np.float32)
+        self.method = method
+        self.tile_pixels = tile_pixels
+        self.workers = workers
+        self._table = np.empty(COLOUR_CUBE_SIZE, dtype=np.uint32)
+        self._filled = np.zeros(COLOUR_CUBE_SIZE, dtype=bool)
+        self._lock = threading.Lock()
+
+    def mark(self, tile, needed):
+        """Flag a tile's colours in a (2^24,) bool array"""
+        needed[_colour_keys(tile)] = True
+
+    def add(self, needed):
+        """Interpolate the colours flagged in a (2^24,) bool array that are not in the table yet"""
+        self._fill(lambda: np.flatnonzero(needed & ~self._filled))
+
+    def _fill(self, missing_keys):
+        with self._lock:
+            keys = missing_keys().astype(np.uint32)
+            if not len(keys):
+                return
+            colours = np.empty((len(keys), 1, 3), dtype=np.uint8)
+            colours[:, 0, 0] = keys >> 16
+            colours[:, 0, 1] = keys >> 8
+            colours[:, 0, 2] = keys
+            rgbx = np.zeros((len(keys), 4), dtype=np.uint8)
+            rgbx[:, :3] = _apply_lut_tiles(colours, self.lut, self.method, self.tile_pixels,
+                                           self.workers)[:, 0]
+            self._table[keys] = rgbx.view(np.uint32).ravel()
+            self._filled[keys] = True
+
+    def lookup(self, tile, out):
+        """Grade a tile whose colours are all in the table, writing into out"""
+        rgbx = np.take(self._table, _colour_keys(tile)).view(np.uint8)
+        cv2.cvtColor(rgbx.reshape(tile.shape[0], tile.shape[1], 4), cv2.COLOR_RGBA2RGB, dst=out)
+
+    def __call__(self, tile):
+        """Grade one (H, W, 3) uint8 array"""
+        keys = _colour_keys(tile).ravel()
+        if len(keys) >= COLOUR_LOOKUP_MIN_PIXELS:
+            needed = np.zeros(COLOUR_CUBE_SIZE, dtype=bool)
+            needed[keys] = True
+            self.add(needed)
+        else:
+            # Small tiles: sorting the few new colours beats scanning the whole cube
+            self._fill(lambda: np.unique(keys[~np.take(self._filled, keys)]))
+        out = np.empty_like(tile)
+        self.lookup(tile, out)
+        return out
+
+
+def unique_color_keys(colors):
+    """
+    Unique colours of an (n, 3) uint8 array as packed 24-bit keys (r<<16 | g<<8 | b)
+    Returns:
+        (unique_keys, inverse, counts): sorted int32 keys, the int32 index of
+        each input colour's key and the number of pixels per key
+    """
+    packed = np.asarray(colors, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+    keys = (packed[:, 0] << 16) | (packed[:, 1] << 8) | packed[:, 2]
+    unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return unique_keys, inverse.ravel().astype(np.int32), counts
+
+
+def _interp_matrix(n_out, n_in):
+    """(n_out, n_in) linear interpolation between two uniform grids spanning [0, 1]"""
+    pos = np.linspace(0, n_in - 1, n_out)
+    lower = np.minimum(pos.astype(np.int64), n_in - 2)
+    frac = pos - lower
+    matrix = np.zeros((n_out, n_in), dtype=np.float32)
+    matrix[np.arange(n_out), lower] = 1 - frac
+    matrix[np.arange(n_out), lower + 1] += frac
+    return matrix
+
+
+def _resample_grid(grid, matrix):
+    """Apply a 1D resampling matrix along each of the first three axes of a grid"""
+    grid = np.einsum('ai,i...->a...', matrix, grid)
+    grid = np.einsum('bj,aj...->ab...', matrix, grid)
+    return np.einsum('ck,abk...->abc...', matrix, grid)
+
+
+# Fit error comments record LUTGenerator.fit_error in exported .cube headers
+FIT_ERROR_PREFIX = "Fit error: "
+
+
+def fit_error_comment(error, method):
+    """Header comment recording a LUT's fit error, see LUTGenerator.fit_error"""
+    return (f"{FIT_ERROR_PREFIX}method={method}; rmse={error['rmse']:.3f}; "
+            f"mean_abs={error['mean_abs']:.3f}; max_abs={error['max_abs']:.3f}; "
+            f"samples={error['samples']}")
+
+
+def read_fit_error(data):
+    """Return the fit error comment of .cube file contents, or None"""
+    marker = f"# {FIT_ERROR_PREFIX}".encode()
+    for line in data[:1024].splitlines():
+        if line.startswith(marker):
+            return line[len(marker):].decode()
+    return None
+
+
+class LUTGenerator:
+    """Generate 3D LUTs from image transformations"""
+    
+    # 'nearest': inverse-distance kNN of sampled colours at every grid node
+    # 'splat': trilinear splat of every pixel, then diffusion into empty nodes
+    FIT_METHODS = ('nearest', 'splat')
+    
+    def __init__(self, lut_size=64, method='nearest'):
+        if method not in self.FIT_METHODS:
+            raise ValueError(f"Unknown fit method '{method}', expected one of {self.FIT_METHODS}")
+        self.lut_size = lut_size
+        self.method = method
+        self.identity_lut = identity_lut(lut_size)
     
     def generate_from_images(self, original_img, stylized_img, output_path):
         """
@@ -40,6 +557,33 @@ class LUTGenerator:
             stylized_img: PIL Image (stylized)
             output_path: Path to save .cube file
         """
+        lut = self.fit_lut(original_img, stylized_img)
+        
+        # Save as .cube file
+        self._save_cube_file(lut, output_path)
+        
+        return lut
+    
+    @span('lut_fit')
+    def fit_lut(self, original_img, stylized_img, progress=None):
+        """
+        Fit a 3D LUT to an original/stylized image pair without saving it
+        Args:
+            original_img: PIL Image or array (original)
+            stylized_img: PIL Image or array (stylized)
+            progress: optional callback(fraction of LUT grid cells done)
+        Returns:
+            (lut_size, lut_size, lut_size, 3) float32 LUT in 0-1 range
+        """
+        original_img, stylized_img = self._prepare_pair(original_img, stylized_img)
+        
+        if self.method == 'splat':
+            return self._generate_lut_from_splat(original_img, stylized_img, progress)
+        # Generate LUT using scattered data interpolation
+        return self._generate_lut_from_mapping(original_img, stylized_img, progress)
+    
+    def _prepare_pair(self, original_img, stylized_img):
+        """Convert an image pair to uint8 arrays of the same size"""
         # Convert images to numpy arrays
         if isinstance(original_img, Image.Image):
             original_img = np.array(original_img)
@@ -52,108 +596,251 @@ class LUTGenerator:
             h, w = original_img.shape[:2]
             stylized_img = cv2.resize(stylized_img, (w, h))
         
-        # Generate LUT using scattered data interpolation
-        lut = self._generate_lut_from_mapping(original_img, stylized_img)
+        return original_img, stylized_img
+    
+    @span('lut_fit')
+    def fit_lut_from_analysis(self, original, stylized, progress=None):
+        """
+        Fit a LUT from the sample sets of two shared image analyses
+        Reuses the original's unique-colour table instead of rebuilding it.
+        Args:
+            original, stylized: analysis.ImageAnalysis of the image pair
+        Returns:
+            LUT as for fit_lut
+        """
+        original_samples, stylized_samples = original.paired_samples(stylized)
+        if self.method == 'splat':
+            return self._generate_lut_from_splat(original_samples, stylized_samples, progress)
+        return self._generate_lut_from_mapping(original_samples, stylized_samples, progress,
+                                               unique=original.unique_colors())
+    
+    @span('lut_fit_error')
+    def fit_error(self, lut, original_img, stylized_img, max_samples=1 << 18):
+        """
+        Measure how well a LUT reproduces the stylized image
+        Args:
+            lut: LUT from fit_lut
+            original_img, stylized_img: the pair it was fitted on
+            max_samples: evaluate on an evenly strided sample of at most this many pixels
+        Returns:
+            dict of rmse, mean_abs and max_abs (0-255 units) and the sample count
+        """
+        original, stylized = self._prepare_pair(original_img, stylized_img)
+        original = original.reshape(-1, 3)
+        stylized = stylized.reshape(-1, 3)
+        step = max(1, len(original) // max_samples)
+        original, stylized = original[::step], stylized[::step]
         
-        # Save as .cube file
-        self._save_cube_file(lut, output_path)
+        predicted = apply_lut(original[:, None, :].astype(np.float32) / 255.0, lut, 'trilinear',
+                              workers=1)[:, 0] * 255.0
+        diff = predicted - stylized
+        return {
+            'rmse': float(np.sqrt(np.mean(diff ** 2))),
+            'mean_abs': float(np.mean(np.abs(diff))),
+            'max_abs': float(np.max(np.abs(diff))),
+            'samples': int(len(original)),
+        }
+    
+    def _generate_lut_from_splat(self, original, stylized, progress=None, chunk_pixels=1 << 19,
+                                 smoothing=1.0, iterations=16):
+        """
+        Generate 3D LUT by splatting every pixel pair into the grid
+        Each (original -> stylized) pair adds trilinear weights to the 8 nodes
+        around its original colour, one bincount per quantity per chunk. Nodes
+        then take their weighted mean stylized colour, and nodes without data
+        are filled by diffusing the offset from identity coarse-to-fine, so the
+        fill costs time in proportion to the grid size, not the pixel count.
+        Args:
+            smoothing: pixel-equivalent weight pulling each node towards its
+                neighbours; nodes with much more data than this keep their mean
+            iterations: Jacobi smoothing passes per grid level
+        """
+        size = self.lut_size
+        n_nodes = size ** 3
+        original = original.reshape(-1, 3)
+        stylized = stylized.reshape(-1, 3)
         
-        return lut
+        # Per-channel tables: input value -> lower node index and weight of the upper node
+        pos = np.arange(256) * (size - 1) / 255.0
+        lower_table = np.minimum(pos.astype(np.int64), size - 2)
+        upper_table = (pos - lower_table).astype(np.float32)
+        corners = list(itertools.product((0, 1), repeat=3))
+        
+        weights = np.zeros(n_nodes)
+        sums = np.zeros((3, n_nodes))
+        for start in range(0, len(original), chunk_pixels):
+            colors = original[start:start + chunk_pixels]
+            targets = stylized[start:start + chunk_pixels].astype(np.float32)
+            lower = np.take(lower_table, colors)
+            upper = np.take(upper_table, colors)
+            base = (lower[:, 0] * size + lower[:, 1]) * size + lower[:, 2]
+            
+            index = np.empty((8, len(colors)), dtype=np.int64)
+            weight = np.empty((8, len(colors)), dtype=np.float32)
+            for corner, (dr, dg, db) in enumerate(corners):
+                index[corner] = base + (dr * size + dg) * size + db
+                weight[corner] = ((upper[:, 0] if dr else 1 - upper[:, 0])
+                                  * (upper[:, 1] if dg else 1 - upper[:, 1])
+                                  * (upper[:, 2] if db else 1 - upper[:, 2]))
+            index = index.ravel()
+            weights += np.bincount(index, weight.ravel(), n_nodes)
+            for c in range(3):
+                sums[c] += np.bincount(index, (weight * targets[:, c]).ravel(), n_nodes)
+            if progress is not None:
+                progress(0.8 * min(start + chunk_pixels, len(original)) / len(original))
+        
+        # Weighted mean offset from identity at nodes with data (0-255 units)
+        identity = self.identity_lut * 255.0
+        weights = weights.reshape(size, size, size).astype(np.float32)
+        means = np.zeros_like(identity)
+        has_data = weights > 0
+        means[has_data] = sums.T.reshape(size, size, size, 3)[has_data] / weights[has_data, None]
+        offsets = np.where(has_data[..., None], means - identity, 0).astype(np.float32)
+        
+        offsets = self._diffuse(offsets, weights, smoothing, iterations)
+        if progress is not None:
+            progress(1.0)
+        return (np.clip(identity + offsets, 0, 255) / 255.0).astype(np.float32)
     
-    def _generate_lut_from_mapping(self, original, stylized):
+    def _diffuse(self, data, weights, smoothing, iterations):
+        """
+        Smooth a sparse grid of offsets, filling nodes without data
+        Minimizes sum(weights * (x - data)^2) + smoothing * roughness(x) by
+        weighted Jacobi iterations, starting from the solution on a grid of half
+        the size (multigrid-style), so empty regions fill in few passes.
+        """
+        n = weights.shape[0]
+        if n > 3:
+            coarse = _interp_matrix(n, (n + 1) // 2)
+            coarse_weights = _resample_grid(weights, coarse.T)
+            coarse_data = _resample_grid(weights[..., None] * data, coarse.T)
+            np.divide(coarse_data, coarse_weights[..., None], out=coarse_data,
+                      where=coarse_weights[..., None] > 0)
+            x = _resample_grid(self._diffuse(coarse_data, coarse_weights, smoothing, iterations),
+                               coarse)
+        else:
+            x = data.copy()
+            iterations *= 4
+        
+        weighted_data = weights[..., None] * data
+        denominator = (weights + smoothing)[..., None]
+        for _ in range(iterations):
+            # Mean of the 6 neighbours; edge padding keeps the grid border free
+            p = np.pad(x, ((1, 1), (1, 1), (1, 1), (0, 0)), mode='edge')
+            neighbours = (p[:-2, 1:-1, 1:-1] + p[2:, 1:-1, 1:-1] + p[1:-1, :-2, 1:-1]
+                          + p[1:-1, 2:, 1:-1] + p[1:-1, 1:-1, :-2] + p[1:-1, 1:-1, 2:]) / 6
+            x = (weighted_data + smoothing * neighbours) / denominator
+        return x.astype(np.float32)
+    
+    def _generate_lut_from_mapping(self, original, stylized, progress=None, unique=None):
         """
         Generate 3D LUT from color mapping between original and stylized images
         Uses sampling and interpolation to create smooth transitions
+        Args:
+            unique: optional unique_color_keys(original), if already known
         """
         # Sample colors from images
         original_flat = original.reshape(-1, 3)
         stylized_flat = stylized.reshape(-1, 3)
         
-        # Remove duplicate colors and subsample for performance
-        unique_indices = self._get_unique_colors(original_flat, max_samples=10000)
-        original_sampled = original_flat[unique_indices]
-        stylized_sampled = stylized_flat[unique_indices]
-        
-        # Create 3D LUT using interpolation
-        lut = np.copy(self.identity_lut)
-        
-        # For each LUT entry, find closest color mapping
-        for r in range(self.lut_size):
-            for g in range(self.lut_size):
-                for b in range(self.lut_size):
-                    # Current RGB color (0-1 range)
-                    rgb_norm = np.array([r / (self.lut_size - 1), 
-                                       g / (self.lut_size - 1), 
-                                       b / (self.lut_size - 1)])
-                    rgb_255 = (rgb_norm * 255).astype(np.uint8)
-                    
-                    # Find closest mapping
-                    mapped_color = self._find_closest_mapping(
-                        rgb_255, original_sampled, stylized_sampled
-                    )
-                    
-                    # Store in LUT (0-1 range)
-                    lut[r, g, b] = mapped_color / 255.0
+        # Collapse duplicate colors, averaging their stylized values, and subsample
+        original_sampled, _, stylized_sampled = self._get_unique_colors(
+            original_flat, stylized_flat, max_samples=10000, unique=unique
+        )
         
-        return lut
+        # Query every LUT grid node in one batched nearest-neighbour pass
+        grid = (self.identity_lut.reshape(-1, 3) * 255).astype(np.uint8)
+        mapped = self._find_closest_mappings(grid, original_sampled, stylized_sampled,
+                                             progress=progress)
+        
+        # Store in LUT (0-1 range)
+        lut = (mapped / 255.0).astype(np.float32)
+        return lut.reshape(self.identity_lut.shape)
     
-    def _get_unique_colors(self, colors, max_samples=10000):
-        """Get indices of unique colors, subsample if too many"""
-        # Convert to tuple format for uniqueness check
-        color_tuples = [tuple(color) for color in colors]
-        unique_colors = list(set(color_tuples))
+    def _get_unique_colors(self, colors, stylized=None, max_samples=10000, unique=None):
+        """
+        Get unique colors with their pixel counts and mean stylized colors
+        Colors are packed into 24-bit keys (r<<16 | g<<8 | b) so the whole
+        aggregation is a single np.unique plus per-channel bincounts.
+        Args:
+            colors: (n, 3) uint8 array of source colors
+            stylized: optional (n, 3) array of stylized colors, same order as colors
+            max_samples: subsample to at most this many colors, weighted by count
+            unique: optional unique_color_keys(colors), if already known
+        Returns:
+            (unique_colors, counts, mean_stylized): (m, 3) uint8, (m,) int and
+            (m, 3) float32 arrays; mean_stylized is None when stylized is None
+        """
+        unique_keys, inverse, counts = unique if unique is not None else unique_color_keys(colors)
         
-        # If too many unique colors, subsample
-        if len(unique_colors) > max_samples:
-            indices = np.random.choice(len(unique_colors), max_samples, replace=False)
-            unique_colors = [unique_colors[i] for i in indices]
+        mean_stylized = None
+        if stylized is not None:
+            stylized = np.asarray(stylized).reshape(-1, 3)
+            mean_stylized = np.empty((len(unique_keys), 3), dtype=np.float32)
+            for c in range(3):
+                sums = np.bincount(inverse, weights=stylized[:, c], minlength=len(unique_keys))
+                mean_stylized[:, c] = sums / counts
         
-        # Convert back to indices in original array
-        unique_indices = []
-        for color in unique_colors:
-            idx = np.where(np.all(colors == color, axis=1))[0]
-            if len(idx) > 0:
-                unique_indices.append(idx[0])
+        # If too many unique colors, subsample favouring frequent ones
+        if len(unique_keys) > max_samples:
+            indices = np.random.choice(len(unique_keys), max_samples, replace=False,
+                                       p=counts / counts.sum())
+            indices.sort()
+            unique_keys = unique_keys[indices]
+            counts = counts[indices]
+            if mean_stylized is not None:
+                mean_stylized = mean_stylized[indices]
         
-        return unique_indices
-    
-    def _find_closest_mapping(self, target_color, original_colors, stylized_colors):
-        """Find closest color mapping for a target color"""
-        # Calculate distances to all original colors
-        distances = np.sum((original_colors - target_color) ** 2, axis=1)
+        unique_colors = np.stack(
+            [(unique_keys >> 16) & 0xFF, (unique_keys >> 8) & 0xFF, unique_keys & 0xFF], axis=1
+        ).astype(np.uint8)
         
-        # Find k nearest neighbors
-        k = min(5, len(original_colors))
-        nearest_indices = np.argpartition(distances, k)[:k]
+        return unique_colors, counts, mean_stylized
+    
+    def _find_closest_mappings(self, target_colors, original_colors, stylized_colors,
+                               k=5, chunk_size=65536, progress=None):
+        """
+        Find closest color mappings for a batch of target colors
+        Uses a KD-tree over the sampled original colors and processes the
+        targets in chunks of at most `chunk_size` rows to bound memory.
+        Args:
+            target_colors: (m, 3) array of RGB colors in 0-255 range
+            original_colors: (n, 3) sampled original colors
+            stylized_colors: (n, 3) stylized colors matching original_colors
+            progress: optional callback(fraction of targets done), called per chunk;
+                it may raise to abort the search
+        Returns:
+            (m, 3) float array of mapped colors in 0-255 range
+        """
+        original_colors = np.ascontiguousarray(original_colors, dtype=np.float32)
+        stylized_colors = np.asarray(stylized_colors, dtype=np.float32)
+        target_colors = np.asarray(target_colors, dtype=np.float32).reshape(-1, 3)
         
-        # Weight by inverse distance
-        weights = 1.0 / (distances[nearest_indices] + 1e-6)
-        weights /= np.sum(weights)
+        # Exact (single tree, unlimited checks) nearest-neighbour index
+        index = cv2.flann_Index(original_colors, {'algorithm': 4, 'leaf_max_size': 10})
+        k = min(k, len(original_colors))
         
-        # Weighted average of mapped colors
-        mapped_color = np.average(stylized_colors[nearest_indices], weights=weights, axis=0)
+        mapped = np.empty((len(target_colors), 3), dtype=np.float32)
+        for start in range(0, len(target_colors), chunk_size):
+            chunk = np.ascontiguousarray(target_colors[start:start + chunk_size])
+            indices, distances = index.knnSearch(chunk, k, params={'checks': -1})
+            
+            # Weight by inverse squared distance
+            weights = 1.0 / (distances + 1e-6)
+            weights /= np.sum(weights, axis=1, keepdims=True)
+            
+            # Weighted average of mapped colors
+            mapped[start:start + chunk_size] = np.einsum(
+                'ij,ijk->ik', weights, stylized_colors[indices]
+            )
+            if progress is not None:
+                progress(min(start + chunk_size, len(target_colors)) / len(target_colors))
         
-        return np.clip(mapped_color, 0, 255)
+        return np.clip(mapped, 0, 255)
     
     def _save_cube_file(self, lut, output_path):
         """Save 3D LUT as .cube file"""
-        with open(output_path, 'w') as f:
-            # Write header
-            f.write("# LUTor Generated 3D LUT\n")
-            f.write("# Created with LUTor Style Transfer\n")
-            f.write("\n")
-            f.write("TITLE \"LUTor Style Transfer LUT\"\n")
-            f.write(f"LUT_3D_SIZE {self.lut_size}\n")
-            f.write("DOMAIN_MIN 0.0 0.0 0.0\n")
-            f.write("DOMAIN_MAX 1.0 1.0 1.0\n")
-            f.write("\n")
-            
-            # Write LUT data
-            for b in range(self.lut_size):
-                for g in range(self.lut_size):
-                    for r in range(self.lut_size):
-                        rgb = lut[r, g, b]
-                        f.write(f"{rgb[0]:.6f} {rgb[1]:.6f} {rgb[2]:.6f}\n")
+        save_cube_file(lut, output_path)
     
     def generate_xmp_preset(self, original_img, stylized_img, output_path):
         """
@@ -169,6 +856,17 @@ class LUTGenerator:
         # Create XMP preset
         self._create_xmp_preset(adjustments, output_path)
     
+    def xmp_preset_bytes(self, original_img, stylized_img):
+        """Generate a Lightroom XMP preset and return the file contents"""
+        adjustments = self._analyze_color_adjustments(original_img, stylized_img)
+        return self._format_xmp_preset(adjustments).encode()
+    
+    def xmp_preset_from_analysis(self, original, stylized):
+        """Generate a Lightroom XMP preset from two shared image analyses' LAB means"""
+        adjustments = self._adjustments_from_lab_means(original.lab_mean, stylized.lab_mean)
+        return self._format_xmp_preset(adjustments).encode()
+    
+    @span('xmp_analyze')
     def _analyze_color_adjustments(self, original, stylized):
         """Analyze color differences to estimate Lightroom adjustments"""
         if isinstance(original, Image.Image):
@@ -183,7 +881,10 @@ class LUTGenerator:
         # Calculate statistics
         orig_mean = np.mean(original_lab, axis=(0, 1))
         styl_mean = np.mean(stylized_lab, axis=(0, 1))
-        
+        return self._adjustments_from_lab_means(orig_mean, styl_mean)
+    
+    def _adjustments_from_lab_means(self, orig_mean, styl_mean):
+        """Map the shift in mean LAB colour onto Lightroom-style adjustments"""
         # Estimate adjustments
         lightness_diff = (styl_mean[0] - orig_mean[0]) / 255.0
         a_diff = (styl_mean[1] - orig_mean[1]) / 255.0
@@ -204,6 +905,11 @@ class LUTGenerator:
     
     def _create_xmp_preset(self, adjustments, output_path):
         """Create XMP preset file"""
+        with open(output_path, 'w') as f:
+            f.write(self._format_xmp_preset(adjustments))
+    
+    def _format_xmp_preset(self, adjustments):
+        """Fill the XMP preset template"""
         # XMP template
         xmp_template = '''<?xml version="1.0" encoding="UTF-8"?>
 <x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="Adobe XMP Core 5.6-c132 79.159284, 2016/04/19-13:13:40">
@@ -225,7 +931,7 @@ class LUTGenerator:
 </x:xmpmeta>'''
         
         # Fill template with adjustments
-        xmp_content = xmp_template.format(
+        return xmp_template.format(
             exposure=adjustments['Exposure'],
             highlights=adjustments['Highlights'],
             shadows=adjustments['Shadows'],
@@ -233,8 +939,4 @@ class LUTGenerator:
             saturation=adjustments['Saturation'],
             temperature=adjustments['Temperature'],
             tint=adjustments['Tint']
-        )
-        
-        # Save XMP file
-        with open(output_path, 'w') as f:
-            f.write(xmp_content)
\ No newline at end of file
+        )
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""
+Instrumentation for LUTor
+Lightweight timing spans, Prometheus-style metrics and an optional sampled
+request profiler.
+"""
+
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Seconds; covers sub-millisecond stages up to full-resolution renders
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, values)} {count}')
+        return lines
+
+
+class Gauge:
+    """Current value that can go up and down"""
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def render(self):
+        return metric_lines(self.name, self.help, [((), self.value)])
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = _labels(self.labels, values, [f'le="{bound}"'])
+                    lines.append(f'{self.name}_bucket{le} {cumulative}')
+                inf = _labels(self.labels, values, ['le="+Inf"'])
+                lines.append(f'{self.name}_bucket{inf} {series[-1]}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, values)} {series[-2]:.6f}')
+                lines.append(f'{self.name}_count{_labels(self.labels, values)} {series[-1]}')
+        return lines
+
+
+def metric_lines(name, help, samples, labels=(), kind='gauge'):
+    """
+    Render a metric from values collected elsewhere, e.g. cache stats
+    Args:
+        samples: list of (label values, value)
+        kind: 'gauge' or 'counter'
+    """
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+    for values, value in samples:
+        lines.append(f'{name}{_labels(labels, values)} {value}')
+    return lines
+
+
+# --- SPANS ---
+
+STAGE_SECONDS = Histogram('lutor_stage_seconds', 'Time spent in each processing stage', ['stage'])
+
+_local = threading.local()
+
+
+def start_request():
+    """Start collecting spans for the current thread's request"""
+    _local.timings = []
+
+
+def end_request():
+    """Stop collecting and return the request's (stage, seconds) spans"""
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    return timings or []
+
+
+@contextmanager
+def span(stage):
+    """Time a block as a named stage, for the stage histogram and Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def server_timing(timings, total=None):
+    """Format spans as a Server-Timing header value, summing repeated stages"""
+    durations = {}
+    for stage, seconds in timings:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    parts = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in durations.items()]
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+# --- PROFILER ---
+
+class RequestProfiler:
+    """
+    Profile a random sample of requests with cProfile
+    Profiles are written as <endpoint>-<timestamp>.prof files, readable with
+    pstats or snakeviz. Only one request is profiled at a time.
+    """
+
+    def __init__(self, rate, output_dir):
+        self.rate = rate
+        self.output_dir = output_dir
+        self._busy = threading.Lock()
+
+    @classmethod
+    def from_env(cls, default_dir):
+        """Build from LUTOR_PROFILE (sample rate, 0-1) and LUTOR_PROFILE_DIR, or None if off"""
+        try:
+            rate = float(os.environ.get('LUTOR_PROFILE', 0))
+        except ValueError:
+            rate = 0.0
+        if rate <= 0:
+            return None
+        output_dir = os.environ.get('LUTOR_PROFILE_DIR', default_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        return cls(min(rate, 1.0), output_dir)
+
+    def start(self):
+        if random.random() >= self.rate or not self._busy.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active
+            self._busy.release()
+            return
+        _local.profile = profile
+
+    def stop(self, name):
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return
+        _local.profile = None
+        try:
+            profile.disable()
+            safe_name = ''.join(c if c.isalnum() else '_' for c in name).strip('_') or 'request'
+            profile.dump_stats(os.path.join(self.output_dir, f'{safe_name}-{time.time():.6f}.prof'))
+        finally:
+            self._busy.release()
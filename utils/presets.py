@@ -0,0 +1,278 @@
+"""
+Preset styles for LUTor
+A registry of named style references. Built-in presets are generated with
+NumPy on first use; further presets can be registered from a directory of
+style images or .cube LUTs. Everything a preset needs to be applied (its
+image, channel CDFs or LUT) is computed once and memoized.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image
+import numpy as np
+import cv2
+
+from .image_utils import histogram_cdfs, lab_stats
+from .lut_generator import apply_lut, load_lut
+
+
+PRESET_STYLES = [
+    {'name': 'Warm Sunset', 'id': 'warm', 'description': 'Warm orange and yellow tones'},
+    {'name': 'Cool Ocean', 'id': 'cool', 'description': 'Cool blue and cyan tones'},
+    {'name': 'Vintage Film', 'id': 'vintage', 'description': 'Classic film look'},
+    {'name': 'High Contrast', 'id': 'contrast', 'description': 'Bold black and white'},
+    {'name': 'Soft Pastel', 'id': 'pastel', 'description': 'Gentle pastel colors'},
+]
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+LUT_EXTENSIONS = {'.cube', '.npy'}
+
+
+# --- GENERATED STYLES ---
+# Coordinate grids for the 256x256 generated style images
+
+_Y, _X = np.mgrid[0:256, 0:256]
+
+
+def _wave(base, amplitude, t, frequency):
+    """base + int(amplitude * sin(t * frequency)), truncated like int()"""
+    return base + np.trunc(amplitude * np.sin(t * frequency)).astype(np.int64)
+
+
+def _rgb_image(r, g, b):
+    return Image.fromarray(np.clip(np.dstack([r, g, b]), 0, 255).astype(np.uint8))
+
+
+def create_warm_style():
+    return _rgb_image(_wave(200, 30, _X, 0.05), _wave(150, 50, _Y, 0.03), _wave(100, -40, _X + _Y, 0.02))
+def create_cool_style():
+    return _rgb_image(_wave(100, -40, _X, 0.05), _wave(150, 30, _Y, 0.03), _wave(200, 50, _X + _Y, 0.02))
+def create_vintage_style():
+    return _rgb_image(_wave(180, 20, _X, 0.03), _wave(160, 20, _Y, 0.03), _wave(120, 20, _X + _Y, 0.02))
+def create_contrast_style():
+    stripes = np.where((_X + _Y) % 40 < 20, 255, 0)
+    return _rgb_image(stripes, stripes, stripes)
+def create_pastel_style():
+    return _rgb_image(_wave(200, 30, _X, 0.05), _wave(200, 30, _Y, 0.05), _wave(200, 30, _X + _Y, 0.05))
+
+
+STYLE_GENERATORS = {
+    'warm': create_warm_style,
+    'cool': create_cool_style,
+    'vintage': create_vintage_style,
+    'contrast': create_contrast_style,
+    'pastel': create_pastel_style
+}
+
+
+def reference_chart(size=256):
+    """Neutral hue/lightness sweep, used to preview LUT presets"""
+    hue = np.broadcast_to(np.linspace(0, 179, size, dtype=np.float32)[None, :], (size, size))
+    value = np.linspace(255, 32, size, dtype=np.float32)[:, None]
+    sat = np.broadcast_to(np.full((1, size), 200, dtype=np.float32), (size, size))
+    hsv = np.dstack([hue, sat, np.broadcast_to(value, (size, size))]).astype(np.uint8)
+    chart = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+    chart[:size // 8] = np.linspace(0, 255, size, dtype=np.uint8)[None, :, None]  # grey ramp
+    return chart
+
+
+# --- REGISTRY ---
+
+class Preset:
+    """
+    A named style reference with lazily computed, memoized data
+    A preset has a style image (whose channel CDFs drive histogram matching),
+    a LUT that is applied directly, or both.
+    """
+
+    def __init__(self, preset_id, name, description='', image=None, lut=None, builtin=False):
+        """
+        Args:
+            preset_id: short ID used by the API and CLI
+            image: callable returning a PIL Image, or a path to a style image
+            lut: callable returning a LUT array, or a path to a .cube/.npy file
+            builtin: True for the presets shipped with LUTor
+        """
+        if image is None and lut is None:
+            raise ValueError(f"Preset '{preset_id}' needs a style image or a LUT")
+        self.id = preset_id
+        self.name = name
+        self.description = description
+        self.builtin = builtin
+        self._image_source = image
+        self._lut_source = lut
+        self._memo = {}
+        self._memo_version = None
+        self._lock = threading.RLock()  # memoized values build on each other
+
+    @property
+    def has_lut(self):
+        return self._lut_source is not None
+
+    @property
+    def version(self):
+        """
+        Modification time and size of the preset's files, or None if it has none
+        If a file has gone missing the last seen version is kept, so values
+        memoized before the deletion keep being served.
+        """
+        try:
+            stats = [os.stat(source) for source in self._file_sources()]
+        except OSError:
+            return self._memo_version
+        if not stats:
+            return None
+        return '-'.join(f'{st.st_mtime_ns}.{st.st_size}' for st in stats)
+
+    @property
+    def available(self):
+        """False once the preset's files are gone and nothing was loaded from them"""
+        return bool(self._memo) or all(os.path.exists(source) for source in self._file_sources())
+
+    def _file_sources(self):
+        return [source for source in (self._image_source, self._lut_source)
+                if source is not None and not callable(source)]
+
+    def _memoized(self, name, compute):
+        with self._lock:
+            version = self.version
+            if version != self._memo_version:
+                # A preset file was edited: everything derived from it is stale
+                self._memo = {}
+                self._memo_version = version
+            if name not in self._memo:
+                value = compute()
+                if isinstance(value, np.ndarray):
+                    value.setflags(write=False)
+                self._memo[name] = value
+            return self._memo[name]
+
+    def _load_image(self):
+        source = self._image_source
+        if source is None:
+            # LUT-only preset: preview the LUT on a neutral chart
+            return np.asarray(apply_lut(reference_chart(), self.lut(), 'tetrahedral', workers=1))
+        if callable(source):
+            return np.array(source().convert('RGB'))
+        with Image.open(source) as image:
+            return np.array(image.convert('RGB'))
+
+    def image_array(self):
+        """Style image as a read-only (H, W, 3) uint8 array"""
+        return self._memoized('image', self._load_image)
+
+    def image(self):
+        """Style image as a PIL Image"""
+        return Image.fromarray(self.image_array())
+
+    def cdfs(self):
+        """Per-channel histogram CDFs of the style image, for match_histogram"""
+        return self._memoized('cdfs', lambda: histogram_cdfs(self.image_array()))
+
+    def lab_stats(self):
+        """LAB mean and standard deviation of the style image, for reinhard_transfer"""
+        return self._memoized('lab_stats', lambda: lab_stats(self.image_array()))
+
+    def lut(self):
+        """The preset's LUT (float32, 0-1), or None for image-only presets"""
+        if self._lut_source is None:
+            return None
+        source = self._lut_source
+        return self._memoized('lut', lambda: np.asarray(
+            source() if callable(source) else load_lut(source), dtype=np.float32))
+
+    def warm(self):
+        """Compute everything up front"""
+        self.lut()
+        self.cdfs()
+        self.lab_stats()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'id': self.id,
+            'description': self.description,
+            'kind': 'lut' if self.has_lut else 'image',
+            'builtin': self.builtin,
+        }
+
+
+class PresetRegistry:
+    """
+    Ordered, thread-safe collection of presets by ID
+    Presets that are no longer available (see Preset.available) are treated
+    as unregistered.
+    """
+
+    def __init__(self):
+        self._presets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, preset):
+        with self._lock:
+            self._presets[preset.id] = preset
+        return preset
+
+    def unregister(self, preset_id):
+        with self._lock:
+            return self._presets.pop(preset_id, None)
+
+    def get(self, preset_id):
+        with self._lock:
+            preset = self._presets.get(preset_id)
+        return preset if preset is not None and preset.available else None
+
+    def __contains__(self, preset_id):
+        return self.get(preset_id) is not None
+
+    def __iter__(self):
+        with self._lock:
+            presets = list(self._presets.values())
+        return iter([preset for preset in presets if preset.available])
+
+    def list(self):
+        """Preset metadata for the API"""
+        return [preset.to_dict() for preset in self]
+
+    def load_directory(self, path):
+        """
+        Register a preset for every style image and .cube/.npy LUT in a directory
+        The file stem becomes the preset ID; an image and a LUT sharing a stem
+        form one preset, the image serving as its preview.
+        Returns:
+            list of registered preset IDs
+        """
+        found = {}
+        for file in sorted(Path(path).iterdir()):
+            suffix = file.suffix.lower()
+            if not file.is_file() or file.name.endswith('.cube.npy'):
+                continue  # binary caches written by load_lut
+            if suffix in IMAGE_EXTENSIONS:
+                found.setdefault(file.stem, {})['image'] = file
+            elif suffix in LUT_EXTENSIONS:
+                found.setdefault(file.stem, {})['lut'] = file
+
+        registered = []
+        for stem, files in found.items():
+            preset_id = re.sub(r'[^a-z0-9_-]+', '-', stem.lower()).strip('-')
+            if not preset_id or (preset_id in self and self.get(preset_id).builtin):
+                continue
+            name = stem.replace('_', ' ').replace('-', ' ').title()
+            self.register(Preset(preset_id, name, f"From {', '.join(f.name for f in files.values())}",
+                                 image=files.get('image'), lut=files.get('lut')))
+            registered.append(preset_id)
+        return registered
+
+    def warm(self):
+        for preset in self:
+            preset.warm()
+
+
+PRESETS = PresetRegistry()
+for _style in PRESET_STYLES:
+    PRESETS.register(Preset(_style['id'], _style['name'], _style['description'],
+                            image=STYLE_GENERATORS[_style['id']], builtin=True))
@@ -0,0 +1,275 @@
+"""
+Full-resolution rendering for LUTor
+Applies a colour transform to a decoded full-size image in row tiles. PNG and
+16-bit TIFF results are streamed out without full-size intermediate buffers;
+JPEG results are graded in place.
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+import cv2
+from PIL import Image
+
+from .image_utils import apply_orientation, image_orientation, reinhard_transfer
+from .lut_generator import ColourLookup, apply_lut
+
+
+class ChannelCurves:
+    """
+    Separable colour transform: one float curve per channel over 0-255 input
+    Output tiles may be uint8 or uint16; 16-bit output keeps the curve's
+    fractional precision, so it needs unquantized curves (see
+    image_utils.matched_strength_curves).
+    """
+
+    def __init__(self, curves):
+        self.curves = np.clip(np.asarray(curves, dtype=np.float64), 0, 255).reshape(3, -1)
+        self._tables = {}
+
+    def table(self, dtype):
+        """Per-channel integer lookup tables for an output dtype"""
+        dtype = np.dtype(dtype)
+        if dtype not in self._tables:
+            scale = 257.0 if dtype == np.uint16 else 1.0
+            self._tables[dtype] = np.rint(self.curves * scale).astype(dtype)
+        return self._tables[dtype]
+
+    def __call__(self, tile, dtype=np.uint8):
+        table = self.table(dtype)
+        if dtype == np.uint8:
+            return cv2.LUT(tile, np.ascontiguousarray(table.T).reshape(256, 1, 3))
+        out = np.empty(tile.shape, dtype=dtype)
+        for c in range(3):
+            out[:, :, c] = np.take(table[c], tile[:, :, c])
+        return out
+
+
+class LUTTransform:
+    """
+    3D (or 1D) LUT transform for uint8 tiles, with uint8 or uint16 output
+    8-bit output of a 3D LUT goes through one ColourLookup shared by every
+    tile, so each colour is interpolated once per image (or clip).
+    """
+
+    def __init__(self, lut, method='tetrahedral', workers=1):
+        self.lut = np.asarray(lut, dtype=np.float32)
+        self.method = method
+        self.workers = workers
+        self._lookup = None
+
+    def __call__(self, tile, dtype=np.uint8):
+        if dtype == np.uint8 and self.lut.ndim == 4:
+            if self._lookup is None:
+                self._lookup = ColourLookup(self.lut, self.method, workers=self.workers)
+            return self._lookup(tile)
+        if dtype == np.uint8:
+            return apply_lut(tile, self.lut, self.method, workers=self.workers)
+        graded = apply_lut(tile.astype(np.float32) / 255.0, self.lut, self.method,
+                           workers=self.workers)
+        return np.rint(graded * 65535.0).astype(np.uint16)
+
+
+class LabTransfer:
+    """
+    Statistics-based LAB transform (see image_utils.reinhard_transfer) blended
+    with the input at a strength; 16-bit output is computed in float LAB
+    """
+
+    def __init__(self, scale, offset, strength=1.0):
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.strength = float(strength)
+
+    def graded(self, rgb):
+        """Full-strength transform of (H, W, 3) float32 RGB in 0-1 range"""
+        lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
+        # The coefficients are in 8-bit LAB units: L * 255 / 100, a + 128, b + 128
+        units = np.array([255.0 / 100.0, 1.0, 1.0], dtype=np.float32)
+        shift = np.array([0.0, 128.0, 128.0], dtype=np.float32)
+        # Saturate like the 8-bit path does
+        lab = (np.clip((lab * units + shift) * self.scale + self.offset, 0.0, 255.0) - shift) / units
+        return np.clip(cv2.cvtColor(lab, cv2.COLOR_LAB2RGB), 0.0, 1.0)
+
+    def __call__(self, tile, dtype=np.uint8):
+        if dtype == np.uint8:
+            graded = reinhard_transfer(tile, self.scale, self.offset, tile_rows=tile.shape[0])
+            return cv2.addWeighted(tile, 1.0 - self.strength, graded, self.strength, 0.0)
+        rgb = tile.astype(np.float32) / 255.0
+        blended = rgb + (self.graded(rgb) - rgb) * np.float32(self.strength)
+        return np.rint(np.clip(blended, 0.0, 1.0) * 65535.0).astype(np.uint16)
+
+
+def _open_output(target):
+    """Open a path for writing, or pass through a writable file object"""
+    if isinstance(target, (str, os.PathLike)):
+        return open(target, 'wb'), True
+    return target, False
+
+
+class PNGStreamWriter:
+    """Write an RGB PNG row tile by row tile"""
+
+    def __init__(self, path, width, height, bit_depth=8, level=6):
+        self.f, self._owns_file = _open_output(path)
+        self.width = width
+        self.bit_depth = bit_depth
+        self._compressor = zlib.compressobj(level)
+        self.f.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.f.write(struct.pack('>I', len(data)))
+        self.f.write(kind)
+        self.f.write(data)
+        self.f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    def write(self, rows):
+        if self.bit_depth == 16:
+            rows = rows.astype('>u2')
+        data = rows.reshape(rows.shape[0], -1).view(np.uint8)
+        # Each scanline is prefixed by its filter type (0 = none)
+        scanlines = np.zeros((data.shape[0], data.shape[1] + 1), dtype=np.uint8)
+        scanlines[:, 1:] = data
+        compressed = self._compressor.compress(scanlines.tobytes())
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+
+    def close(self):
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+        if self._owns_file:
+            self.f.close()
+
+
+class TIFFStreamWriter:
+    """Write an uncompressed baseline RGB TIFF (8 or 16 bit) strip by strip"""
+
+    def __init__(self, path, width, height, bit_depth=16):
+        self.f, self._owns_file = _open_output(path)
+        self._start = self.f.tell()
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.rows_per_strip = None
+        self.offsets = []
+        self.counts = []
+        # Header; the IFD offset is patched in on close
+        self.f.write(b'II*\x00' + struct.pack('<I', 0))
+
+    def write(self, rows):
+        if self.rows_per_strip is None:
+            self.rows_per_strip = rows.shape[0]
+        dtype = '<u2' if self.bit_depth == 16 else np.uint8
+        data = np.ascontiguousarray(rows, dtype=dtype).tobytes()
+        self.offsets.append(self.f.tell() - self._start)
+        self.counts.append(len(data))
+        self.f.write(data)
+
+    def _align(self):
+        if (self.f.tell() - self._start) % 2:
+            self.f.write(b'\x00')
+        return self.f.tell() - self._start
+
+    def _write_array(self, fmt, values):
+        offset = self._align()
+        self.f.write(struct.pack(f'<{len(values)}{fmt}', *values))
+        return offset
+
+    def close(self):
+        n = len(self.offsets)
+        bits_offset = self._write_array('H', [self.bit_depth] * 3)
+        offsets_at = self._write_array('I', self.offsets) if n > 1 else self.offsets[0]
+        counts_at = self._write_array('I', self.counts) if n > 1 else self.counts[0]
+
+        SHORT, LONG = 3, 4
+        entries = [
+            (256, LONG, 1, self.width),
+            (257, LONG, 1, self.height),
+            (258, SHORT, 3, bits_offset),
+            (259, SHORT, 1, 1),                    # no compression
+            (262, SHORT, 1, 2),                    # RGB
+            (273, LONG, n, offsets_at),
+            (277, SHORT, 1, 3),
+            (278, LONG, 1, self.rows_per_strip or self.height),
+            (279, LONG, n, counts_at),
+            (284, SHORT, 1, 1),                    # chunky (RGBRGB...)
+        ]
+        ifd_offset = self._align()
+        self.f.write(struct.pack('<H', len(entries)))
+        for tag, kind, count, value in entries:
+            packed = struct.pack('<H', value) + b'\x00\x00' if kind == SHORT and count == 1 \
+                else struct.pack('<I', value)
+            self.f.write(struct.pack('<HHI', tag, kind, count) + packed)
+        self.f.write(struct.pack('<I', 0))
+        end = self.f.tell()
+        self.f.seek(self._start + 4)
+        self.f.write(struct.pack('<I', ifd_offset))
+        self.f.seek(end)
+        if self._owns_file:
+            self.f.close()
+
+
+OUTPUT_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'tiff': ('.tif', 'image/tiff'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+}
+
+
+def open_rgb(path):
+    """
+    Open and decode an image as 8-bit RGB, upright per its EXIF orientation
+    Avoids an extra full-size copy unless the image needs converting or rotating.
+    """
+    img = Image.open(path)
+    orientation = image_orientation(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.load()
+    return apply_orientation(img, orientation)
+
+
+def render_full_resolution(source, transform, output_path, fmt='png', tile_rows=256,
+                           quality=95):
+    """
+    Render a transform over a full-size image in row tiles
+    The source is decoded in full and held for the whole render; on top of it
+    PNG and TIFF output only needs a tile's worth of buffers, as it is streamed
+    to disk. JPEG output is encoded in one go, so graded tiles are pasted back
+    into the source (which is modified) and PIL's encoder adds its own buffers.
+    Args:
+        source: path or PIL Image (8-bit RGB)
+        transform: callable (uint8 tile, output dtype) -> tile, e.g. ChannelCurves
+        output_path: Path for the rendered file, or a writable (seekable) file object
+        fmt: 'png' (8-bit), 'tiff' (16-bit) or 'jpeg'
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{fmt}'")
+    img = source if isinstance(source, Image.Image) else open_rgb(source)
+    width, height = img.size
+
+    if fmt == 'png':
+        writer, dtype = PNGStreamWriter(output_path, width, height, bit_depth=8), np.uint8
+    elif fmt == 'tiff':
+        writer, dtype = TIFFStreamWriter(output_path, width, height, bit_depth=16), np.uint16
+    else:
+        writer, dtype = None, np.uint8
+
+    try:
+        for y in range(0, height, tile_rows):
+            box = (0, y, width, min(y + tile_rows, height))
+            tile = np.asarray(img.crop(box))
+            graded = transform(tile, dtype)
+            if writer is not None:
+                writer.write(graded)
+            else:
+                img.paste(Image.fromarray(graded), box)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        img.save(output_path, format='JPEG', quality=quality, subsampling=0)
@@ -0,0 +1,139 @@
+"""
+Production server for LUTor
+Serves the app on a fixed pool of threads, optionally in several pre-forked
+processes. Read-only data (preset tables, identity LUTs) is built once before
+forking, so every process shares its pages copy-on-write instead of holding
+its own copy.
+
+Usage:
+    python -m utils.serve [--host 0.0.0.0] [--port 5001] [--threads 8]
+                          [--processes 1 [--per-process-state]]
+
+Each process keeps its own caches, image store and job queue, and a request
+may land on any process. Image IDs, background LUT export jobs and exact
+curve exports all refer to state held by the process that created them, so
+the web UI needs a single process; --processes > 1 is refused unless
+--per-process-state acknowledges that clients resend their images.
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+
+DEFAULT_THREADS = 8
+
+
+class _RequestHandler(WSGIRequestHandler):
+    # One request per connection: an idle keep-alive connection would hold a
+    # pool thread that queued requests are waiting for
+    protocol_version = 'HTTP/1.0'
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server handling connections on a fixed-size thread pool"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=DEFAULT_THREADS):
+        super().__init__(host, port, app, handler=_RequestHandler)
+        self.threads = threads
+        self._pool = None
+
+    def serve_forever(self, poll_interval=0.5):
+        # Threads do not survive fork, so each process starts its own pool
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='lutor-http')
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve(app, host='0.0.0.0', port=5001, threads=DEFAULT_THREADS, processes=1, after_fork=None):
+    """
+    Serve a WSGI app until interrupted
+    The socket is bound once and processes - 1 children are forked to accept
+    on it alongside this one, so anything the app built beforehand is shared.
+    Args:
+        app: WSGI application, e.g. from app.create_app()
+        threads: request threads per process
+        processes: serving processes, including this one
+        after_fork: optional callable run in each child before it serves,
+            to give it state of its own
+    """
+    server = PooledWSGIServer(host, port, app, threads)
+    server.multiprocess = processes > 1
+    # Exit through the finally blocks below on SIGTERM, in children too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    children = []
+    for _ in range(processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                if after_fork is not None:
+                    after_fork()
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    try:
+        server.serve_forever()
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            os.waitpid(pid, 0)
+
+
+def main(argv=None):
+    start = time.perf_counter()
+    parser = argparse.ArgumentParser(prog='python -m utils.serve',
+                                     description='Serve LUTor with a thread pool and optional worker processes.')
+    parser.add_argument('--host', default='0.0.0.0', help='interface to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=5001, help='port to listen on (default: 5001)')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help=f'request threads per process (default: {DEFAULT_THREADS})')
+    parser.add_argument('--processes', type=int, default=1, help='serving processes (default: 1)')
+    parser.add_argument('--per-process-state', action='store_true',
+                        help='allow --processes > 1 although image IDs and jobs are per process')
+    args = parser.parse_args(argv)
+    if args.threads < 1 or args.processes < 1:
+        parser.error('--threads and --processes must be at least 1')
+    if args.processes > 1 and not hasattr(os, 'fork'):
+        parser.error('--processes needs os.fork, which this platform lacks')
+    if args.processes > 1 and not args.per_process_state:
+        parser.error('--processes > 1 splits image IDs, export jobs and curves between processes, '
+                     'which the web UI relies on; scale with --threads, or pass --per-process-state '
+                     'for clients that resend their images')
+
+    import app as lutor
+    app = lutor.create_app()
+    print(f"🚀 Ready in {(time.perf_counter() - start) * 1000:.0f}ms: http://{args.host}:{args.port} "
+          f"({args.processes} process(es) x {args.threads} threads)")
+    serve(app, args.host, args.port, args.threads, args.processes, after_fork=lutor.init_process)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
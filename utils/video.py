@@ -0,0 +1,295 @@
+"""
+Video grading for LUTor
+Streams a clip or an image sequence through one style, frame by frame.
+Decoding, grading and encoding run as separate stages joined by bounded
+queues, so memory use stays constant however long the clip is.
+
+Usage:
+    python -m utils.video STYLE INPUT OUTPUT [--strength S] [--fps N] [--codec mp4v]
+
+STYLE is a preset ID, a style image or a .cube/.npy LUT, as for utils.batch.
+INPUT is a video file or a directory of frames; OUTPUT is a video file, or a
+directory to write a PNG sequence into.
+"""
+
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+import cv2
+from PIL import Image
+
+from .batch import TRANSFER_MODES, load_style, transform_for
+from .presets import IMAGE_EXTENSIONS, PRESETS
+from .render import LUTTransform
+
+
+# Output container -> default FourCC
+VIDEO_CODECS = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.mov': 'mp4v', '.mkv': 'mp4v', '.avi': 'MJPG'}
+DEFAULT_FPS = 24.0
+QUEUE_FRAMES = 8  # frames buffered between stages
+
+_DONE = object()
+
+
+# --- SOURCES AND SINKS ---
+
+class FrameSource:
+    """BGR frames of a video file or of a directory of images, in order"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._capture = None
+        if self.path.is_dir():
+            self.files = sorted(p for p in self.path.iterdir()
+                                if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+            if not self.files:
+                raise ValueError(f"No frames found in {self.path}")
+            self.fps = None
+            self.frame_count = len(self.files)
+        else:
+            self._capture = cv2.VideoCapture(str(self.path))
+            if not self._capture.isOpened():
+                raise ValueError(f"Cannot open video {self.path}")
+            self.fps = self._capture.get(cv2.CAP_PROP_FPS) or None
+            count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.frame_count = count if count > 0 else None
+
+    def frames(self):
+        if self._capture is None:
+            size = None
+            for path in self.files:
+                frame = cv2.imread(str(path), cv2.IMREAD_COLOR)
+                if frame is None:
+                    raise ValueError(f"Cannot decode frame {path}")
+                # A video writer silently drops frames of another size
+                if size is None:
+                    size = frame.shape[:2]
+                elif frame.shape[:2] != size:
+                    raise ValueError(f"Frame {path} is {frame.shape[1]}x{frame.shape[0]}, "
+                                     f"the sequence is {size[1]}x{size[0]}")
+                yield frame
+            return
+        while True:
+            ok, frame = self._capture.read()
+            if not ok:
+                return
+            yield frame
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.release()
+
+
+class FrameSink:
+    """Write BGR frames to a video file, or as a numbered PNG sequence into a directory"""
+
+    def __init__(self, path, fps, codec=None):
+        self.path = Path(path)
+        self.fps = fps
+        suffix = self.path.suffix.lower()
+        self.is_video = suffix in VIDEO_CODECS
+        self.codec = codec or VIDEO_CODECS.get(suffix)
+        self._writer = None
+        self._size = None
+        self.count = 0
+        if not self.is_video:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def write(self, frame):
+        if not self.is_video:
+            cv2.imwrite(str(self.path / f'frame_{self.count:06d}.png'), frame)
+        else:
+            if self._writer is None:
+                # The frame size is only known once the first frame arrives
+                height, width = frame.shape[:2]
+                self._writer = cv2.VideoWriter(str(self.path), cv2.VideoWriter_fourcc(*self.codec),
+                                               self.fps, (width, height))
+                if not self._writer.isOpened():
+                    raise ValueError(f"Cannot write {self.path} with codec {self.codec}")
+                self._size = frame.shape[:2]
+            elif frame.shape[:2] != self._size:
+                # cv2.VideoWriter would drop it without an error
+                raise ValueError(f"Frame {self.count} is {frame.shape[1]}x{frame.shape[0]}, "
+                                 f"{self.path} is {self._size[1]}x{self._size[0]}")
+            self._writer.write(frame)
+        self.count += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+
+
+# --- PIPELINE ---
+
+def clip_transform(spec, frame, workers=None):
+    """
+    Transform for a whole clip, fixed from its first frame
+    Histogram and LAB statistics styles adapt to the content; deriving them
+    once keeps the grade from flickering between frames.
+    Args:
+        spec: style spec from batch.load_style / style_spec_from_*
+        frame: first frame, (H, W, 3) uint8 RGB
+        workers: threads for LUT application, defaults to the CPU count
+    """
+    if spec['kind'] == 'lut':
+        return LUTTransform(spec['lut'], spec['method'], workers=workers)
+    return transform_for(spec, Image.fromarray(frame))
+
+
+def _put(q, item, stop):
+    """Put unless the pipeline is stopping; returns False if it is"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    """Next item, or _DONE once the pipeline is stopping"""
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return _DONE
+
+
+def grade_video(spec, source, output, fps=None, codec=None, queue_frames=QUEUE_FRAMES,
+                workers=None, progress=None):
+    """
+    Grade every frame of a clip with a style
+    The decoder and grader run in their own threads and the encoder in the
+    calling thread; at most queue_frames frames wait between two stages.
+    Args:
+        spec: style spec from batch.load_style / style_spec_from_*
+        source: video file or frame directory path
+        output: video file path (container from its suffix) or output directory
+        fps: output frame rate, defaults to the source's or DEFAULT_FPS
+        codec: FourCC, defaults per container (see VIDEO_CODECS)
+        progress: optional callback(done, total or None, elapsed); it may
+            raise to abort the run
+    Returns:
+        report dict with the frame count, frames/sec and per-stage busy time
+    """
+    source = FrameSource(source)
+    sink = FrameSink(output, fps or source.fps or DEFAULT_FPS, codec)
+    decoded = queue.Queue(maxsize=queue_frames)
+    graded = queue.Queue(maxsize=queue_frames)
+    stop = threading.Event()
+    errors = []
+    busy = {'decode': 0.0, 'grade': 0.0, 'encode': 0.0}
+
+    def decode():
+        try:
+            frames = source.frames()
+            while True:
+                t = time.perf_counter()
+                frame = next(frames, _DONE)
+                busy['decode'] += time.perf_counter() - t
+                if frame is _DONE or not _put(decoded, frame, stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(decoded, _DONE, stop)
+
+    def grade():
+        transform = None
+        try:
+            while True:
+                frame = _get(decoded, stop)
+                if frame is _DONE:
+                    break
+                t = time.perf_counter()
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                if transform is None:
+                    transform = clip_transform(spec, rgb, workers)
+                frame = cv2.cvtColor(transform(rgb), cv2.COLOR_RGB2BGR)
+                busy['grade'] += time.perf_counter() - t
+                if not _put(graded, frame, stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(graded, _DONE, stop)
+
+    threads = [threading.Thread(target=decode, name='lutor-video-decode', daemon=True),
+               threading.Thread(target=grade, name='lutor-video-grade', daemon=True)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            frame = _get(graded, stop)
+            if frame is _DONE:
+                break
+            t = time.perf_counter()
+            sink.write(frame)
+            busy['encode'] += time.perf_counter() - t
+            if progress is not None:
+                progress(sink.count, source.frame_count, time.perf_counter() - start)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        source.close()
+        sink.close()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - start
+    return {
+        'frames': sink.count,
+        'seconds': round(elapsed, 3),
+        'frames_per_second': round(sink.count / elapsed, 3) if elapsed > 0 else 0.0,
+        'fps': sink.fps,
+        'stage_seconds': {stage: round(seconds, 3) for stage, seconds in busy.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m utils.video',
+                                     description='Grade a video or frame sequence with a LUTor style.')
+    parser.add_argument('style', help='preset ID, style image or .cube/.npy LUT')
+    parser.add_argument('input', help='video file or directory of frames')
+    parser.add_argument('output', help='output video (e.g. .mp4, .avi) or a directory for PNG frames')
+    parser.add_argument('--strength', type=float, default=1.0, help='style strength (default: 1.0)')
+    parser.add_argument('--method', default='tetrahedral', choices=['trilinear', 'tetrahedral'],
+                        help='LUT interpolation for .cube styles')
+    parser.add_argument('--mode', default='histogram', choices=TRANSFER_MODES,
+                        help='style transfer for image styles: histogram matching or LAB statistics')
+    parser.add_argument('--fps', type=float, default=None, help='output frame rate (default: the input\'s)')
+    parser.add_argument('--codec', default=None, help='FourCC, e.g. mp4v or MJPG (default: per container)')
+    parser.add_argument('--queue', type=int, default=QUEUE_FRAMES, help='frames buffered between stages')
+    parser.add_argument('--presets', metavar='DIR', help='register extra presets from a directory')
+    args = parser.parse_args(argv)
+
+    if args.presets:
+        PRESETS.load_directory(args.presets)
+    spec = load_style(args.style, args.strength, args.method, args.mode)
+
+    def progress(done, total, elapsed):
+        if done % 25 and done != total:
+            return
+        rate = done / elapsed if elapsed > 0 else 0.0
+        of_total = f"/{total}" if total else ""
+        print(f"[{done}{of_total}] {rate:.1f} frames/s", file=sys.stderr)
+
+    report = grade_video(spec, args.input, args.output, args.fps, args.codec, args.queue,
+                         progress=progress)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
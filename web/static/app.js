@@ -5,12 +5,51 @@ class LUTorApp {
         this.contentImage = null;
         this.styleImage = null;
         this.resultImage = null;
+        // Server-side image IDs; the data URIs above are only a fallback
+        this.contentImageId = null;
+        this.styleImageId = null;
+        this.resultImageId = null;
+        this.stylePresetId = null;
+        // Strength and look the server's result was rendered at
+        this.resultStrength = null;
+        this.resultKey = null;
+        // Full-strength look for previewing strength changes locally
+        this.previewLut = null;
+        this.previewLutKey = null;
+        // Downloaded exports by request, revalidated with their ETag
+        this.exportCache = new Map();
         this.init();
     }
 
     init() {
         this.setupEventListeners();
         this.setupDragAndDrop();
+        this.loadPresetStyles();
+    }
+
+    async loadPresetStyles() {
+        // Add buttons for presets registered on the server beyond the built-in ones
+        try {
+            const response = await fetch('/api/preset_styles');
+            const result = await response.json();
+            const grid = document.querySelector('.preset-style-btn').parentElement;
+            for (const style of result.styles) {
+                if (style.builtin || document.querySelector(`[data-style="${style.id}"]`)) {
+                    continue;
+                }
+                const btn = document.createElement('button');
+                btn.className = 'preset-style-btn p-3 border rounded-lg hover:bg-blue-50 hover:border-blue-300 transition-colors';
+                btn.dataset.style = style.id;
+                btn.title = style.description;
+                btn.innerHTML = '<div class="w-full h-20 bg-gradient-to-r from-gray-300 to-gray-500 rounded mb-2"></div>'
+                    + '<p class="text-sm font-medium"></p>';
+                btn.querySelector('p').textContent = style.name;
+                btn.addEventListener('click', () => this.selectPresetStyle(style.id));
+                grid.appendChild(btn);
+            }
+        } catch (error) {
+            // The built-in presets in the page still work
+        }
     }
 
     setupEventListeners() {
@@ -44,6 +83,12 @@ class LUTorApp {
         const strengthValue = document.getElementById('strength-value');
         strengthSlider.addEventListener('input', (e) => {
             strengthValue.textContent = e.target.value;
+            this.scheduleStrengthUpdate();
+        });
+
+        // Transfer mode: re-render an existing result with the other algorithm
+        document.getElementById('transfer-mode').addEventListener('change', () => {
+            this.scheduleStrengthUpdate();
         });
 
         // Process button
@@ -56,6 +101,10 @@ class LUTorApp {
             this.downloadImage();
         });
 
+        document.getElementById('download-full').addEventListener('click', () => {
+            this.downloadFullResolution();
+        });
+
         document.getElementById('export-lut').addEventListener('click', () => {
             this.exportLUT();
         });
@@ -122,6 +171,7 @@ class LUTorApp {
             
             if (result.success) {
                 this.contentImage = result.image;
+                this.contentImageId = result.image_id;
                 this.displayContentImage(result.image);
                 this.updateProcessButton();
             } else {
@@ -153,6 +203,8 @@ class LUTorApp {
             
             if (result.success) {
                 this.styleImage = result.image;
+                this.styleImageId = result.image_id;
+                this.stylePresetId = null;
                 this.displayStyleImage(result.image);
                 this.updateProcessButton();
                 this.clearPresetSelection();
@@ -190,6 +242,8 @@ class LUTorApp {
             
             if (result.success) {
                 this.styleImage = result.style_image;
+                this.styleImageId = result.style_image_id;
+                this.stylePresetId = result.style_preset_id;
                 this.displayStyleImage(result.style_image);
                 this.updateProcessButton();
             } else {
@@ -209,26 +263,11 @@ class LUTorApp {
         try {
             this.showProcessing();
             
-            const strength = document.getElementById('strength-slider').value;
-            
-            const response = await fetch('/api/style_transfer', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    content_image: this.contentImage,
-                    style_image: this.styleImage,
-                    strength: parseFloat(strength)
-                })
-            });
-
-            const result = await response.json();
+            const result = await this.fetchResult();
             
             if (result.success) {
-                this.resultImage = result.stylized_image;
-                this.displayResult(result.stylized_image);
                 this.showExportOptions();
+                this.loadPreviewLut();
             } else {
                 this.showError(result.error);
             }
@@ -239,6 +278,231 @@ class LUTorApp {
         }
     }
 
+    scheduleStrengthUpdate() {
+        // Once a result exists, re-render as the slider moves. With the
+        // look's LUT at hand this is a local blend; otherwise the server
+        // re-blends its cached matched image.
+        if (!this.resultImage) {
+            return;
+        }
+        if (this.previewLut && this.previewLut.key === this.lookKey()) {
+            cancelAnimationFrame(this.previewFrame);
+            this.previewFrame = requestAnimationFrame(() => this.renderPreview());
+            return;
+        }
+        clearTimeout(this.strengthTimer);
+        this.strengthTimer = setTimeout(() => this.updateStrength(), 60);
+    }
+
+    async updateStrength() {
+        // Keep at most one request in flight; coalesce ticks that arrive meanwhile
+        if (this.strengthInFlight) {
+            this.strengthPending = true;
+            return;
+        }
+        this.strengthInFlight = true;
+
+        try {
+            const result = await this.fetchResult();
+            if (result.success) {
+                this.loadPreviewLut();
+            }
+        } catch (error) {
+            // Ignore; the next slider tick or the process button will retry
+        } finally {
+            this.strengthInFlight = false;
+            if (this.strengthPending) {
+                this.strengthPending = false;
+                this.updateStrength();
+            }
+        }
+    }
+
+    lookKey() {
+        // Everything the full-strength look depends on
+        return [this.contentImageId, this.styleImageId, this.stylePresetId,
+                document.getElementById('transfer-mode').value].join('|');
+    }
+
+    async fetchResult() {
+        // Render the result on the server at the current strength
+        const strength = parseFloat(document.getElementById('strength-slider').value);
+        const key = this.lookKey();
+        const response = await this.postWithImages('/api/style_transfer', {
+            content_image: [this.contentImageId, this.contentImage],
+            style_image: [this.styleImageId, this.styleImage]
+        }, {
+            style_preset_id: this.stylePresetId,
+            strength: strength,
+            transfer_mode: document.getElementById('transfer-mode').value
+        });
+
+        const result = await response.json();
+        if (result.success) {
+            this.resultImage = result.stylized_image;
+            this.resultImageId = result.stylized_image_id;
+            this.resultStrength = strength;
+            this.resultKey = key;
+            this.displayResult(result.stylized_image);
+        }
+        return result;
+    }
+
+    async syncResult() {
+        // Local previews leave the server's result at an older strength;
+        // bring it up to date before anything exports it
+        const strength = parseFloat(document.getElementById('strength-slider').value);
+        if (this.resultStrength !== strength || this.resultKey !== this.lookKey()) {
+            const result = await this.fetchResult();
+            if (!result.success) {
+                throw new Error(result.error);
+            }
+        }
+    }
+
+    async loadPreviewLut() {
+        // Fetch the look once per content, style and mode, and grade the
+        // content preview with it; strength changes then only re-blend
+        const key = this.lookKey();
+        if (this.previewLutKey === key) {
+            return;  // loaded or loading
+        }
+        this.previewLutKey = key;
+        const failed = () => {
+            // Let the next change retry, unless a newer look is already loading
+            if (this.previewLutKey === key) {
+                this.previewLutKey = null;
+            }
+        };
+
+        try {
+            const response = await this.postWithImages('/api/preview_lut', {
+                content_image: [this.contentImageId, this.contentImage],
+                style_image: [this.styleImageId, this.styleImage]
+            }, {
+                style_preset_id: this.stylePresetId,
+                transfer_mode: document.getElementById('transfer-mode').value
+            });
+            if (!response.ok) {
+                failed();
+                return;
+            }
+            const lut = this.decodeHalfFloats(await response.arrayBuffer());
+            const size = parseInt(response.headers.get('X-LUT-Size'), 10);
+            const is1d = response.headers.get('X-LUT-Dimensions') === '1d';
+            const original = await this.loadPixels(this.contentImage);
+            if (this.lookKey() !== key) {
+                return;  // the look changed while loading
+            }
+            const graded = is1d ? this.applyLut1d(original.data, lut)
+                : this.applyLut3d(original.data, lut, size);
+            this.previewLut = { key, original, graded };
+        } catch (error) {
+            // Strength changes keep going through the server meanwhile
+            failed();
+        }
+    }
+
+    decodeHalfFloats(buffer) {
+        // Little-endian IEEE half floats; LUT values are finite and non-negative
+        const view = new DataView(buffer);
+        const values = new Float32Array(buffer.byteLength / 2);
+        for (let i = 0; i < values.length; i++) {
+            const half = view.getUint16(2 * i, true);
+            const exponent = (half >> 10) & 0x1f;
+            const mantissa = half & 0x3ff;
+            const value = exponent === 0 ? mantissa * 2 ** -24
+                : (1 + mantissa / 1024) * 2 ** (exponent - 15);
+            values[i] = half & 0x8000 ? -value : value;
+        }
+        return values;
+    }
+
+    loadPixels(src) {
+        return new Promise((resolve, reject) => {
+            const img = new Image();
+            img.onload = () => {
+                const canvas = document.createElement('canvas');
+                canvas.width = img.naturalWidth;
+                canvas.height = img.naturalHeight;
+                const context = canvas.getContext('2d');
+                context.drawImage(img, 0, 0);
+                resolve(context.getImageData(0, 0, canvas.width, canvas.height));
+            };
+            img.onerror = () => reject(new Error('Cannot decode the content image'));
+            img.src = src;
+        });
+    }
+
+    applyLut1d(pixels, lut) {
+        // (256, 3) per-channel LUT: three lookup tables
+        const tables = new Uint8ClampedArray(3 * 256);
+        for (let v = 0; v < 256; v++) {
+            for (let c = 0; c < 3; c++) {
+                tables[c * 256 + v] = lut[v * 3 + c] * 255;
+            }
+        }
+        const graded = new Uint8ClampedArray(pixels.length);
+        for (let i = 0; i < pixels.length; i += 4) {
+            graded[i] = tables[pixels[i]];
+            graded[i + 1] = tables[256 + pixels[i + 1]];
+            graded[i + 2] = tables[512 + pixels[i + 2]];
+            graded[i + 3] = 255;
+        }
+        return graded;
+    }
+
+    applyLut3d(pixels, lut, size) {
+        // (size, size, size, 3) LUT indexed [r, g, b], trilinear interpolation
+        const scale = (size - 1) / 255;
+        const strideR = size * size * 3;
+        const strideG = size * 3;
+        const graded = new Uint8ClampedArray(pixels.length);
+        for (let i = 0; i < pixels.length; i += 4) {
+            const r = pixels[i] * scale, g = pixels[i + 1] * scale, b = pixels[i + 2] * scale;
+            const r0 = Math.min(Math.floor(r), size - 2);
+            const g0 = Math.min(Math.floor(g), size - 2);
+            const b0 = Math.min(Math.floor(b), size - 2);
+            const fr = r - r0, fg = g - g0, fb = b - b0;
+            const base = r0 * strideR + g0 * strideG + b0 * 3;
+            for (let c = 0; c < 3; c++) {
+                const p = base + c;
+                const c00 = lut[p] + (lut[p + 3] - lut[p]) * fb;
+                const c01 = lut[p + strideG] + (lut[p + strideG + 3] - lut[p + strideG]) * fb;
+                const c10 = lut[p + strideR] + (lut[p + strideR + 3] - lut[p + strideR]) * fb;
+                const c11 = lut[p + strideR + strideG]
+                    + (lut[p + strideR + strideG + 3] - lut[p + strideR + strideG]) * fb;
+                const c0 = c00 + (c01 - c00) * fg;
+                const c1 = c10 + (c11 - c10) * fg;
+                graded[i + c] = (c0 + (c1 - c0) * fr) * 255;
+            }
+            graded[i + 3] = 255;
+        }
+        return graded;
+    }
+
+    renderPreview() {
+        // Blend the content preview with its full-strength grade, as the
+        // server does; strengths above 1 extrapolate
+        const { original, graded } = this.previewLut;
+        const strength = parseFloat(document.getElementById('strength-slider').value);
+        const canvas = document.getElementById('result-canvas');
+        if (canvas.width !== original.width || canvas.height !== original.height) {
+            canvas.width = original.width;
+            canvas.height = original.height;
+        }
+        const context = canvas.getContext('2d');
+        const output = context.createImageData(original.width, original.height);
+        const src = original.data;
+        const dst = output.data;
+        for (let i = 0; i < src.length; i++) {
+            dst[i] = src[i] + (graded[i] - src[i]) * strength;
+        }
+        context.putImageData(output, 0, 0);
+        canvas.classList.remove('hidden');
+        document.getElementById('result-image').classList.add('hidden');
+    }
+
     displayContentImage(imageData) {
         const preview = document.getElementById('content-preview');
         const prompt = document.getElementById('content-upload-prompt');
@@ -264,6 +528,7 @@ class LUTorApp {
         resultImage.src = imageData;
         resultImage.classList.remove('hidden');
         placeholder.classList.add('hidden');
+        document.getElementById('result-canvas').classList.add('hidden');
     }
 
     clearStyleImage() {
@@ -273,6 +538,34 @@ class LUTorApp {
         preview.classList.add('hidden');
         prompt.classList.remove('hidden');
         this.styleImage = null;
+        this.styleImageId = null;
+        this.stylePresetId = null;
+    }
+
+    async postWithImages(url, images, params = {}, headers = {}) {
+        // Send images by server-side ID; if the server has expired an ID
+        // (HTTP 410), retry once with the base64 data URIs instead.
+        const post = (useIds) => {
+            const body = { ...params };
+            for (const [field, [id, dataUri]] of Object.entries(images)) {
+                if (useIds && id) {
+                    body[field + '_id'] = id;
+                } else {
+                    body[field] = dataUri;
+                }
+            }
+            return fetch(url, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    ...headers
+                },
+                body: JSON.stringify(body)
+            });
+        };
+
+        const response = await post(true);
+        return response.status === 410 ? post(false) : response;
     }
 
     clearPresetSelection() {
@@ -295,6 +588,7 @@ class LUTorApp {
         document.getElementById('loading-state').classList.remove('hidden');
         document.getElementById('result-placeholder').classList.add('hidden');
         document.getElementById('result-image').classList.add('hidden');
+        document.getElementById('result-canvas').classList.add('hidden');
         document.getElementById('process-btn').disabled = true;
     }
 
@@ -312,12 +606,19 @@ class LUTorApp {
         // Could add loading indicators to specific elements
     }
 
-    downloadImage() {
+    async downloadImage() {
         if (!this.resultImage) {
             this.showError('没有可下载的图片');
             return;
         }
 
+        try {
+            await this.syncResult();
+        } catch (error) {
+            this.showError('下载失败: ' + error.message);
+            return;
+        }
+
         // Create download link
         const link = document.createElement('a');
         link.href = this.resultImage;
@@ -327,73 +628,126 @@ class LUTorApp {
         document.body.removeChild(link);
     }
 
-    async exportLUT() {
-        if (!this.contentImage || !this.resultImage) {
+    async downloadFullResolution() {
+        if (!this.contentImageId || !this.styleImage) {
             this.showError('没有可导出的内容');
             return;
         }
 
         try {
-            const response = await fetch('/api/export_lut', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    original_image: this.contentImage,
-                    stylized_image: this.resultImage
-                })
+            const format = document.getElementById('full-res-format').value;
+            const strength = document.getElementById('strength-slider').value;
+            const response = await this.postWithImages('/api/export_full', {
+                style_image: [this.styleImageId, this.styleImage]
+            }, {
+                content_image_id: this.contentImageId,
+                style_preset_id: this.stylePresetId,
+                strength: parseFloat(strength),
+                transfer_mode: document.getElementById('transfer-mode').value,
+                format: format
             });
 
             if (response.ok) {
-                // Trigger download
-                const blob = await response.blob();
-                const url = window.URL.createObjectURL(blob);
-                const link = document.createElement('a');
-                link.href = url;
-                link.download = 'lutor_style_transfer.cube';
-                document.body.appendChild(link);
-                link.click();
-                document.body.removeChild(link);
-                window.URL.revokeObjectURL(url);
+                const extensions = { png: 'png', tiff: 'tif', jpeg: 'jpg' };
+                this.saveBlob(await response.blob(), 'lutor_full_resolution.' + extensions[format]);
             } else {
                 const result = await response.json();
                 this.showError(result.error);
             }
         } catch (error) {
-            this.showError('导出 LUT 失败: ' + error.message);
+            this.showError('导出全分辨率图片失败: ' + error.message);
         }
     }
 
-    async exportXMP() {
+    saveBlob(blob, filename) {
+        const url = window.URL.createObjectURL(blob);
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = filename;
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
+        window.URL.revokeObjectURL(url);
+    }
+
+    async exportLUT() {
         if (!this.contentImage || !this.resultImage) {
             this.showError('没有可导出的内容');
             return;
         }
 
+        // LUT fitting can take a while: run it as a background job and
+        // show its progress on the button while polling
+        const button = document.getElementById('export-lut');
+        const label = button.innerHTML;
+        button.disabled = true;
+
         try {
-            const response = await fetch('/api/export_xmp', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    original_image: this.contentImage,
-                    stylized_image: this.resultImage
-                })
+            await this.syncResult();
+            const response = await this.postWithImages('/api/jobs/export_lut', {
+                original_image: [this.contentImageId, this.contentImage],
+                stylized_image: [this.resultImageId, this.resultImage]
             });
+            let job = await response.json();
+            if (!response.ok) {
+                this.showError(job.error);
+                return;
+            }
 
-            if (response.ok) {
-                // Trigger download
+            while (job.status === 'queued' || job.status === 'running') {
+                button.textContent = `导出中 ${Math.round(job.progress * 100)}%`;
+                await new Promise(resolve => setTimeout(resolve, 500));
+                const status = await fetch(`/api/jobs/${job.job_id}`);
+                job = await status.json();
+                if (!status.ok) {
+                    this.showError(job.error);
+                    return;
+                }
+            }
+
+            if (job.status !== 'done') {
+                this.showError(job.error || job.status);
+                return;
+            }
+            const result = await fetch(`/api/jobs/${job.job_id}/result`);
+            if (result.ok) {
+                this.saveBlob(await result.blob(), 'lutor_style_transfer.cube');
+            } else {
+                this.showError((await result.json()).error);
+            }
+        } catch (error) {
+            this.showError('导出 LUT 失败: ' + error.message);
+        } finally {
+            button.innerHTML = label;
+            button.disabled = false;
+        }
+    }
+
+    async exportXMP() {
+        if (!this.contentImage || !this.resultImage) {
+            this.showError('没有可导出的内容');
+            return;
+        }
+
+        try {
+            await this.syncResult();
+            const cacheKey = `xmp|${this.contentImageId}|${this.resultImageId}`;
+            const cached = this.exportCache.get(cacheKey);
+            const response = await this.postWithImages('/api/export_xmp', {
+                original_image: [this.contentImageId, this.contentImage],
+                stylized_image: [this.resultImageId, this.resultImage]
+            }, {}, cached ? { 'If-None-Match': `"${cached.etag}"` } : {});
+
+            if (response.status === 304) {
+                // Unchanged since the last export: reuse the downloaded file
+                this.saveBlob(cached.blob, 'lutor_style_transfer.xmp');
+            } else if (response.ok) {
                 const blob = await response.blob();
-                const url = window.URL.createObjectURL(blob);
-                const link = document.createElement('a');
-                link.href = url;
-                link.download = 'lutor_style_transfer.xmp';
-                document.body.appendChild(link);
-                link.click();
-                document.body.removeChild(link);
-                window.URL.revokeObjectURL(url);
+                const etag = response.headers.get('X-Artifact-Key');
+                if (etag && this.contentImageId && this.resultImageId) {
+                    this.exportCache.set(cacheKey, { etag, blob });
+                }
+                this.saveBlob(blob, 'lutor_style_transfer.xmp');
             } else {
                 const result = await response.json();
                 this.showError(result.error);